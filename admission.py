@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBuckets():
+    # In-process token buckets. A bucket holds up to burst tokens and gains rate tokens per second,
+    # every admitted request takes one token from each of its buckets.
+    # The least recently used buckets are dropped past max_entries, a dropped bucket starts full again.
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, limits):
+        # limits is a list of (key, rate, burst). Returns 0 when a token was taken from every bucket,
+        # otherwise the seconds until each bucket has one, and no token is taken.
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate, burst in limits:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                levels.append(min(burst, tokens + (now - updated) * rate))
+            wait = max([(1 - tokens) / rate for tokens, (_, rate, _) in zip(levels, limits) if tokens < 1], default=0)
+            if wait:
+                return wait
+            for tokens, (key, _, _) in zip(levels, limits):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+            return 0
+
+
+class RedisTokenBuckets():
+    # Token buckets shared by every app process, stored in Redis hashes and updated atomically
+    # by one script call per request. Buckets expire once they would be full again.
+
+    SCRIPT = '''
+    local now = tonumber(ARGV[1])
+    local levels = {}
+    local wait = 0
+    for i, key in ipairs(KEYS) do
+        local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+        local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        levels[i] = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        if levels[i] < 1 then
+            wait = math.max(wait, (1 - levels[i]) / rate)
+        end
+    end
+    if wait == 0 then
+        for i, key in ipairs(KEYS) do
+            local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+            redis.call('HSET', key, 'tokens', levels[i] - 1, 'updated', now)
+            redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+        end
+    end
+    return tostring(wait)
+    '''
+
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(self.SCRIPT)
+
+    def take(self, limits):
+        args = [time.time()]
+        for _, rate, burst in limits:
+            args += [rate, burst]
+        return float(self._script(keys=[f'ratelimit:{key}' for key, _, _ in limits], args=args))
+
+
+def parse_limit(value):
+    # 'rate:burst' in requests per second, burst defaults to rate. Empty or 0 is no limit.
+    if not value:
+        return None
+    rate, _, burst = value.partition(':')
+    rate, burst = float(rate), float(burst or rate)
+    return (rate, max(burst, 1)) if rate > 0 else None
+
+def parse_endpoint_limits(value):
+    # Comma separated 'METHOD /rule=rate:burst'
+    limits = {}
+    for item in value.split(','):
+        if item.strip():
+            endpoint, _, limit = item.rpartition('=')
+            limits[endpoint.strip()] = parse_limit(limit.strip())
+    return {endpoint: limit for endpoint, limit in limits.items() if limit is not None}
+
+
+class RateLimiter():
+    # Token bucket limits of every client, identified by its address, and of single endpoints
+    # ('GET /api/recipe') across all clients. A request over either limit is rejected right away.
+    # Behind a proxy every client has the proxy's address unless PROXY_FIX_X_FOR is set.
+
+    def __init__(self, backend, client_limit=None, endpoint_limits=None, enabled=True):
+        self.backend = backend
+        self.client_limit = client_limit
+        self.endpoint_limits = endpoint_limits or {}
+        self.enabled = enabled
+
+    def retry_after(self, client, endpoint):
+        # Take a token for the request, returns 0 when it is admitted or the seconds the client should wait
+        if not self.enabled:
+            return 0
+        limits = []
+        if self.client_limit is not None:
+            limits.append((f'client:{client}', *self.client_limit))
+        if endpoint in self.endpoint_limits:
+            limits.append((f'endpoint:{endpoint}', *self.endpoint_limits[endpoint]))
+        return self.backend.take(limits) if limits else 0
+
+
+class ConcurrencyLimiter():
+    # At most limit requests run at once. Up to queue_size more wait, for at most queue_timeout
+    # seconds, for one of them to finish. Requests finding the queue full are rejected right away,
+    # so an overload of expensive requests is shed instead of piling up on the database.
+    # The limit is per app process, 0 is no limit.
+
+    def __init__(self, limit, queue_size=0, queue_timeout=0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        # True when the request may run, it has to call release once it is done
+        with self._condition:
+            if not self.limit or self.running < self.limit:
+                self.running += 1
+                return True
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self.running < self.limit, self.queue_timeout):
+                    return False
+                self.running += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.running -= 1
+            self._condition.notify()
+
+
+def build_backend():
+    if os.getenv('RATE_LIMIT_BACKEND', 'memory') == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATE_LIMIT_BACKEND=redis requires the redis package')
+        return RedisTokenBuckets(redis.Redis.from_url(os.getenv('RATE_LIMIT_REDIS_URL', os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'))))
+    return TokenBuckets(max_entries=int(os.getenv('RATE_LIMIT_MAX_CLIENTS', 10000)))
+
+
+# Proxies in front of the app appending the address they received a request from to X-Forwarded-For,
+# 0 when clients connect directly. The app is wrapped in werkzeug's ProxyFix with x_for set to it.
+PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', 0))
+
+def forwarded_client(remote_addr, forwarded_for, trusted=PROXY_FIX_X_FOR):
+    # Client address as ProxyFix(x_for=trusted) sets REMOTE_ADDR, for the requests not passing through it
+    values = [value.strip() for value in (forwarded_for or '').split(',')]
+    if trusted and len(values) >= trusted and values[-trusted]:
+        return values[-trusted]
+    return remote_addr
+
+
+# Endpoints whose requests may scan or serialize many rows, they share the concurrency limit
+EXPENSIVE_ENDPOINTS = {endpoint.strip() for endpoint in os.getenv('ADMISSION_EXPENSIVE_ENDPOINTS', ','.join([
+    'GET /api/recipe',
+    'GET /api/recipe/search',
+    'GET /api/recipe/search/bahan',
+    'POST /api/recipe/shopping-list',
+    'GET /api/bahan/export',
+    'GET /api/kategori/export',
+    'GET /api/recipe/export',
+    'POST /api/bahan/import',
+    'POST /api/kategori/import',
+    'POST /api/recipe/import',
+])).split(',') if endpoint.strip()}
+# Query parameter of an expensive endpoint looking rows up by id. Such requests read a bounded batch
+# of rows, only the listing and filtering requests of the endpoint are expensive.
+ID_LOOKUPS = {'GET /api/recipe': 'id_recipe'}
+
+def is_expensive(endpoint, args):
+    if endpoint not in EXPENSIVE_ENDPOINTS:
+        return False
+    return endpoint not in ID_LOOKUPS or ID_LOOKUPS[endpoint] not in args
+
+rate_limiter = RateLimiter(
+    build_backend(),
+    client_limit=parse_limit(os.getenv('RATE_LIMIT_CLIENT', '')),
+    endpoint_limits=parse_endpoint_limits(os.getenv('RATE_LIMIT_ENDPOINTS', '')),
+    enabled=os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+)
+expensive_requests = ConcurrencyLimiter(
+    int(os.getenv('ADMISSION_MAX_CONCURRENT', 8)),
+    queue_size=int(os.getenv('ADMISSION_QUEUE_SIZE', 16)),
+    queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2))
+)
@@ -1,92 +1,202 @@
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from flask_restx import Api, Resource, reqparse
+from werkzeug.middleware.proxy_fix import ProxyFix
 from peewee import *
-from playhouse.shortcuts import model_to_dict
 from pydantic import ValidationError
 
 # Import Schema
 
-from schemas.recipe_schema import RecipeSchema, RecipeUpdateSchema, RecipeDeleteSchema
+from schemas.recipe_schema import RecipeSchema, RecipeUpdateSchema, RecipeDeleteSchema, ShoppingListSchema
 from schemas.bahan_schema import BahanCreateSchema, BahanUpdateSchema, BahanDeleteSchema
 from schemas.kategori_schema import KategoriCreateSchema, KategoriUpdateSchema, KategoriDeleteSchema
+from schemas.job_schema import JobCreateSchema
+
+from models import database, init_database, Bahan, Kategori, Recipe, RecipeBahan
+from migrations import backfill, run as run_migrations
+from serializers import serialize_recipes
+from cache import response_cache
+from json_encoder import output_json, stream_list_json, streamed_json
+from representations import JSON, REPRESENTATIONS, negotiate
+from etag import table_versions, data_changed, recipes_changed
+from search_index import bahan_index
+from text_search import text_index
+from recipe_documents import recipe_documents, document_json, document_list_json, document_batch_json, encode_documents
+from repository import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_BATCH_SIZE, RECIPE_FIELDS, RECIPE_RELATIONS, InUse, id_list, field_list, shopping_list, bahan_repository, kategori_repository, recipe_repository
+from instrumentation import metrics, start_request, finish_request, profile_report
+from bulk import read_rows, import_named, import_recipes, export_named, export_recipes, ndjson_response
+from jobs import job_queue, UnknownJob
+from admission import PROXY_FIX_X_FOR, is_expensive, rate_limiter, expensive_requests
+from compression import compress_response
+
+import itertools
+import math
+import os
+import time
+
+
+# Requests are admitted before they borrow a database connection, so a rejected request costs none.
+# Clients over their rate limit get a 429, expensive requests over the concurrency limit and its queue a 503.
+# The client is the address ProxyFix forwards, the listing and filtering requests of EXPENSIVE_ENDPOINTS are expensive.
+def admit_request():
+    endpoint = f'{request.method} {request.url_rule.rule}' if request.url_rule else None
+    retry_after = rate_limiter.retry_after(request.remote_addr, endpoint)
+    if retry_after:
+        return output_json(ResponseSchema.ResponseJson(success=False, message='Too Many Requests', data=None), 429, {'Retry-After': str(math.ceil(retry_after))})
+    if is_expensive(endpoint, request.args):
+        if not expensive_requests.acquire():
+            return output_json(ResponseSchema.ResponseJson(success=False, message='Server Busy', data=None), 503, {'Retry-After': '1'})
+        g.expensive_request = True
+
+def release_request(exc):
+    if g.pop('expensive_request', False):
+        expensive_requests.release()
+
+# Every request borrows a connection from the pool and returns it when the request ends
+def open_database_connection():
+    database.connect(reuse_if_open=True)
+
+def close_database_connection(exc):
+    database.read_from_primary()
+    if not database.is_closed():
+        database.close()
+
+# Seconds during which a client that wrote reads from the primary, so it sees its own writes
+# while the replicas catch up. The deadline is kept in a cookie set on every successful write.
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+STICKY_COOKIE = 'read_primary_until'
+
+# Smallest page size of the bahan, kategori and recipe lists that is streamed
+STREAM_MIN_ROWS = int(os.getenv('STREAM_MIN_ROWS', 500))
+
+def reads_primary():
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+# GET requests read from a replica when replicas are configured, writes always go to the primary.
+# g.reads_replica keeps their possibly stale responses out of the response cache and off version ETags.
+def route_reads_to_replica():
+    if request.method in ('GET', 'HEAD') and not reads_primary():
+        g.reads_replica = database.read_from_replica() is not None
+
+def stick_to_primary(response):
+    if request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400 and database.replicas:
+        response.set_cookie(STICKY_COOKIE, str(time.time() + REPLICA_STICKY_SECONDS), max_age=math.ceil(REPLICA_STICKY_SECONDS), httponly=True)
+    return response
+
+# Count and time the SQL of every request, ?profile=1 returns a cProfile report when PROFILING_ENABLED=1
+def start_request_stats():
+    g.request_stats = start_request(profile=request.args.get('profile') == '1')
+
+def finish_request_stats(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    response.headers['Server-Timing'] = finish_request(stats, request.method, endpoint, response.status_code)
+    if hasattr(stats, 'profiler'):
+        return Response(profile_report(stats), mimetype='text/plain')
+    return response
+
+def prometheus_metrics():
+    return Response(metrics.render(database.pool_metrics()), mimetype='text/plain; version=0.0.4')
 
-import dotenv, os
 
+class ResponseSchema():
+    def ResponseJson(success: bool = True, message: str = None, data: dict|list = None, error : dict|list = None):
+        return {
+            'success': success,
+            'message': message,
+            'data': data,
+            'error': error
+        }
 
-dotenv.load_dotenv()
-
-# SQLITE
-# db = 'mydatabase.db'
-# database = SqliteDatabase(db)
-
-# MySQL PRODUCTION
-# database = MySQLDatabase(os.getenv('DATABASE_NAME'), user=os.getenv('DATABASE_PROD_USER'), password=os.getenv('DATABASE_PROD_PASSWORD'), host=os.getenv('DATABASE_PROD_HOST'), port=int(os.getenv('DATABASE_PROD_PORT')))
+    def ResponseListJson(success: bool = True, message: str = None, data: list = None, next_cursor: int = None):
+        response = ResponseSchema.ResponseJson(success=success, message=message, data=data)
+        response['next_cursor'] = next_cursor
+        return response
 
-# MySQL DEV
-database = MySQLDatabase(os.getenv('DATABASE_NAME'), user=os.getenv('DATABASE_DEV_USER'), host=os.getenv('DATABASE_DEV_HOST'), port=int(os.getenv('DATABASE_DEV_PORT')))
 
-class BaseModel(Model):
-    class Meta:
-        database = database
+def add_pagination_arguments(parser):
+    parser.add_argument('limit', type=int, location='args')
+    parser.add_argument('after_id', type=int, location='args')
 
-class Bahan(BaseModel):
-    id = AutoField()
-    name = CharField(unique=True)
+def invalid_limit(args):
+    return args['limit'] is not None and args['limit'] < 1
 
-class Kategori(BaseModel):
-    id = AutoField()
-    name = CharField(unique=True)
+def streams(args):
+    # Pages of at least STREAM_MIN_ROWS rows are sent as they are read from the cursor instead of
+    # being built in memory, JSON only
+    return min(args['limit'] or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE) >= STREAM_MIN_ROWS and negotiate() == JSON
 
-class Recipe(BaseModel):
-    id = AutoField()
-    name = CharField()
-    description = TextField()
-    kategori = ForeignKeyField(Kategori, backref='recipes', column_name = 'id_kategori')
+def invalid_batch(ids):
+    return len(ids) > MAX_BATCH_SIZE
 
-class RecipeBahan(BaseModel):
-    id = AutoField()
-    recipe = ForeignKeyField(Recipe, backref='recipe_bahan', column_name = 'id_recipe')
-    bahan = ForeignKeyField(Bahan, backref='recipe_bahan', column_name = 'id_bahan')
-    quantity = IntegerField(null=True)
-    satuan = CharField()
+def batch_json(message, data, not_found):
+    # Response of a batch read: data in the order of the requested ids, null for the ids listed in error.not_found
+    return ResponseSchema.ResponseJson(success=True, message=message, data=data, error={'not_found': not_found} if not_found else None)
 
-def create_tables():
-    with database:
-        database.create_tables([Bahan, Kategori, Recipe, RecipeBahan])
+def missing_filter(args):
+    # A single recipe filter that matches nothing may not exist, which is only checked when the page is empty.
+    # Returns the name of the missing filter, or None.
+    if (args['id_kategori'] is None) == (args['id_bahan'] is None):
+        return None
+    if args['id_kategori'] is not None and not kategori_repository.exists(args['id_kategori']):
+        return 'Kategori'
+    if args['id_bahan'] is not None and not bahan_repository.exists(args['id_bahan']):
+        return 'Bahan'
+    return None
 
+# Query parameters read by the GET handlers, the response cache keys on them only
+PAGINATION_PARAMS = ('limit', 'after_id')
+BAHAN_PARAMS = ('id_bahan', *PAGINATION_PARAMS)
+KATEGORI_PARAMS = ('id_kategori', *PAGINATION_PARAMS)
+RECIPE_PARAMS = ('id_recipe', 'id_kategori', 'id_bahan', 'fields', 'include', *PAGINATION_PARAMS)
 
-app = Flask(__name__)
-api = Api(app)
+def bahan_cache_tags(data):
+    # Bahan lists are tagged 'bahan:list', a single bahan 'bahan:<id>'
+    return ['bahan:list'] if isinstance(data, list) else [f"bahan:{data['id']}"]
 
+def kategori_cache_tags(data):
+    return ['kategori:list'] if isinstance(data, list) else [f"kategori:{data['id']}"]
 
-class ResponseSchema():
-    def ResponseJson(success: bool = True, message: str = None, data: dict|list = None, error : dict|list = None):
-        return {
-            'success': success,
-            'message': message,
-            'data': data,
-            'error': error
-        }
+def recipe_cache_tags(data):
+    # Renaming a bahan or kategori refreshes the recipe documents that embed it,
+    # and invalidates those recipes through recipes_changed
+    return ['recipe:list'] if isinstance(data, list) else [f"recipe:{data['id']}"]
 
 class ResourceBahan(Resource):
+    @table_versions.conditional('bahan', ['bahan'])
+    @response_cache.cached('bahan', bahan_cache_tags, BAHAN_PARAMS)
     def get(self):
         # define the arguments to accept
         parser = reqparse.RequestParser()
-        parser.add_argument('id_bahan', type=int, location='args')
+        parser.add_argument('id_bahan', type=id_list, location='args')
+        add_pagination_arguments(parser)
         args = parser.parse_args()
+        # if id_bahan is a comma separated list, it will return every bahan in the order of the ids
+        if isinstance(args['id_bahan'], list):
+            if invalid_batch(args['id_bahan']):
+                return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+            bahan, not_found = bahan_repository.get_many(args['id_bahan'])
+            return batch_json('Bahan Found', bahan, not_found),200
         # if id_bahan in arguments, it will try to return Bahan with given id
         if args['id_bahan'] is not None:
-            # Get bahan with this id_bahan
-            bahan = Bahan.select().where(Bahan.id == args['id_bahan'])
-            # Check if bahan is exists. if bahan exists. it will return single record of bahan with given id
-            if not bahan.exists():
+            # Get bahan with this id_bahan, None if it doesn't exist
+            bahan = bahan_repository.get(args['id_bahan'])
+            if bahan is None:
                 return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
-            bahan = bahan.dicts().get()
             return ResponseSchema.ResponseJson(success=True, message='Bahan Found', data=bahan),200
         
-        # Get all bahan
-        bahan = list(Bahan.select().dicts())
-        return ResponseSchema.ResponseJson(success=True, message='Bahan Found', data=bahan),200
+        if invalid_limit(args):
+            return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+        # Get a page of bahan, large pages are streamed from the cursor
+        if streams(args):
+            return streamed_json(stream_list_json('Bahan Found', *bahan_repository.page_iterator(args)))
+        bahan, next_cursor = bahan_repository.page(args)
+        return ResponseSchema.ResponseListJson(success=True, message='Bahan Found', data=bahan, next_cursor=next_cursor),200
     
     def post(self):
         # define the required data to accept
@@ -96,8 +206,9 @@ class ResourceBahan(Resource):
             return ResponseSchema.ResponseJson(success=False, message='Bahan Not Created', data=None, error={"message":e.errors()}),400
         # Create new bahan
         try:
-            newBahan = Bahan.create(name=bahan.name)
-            return ResponseSchema.ResponseJson(success=True, message='Bahan Created', data=model_to_dict(newBahan)),201
+            newBahan = bahan_repository.create(bahan.name)
+            data_changed('bahan', 'bahan:list')
+            return ResponseSchema.ResponseJson(success=True, message='Bahan Created', data=newBahan),201
         except Exception as e:
             return ResponseSchema.ResponseJson(success=False, message='Bahan Not Created', data=None, error={"message":str(e)}),400
         
@@ -108,16 +219,14 @@ class ResourceBahan(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Bahan Not Updated', data=None, error={"message":e.errors()}),400
         
-        # Check bahan with given id_bahan exists
-        getBahan = Bahan.select().where(Bahan.id == bahan.id_bahan)
-        if not getBahan.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
-        
-        # Update bahan with given id_bahan
+        # Update bahan with given id_bahan, the update itself tells whether it exists
         try:
-            Bahan.update(name=bahan.name).where(Bahan.id == bahan.id_bahan).execute()
-            getBahan = Bahan.get(id = bahan.id_bahan)
-            return ResponseSchema.ResponseJson(success=True, message='Bahan Updated', data=model_to_dict(getBahan)),200
+            getBahan, id_recipes = bahan_repository.rename(bahan.id_bahan, bahan.name)
+            if getBahan is None:
+                return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
+            data_changed('bahan', 'bahan:list', f'bahan:{bahan.id_bahan}')
+            recipes_changed(id_recipes)
+            return ResponseSchema.ResponseJson(success=True, message='Bahan Updated', data=getBahan),200
         except Exception as e:
             return ResponseSchema.ResponseJson(success=False, message='Bahan Not Updated', data=None, error={"message":str(e)}),400
         
@@ -128,42 +237,48 @@ class ResourceBahan(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Bahan Not Deleted', data=None, error={"message":e.errors()}),400
         
-        # Check bahan with given id_bahan exists
-        getBahan = Bahan.select().where(Bahan.id == bahan.id_bahan)
-        if not getBahan.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
-        
-        # Check if bahan is used in recipe
-        recipe_bahan = RecipeBahan.select().where(RecipeBahan.id_bahan == bahan.id_bahan)
-        if recipe_bahan.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Bahan Used In Recipe', data=None),400
-
-        # Delete bahan with given id_bahan
+        # Delete bahan with given id_bahan unless it is used in a recipe
         try:
-            Bahan.delete().where(Bahan.id == bahan.id_bahan).execute()
+            if not bahan_repository.delete(bahan.id_bahan):
+                return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
+            data_changed('bahan', 'bahan:list', f'bahan:{bahan.id_bahan}')
             return ResponseSchema.ResponseJson(success=True, message='Bahan Deleted', data=None),200
+        except InUse:
+            return ResponseSchema.ResponseJson(success=False, message='Bahan Used In Recipe', data=None),400
         except Exception as e:
             return ResponseSchema.ResponseJson(success=False, message='Bahan Not Deleted', data=None, error={"message":str(e)}),400
 
 class ResourceKategori(Resource):
+    @table_versions.conditional('kategori', ['kategori'])
+    @response_cache.cached('kategori', kategori_cache_tags, KATEGORI_PARAMS)
     def get(self):
         # define the arguments to accept
         parser = reqparse.RequestParser()
-        parser.add_argument('id_kategori', type=int, location='args')
+        parser.add_argument('id_kategori', type=id_list, location='args')
+        add_pagination_arguments(parser)
         args = parser.parse_args()
+        # if id_kategori is a comma separated list, it will return every kategori in the order of the ids
+        if isinstance(args['id_kategori'], list):
+            if invalid_batch(args['id_kategori']):
+                return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+            kategori, not_found = kategori_repository.get_many(args['id_kategori'])
+            return batch_json('Kategori Found', kategori, not_found),200
         # if id_kategori in arguments, it will try to return Kategori with given id
         if args['id_kategori'] is not None:
-            # Get kategori with this id_kategori
-            kategori = Kategori.select().where(Kategori.id == args['id_kategori'])
-            # Check if kategori is exists. if kategori exists. it will return single record of kategori with given id
-            if not kategori.exists():
+            # Get kategori with this id_kategori, None if it doesn't exist
+            kategori = kategori_repository.get(args['id_kategori'])
+            if kategori is None:
                 return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
-            kategori = kategori.dicts().get()
             return ResponseSchema.ResponseJson(success=True, message='Kategori Found', data=kategori),200
         
-        # Get all kategori
-        kategori = list(Kategori.select().dicts())
-        return ResponseSchema.ResponseJson(success=True, message='Kategori Found', data=kategori),200
+        if invalid_limit(args):
+            return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+        # Get a page of kategori, large pages are streamed from the cursor
+        if streams(args):
+            return streamed_json(stream_list_json('Kategori Found', *kategori_repository.page_iterator(args)))
+        kategori, next_cursor = kategori_repository.page(args)
+        return ResponseSchema.ResponseListJson(success=True, message='Kategori Found', data=kategori, next_cursor=next_cursor),200
     
     def post(self):
         # define the required data to accept
@@ -174,8 +289,9 @@ class ResourceKategori(Resource):
 
         # Create new kategori
         try:
-            newKategori = Kategori.create(name=kategori.name)
-            return ResponseSchema.ResponseJson(success=True, message='Kategori Created', data=model_to_dict(newKategori)),201
+            newKategori = kategori_repository.create(kategori.name)
+            data_changed('kategori', 'kategori:list')
+            return ResponseSchema.ResponseJson(success=True, message='Kategori Created', data=newKategori),201
         except Exception as e:
             return ResponseSchema.ResponseJson(success=False, message='Kategori Not Created', data=None, error={"message":str(e)}),400
         
@@ -186,16 +302,14 @@ class ResourceKategori(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Kategori Not Updated', data=None, error=e.errors()),400
         
-        # Check kategori with given id_kategori exists
-        getKategori = Kategori.select().where(Kategori.id == kategori.id_kategori)
-        if not getKategori.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
-        
-        # Update kategori with given id_kategori
+        # Update kategori with given id_kategori, the update itself tells whether it exists
         try:
-            Kategori.update(name=kategori.name).where(Kategori.id == kategori.id_kategori).execute()
-            getKategori = Kategori.get(id = kategori.id_kategori)
-            return ResponseSchema.ResponseJson(success=True, message='Kategori Updated', data=model_to_dict(getKategori)),200
+            getKategori, id_recipes = kategori_repository.rename(kategori.id_kategori, kategori.name)
+            if getKategori is None:
+                return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
+            data_changed('kategori', 'kategori:list', f'kategori:{kategori.id_kategori}')
+            recipes_changed(id_recipes)
+            return ResponseSchema.ResponseJson(success=True, message='Kategori Updated', data=getKategori),200
         except Exception as e:
             return ResponseSchema.ResponseJson(success=False, message='Kategori Not Updated', data=None, error={"message":str(e)}),400
         
@@ -206,76 +320,90 @@ class ResourceKategori(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Kategori Not Deleted', data=None, error=e.errors()),400
         
-        # Check kategori with given id_kategori exists
-        getKategori = Kategori.select().where(Kategori.id == kategori.id_kategori)
-        if not getKategori.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
-        
-        # Check if kategori is used in recipe
-        recipe_kategori = Recipe.select().where(Recipe.id_kategori == kategori.id_kategori)
-        if recipe_kategori.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Kategori Used In Recipe', data=None),400
-        
-        # Delete kategori with given id_kategori
+        # Delete kategori with given id_kategori unless it is used in a recipe
         try:
-            Kategori.delete().where(Kategori.id == kategori.id_kategori).execute()
+            if not kategori_repository.delete(kategori.id_kategori):
+                return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
+            data_changed('kategori', 'kategori:list', f'kategori:{kategori.id_kategori}')
             return ResponseSchema.ResponseJson(success=True, message='Kategori Deleted', data=None),200
+        except InUse:
+            return ResponseSchema.ResponseJson(success=False, message='Kategori Used In Recipe', data=None),400
         except Exception as e:
             return ResponseSchema.ResponseJson(success=False, message='Kategori Not Deleted', data=None, error={"message":str(e)}),400
         
 class ResourceRecipe(Resource):
+    @table_versions.conditional('recipe', ['recipe', 'kategori', 'bahan'])
+    @response_cache.cached('recipe', recipe_cache_tags, RECIPE_PARAMS)
     def get(self):
         # define the arguments to accept
         parser = reqparse.RequestParser()
-        parser.add_argument('id_recipe', type=int, location='args')
+        parser.add_argument('id_recipe', type=id_list, location='args')
         parser.add_argument('id_kategori', type=int, location='args')
         parser.add_argument('id_bahan', type=int, location='args')
+        # sparse fieldsets, fields=id,name&include=kategori. The id is always returned.
+        parser.add_argument('fields', type=field_list(RECIPE_FIELDS), location='args')
+        parser.add_argument('include', type=field_list(RECIPE_RELATIONS), location='args')
+        add_pagination_arguments(parser)
         args = parser.parse_args()
 
+        if args['fields'] is not None or args['include'] is not None:
+            return self.get_sparse(args, args['fields'] or list(RECIPE_FIELDS), args['include'] or [])
 
+        # Recipes are read from their materialized documents, already serialized and encoded
+        # if id_recipe is a comma separated list, it will return every recipe in the order of the ids
+        if isinstance(args['id_recipe'], list):
+            if invalid_batch(args['id_recipe']):
+                return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+            recipe, not_found = recipe_repository.documents(args['id_recipe'])
+            return document_batch_json('Recipe Found', recipe, not_found),200
         # if id_recipe in arguments, it will try to return Recipe with given id
         if args['id_recipe'] is not None:
-            # Get recipe with this id_recipe
-            recipe = Recipe.select().join(RecipeBahan).join(Bahan).where(Recipe.id == args['id_recipe'])
+            # Get the document of recipe with this id_recipe
+            recipe = recipe_repository.document(args['id_recipe'])
             # Check if recipe is exists. if recipe exists. it will return single record of recipe with given id
-            if not recipe.exists():
+            if recipe is None:
                 return ResponseSchema.ResponseJson(success=False, message='Recipe Not Found', data=None),404
-            recipe = model_to_dict(recipe.get(), backrefs=True)
-            return ResponseSchema.ResponseJson(success=True, message='Recipe Found', data=recipe),200
+            return document_json('Recipe Found', recipe, args['id_recipe']),200
         
-        # if id_kategori and id_bahan in arguments, it will try to return Recipe with given id_kategori and id_bahan
-        if args['id_kategori'] is not None and args['id_bahan'] is not None:
-            # Get recipe with given id_kategori and id_bahan
-            recipe = Recipe.select().join(RecipeBahan).join(Bahan).where(Recipe.id_kategori == args['id_kategori'], RecipeBahan.id_bahan == args['id_bahan'])
-            recipe = [model_to_dict(r, backrefs=True) for r in recipe]
-            return ResponseSchema.ResponseJson(success=True, message='Recipe Found', data=recipe),200
-        
-        # if id_kategori in arguments, it will try to return Recipe with given id_kategori
-        if args['id_kategori'] is not None:
-            # check if kategori exists
-            kategori = Kategori.select().where(Kategori.id == args['id_kategori'])
-            if not kategori.exists():
-                return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
-            recipe = Recipe.select().where(Recipe.id_kategori == args['id_kategori'])
-            # Check if recipe is exists. if recipe exists. it will return single record of recipe with given id
-            recipe = [model_to_dict(r, backrefs=True) for r in recipe]
+        if invalid_limit(args):
+            return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+        # Get a page of recipe documents, filtered by id_kategori and id_bahan when they are given.
+        # Large pages are streamed from the cursor once it returned a row, an empty page is answered as usual.
+        if streams(args):
+            rows, limit = recipe_repository.page_iterator(args)
+            first = next(rows, None)
+            if first is not None:
+                return streamed_json(stream_list_json('Recipe Found', itertools.chain([first], rows), limit, encode_documents))
+            recipe, next_cursor = [], None
+        else:
+            recipe, next_cursor = recipe_repository.page(args)
+        missing = missing_filter(args) if not recipe else None
+        if missing is not None:
+            return ResponseSchema.ResponseJson(success=False, message=f'{missing} Not Found', data=None),404
+        return document_list_json('Recipe Found', recipe, next_cursor),200
+
+    def get_sparse(self, args, fields, include):
+        # Only the requested columns are selected and only the included relations are loaded
+        if isinstance(args['id_recipe'], list):
+            if invalid_batch(args['id_recipe']):
+                return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+            recipe, not_found = recipe_repository.get_many_sparse(args['id_recipe'], fields, include)
+            return batch_json('Recipe Found', recipe, not_found),200
+        if args['id_recipe'] is not None:
+            recipe = recipe_repository.get_sparse(args['id_recipe'], fields, include)
+            if recipe is None:
+                return ResponseSchema.ResponseJson(success=False, message='Recipe Not Found', data=None),404
             return ResponseSchema.ResponseJson(success=True, message='Recipe Found', data=recipe),200
-        
-        # if id_bahan in arguments, it will try to return Recipe with given id_bahan
-        if args['id_bahan'] is not None:
-            # check if bahan exists
-            bahan = Bahan.select().where(Bahan.id == args['id_bahan'])
-            if not bahan.exists():
-                return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
-            
-            recipe = Recipe.select().join(RecipeBahan).join(Bahan).where(RecipeBahan.id_bahan == args['id_bahan'])
-            # Check if recipe is exists. if recipe exists. it will return single record of recipe with given id
-            recipes = [model_to_dict(r, backrefs=True) for r in recipe]
-            return ResponseSchema.ResponseJson(success=True, message='Recipe Found', data=recipes),200
 
-        # Get all recipe
-        recipe = [model_to_dict(r, backrefs=True) for r in Recipe.select().join(RecipeBahan).join(Bahan)]
-        return ResponseSchema.ResponseJson(success=True, message='Recipe Found', data=recipe),200
+        if invalid_limit(args):
+            return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+        recipe, next_cursor = recipe_repository.page_sparse(args, fields, include)
+        missing = missing_filter(args) if not recipe else None
+        if missing is not None:
+            return ResponseSchema.ResponseJson(success=False, message=f'{missing} Not Found', data=None),404
+        return ResponseSchema.ResponseListJson(success=True, message='Recipe Found', data=recipe, next_cursor=next_cursor),200
     
     def post(self):
         try:
@@ -284,26 +412,16 @@ class ResourceRecipe(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Recipe Not Created', data=None, error=e.errors()),400
         
-        # Check if id_kategori exists
-        kategori = Kategori.select().where(Kategori.id == recipe.id_kategori)
-        if not kategori.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
+        # Check the kategori and every bahan in recipe ingredients exist with one query
+        missing = recipe_repository.missing_reference(recipe.id_kategori, recipe.ingredients)
+        if missing is not None:
+            return ResponseSchema.ResponseJson(success=False, message=f'{missing} Not Found', data=None),404
         
-        # loop recipe ingredients and check if bahan exists
-        for bahan in recipe.ingredients:
-            bahan = Bahan.select().where(Bahan.id == bahan.id_bahan)
-            if not bahan.exists():
-                return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
-        
-        # Create new recipe
-        newRecipe = Recipe.create(name=recipe.name, description=recipe.description, kategori=recipe.id_kategori)
-        for bahan in recipe.ingredients:
-            RecipeBahan.create(recipe=newRecipe.id, bahan=bahan.id_bahan, quantity=bahan.quantity, satuan=bahan.satuan)
-
-
-        # Getting the newly created recipe
-        recipe = model_to_dict(newRecipe, backrefs=True)
-        return ResponseSchema.ResponseJson(success=True, message='Recipe Created', data=recipe),201
+        # Create new recipe and its ingredients in one transaction, getting its document back
+        id_recipe, body = recipe_repository.create(recipe)
+        data_changed('recipe', 'recipe:list')
+        bahan_index.set_recipe(id_recipe, [bahan.id_bahan for bahan in recipe.ingredients])
+        return document_json('Recipe Created', body, id_recipe),201
     
     def put(self):
         try:
@@ -312,40 +430,16 @@ class ResourceRecipe(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Recipe Not Updated', data=None, error=e.errors()),400
         
-        # try to get recipe with given id_recipe
-        getRecipe = Recipe.select().where(Recipe.id == recipe.id_recipe)
-        if not getRecipe.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Recipe Not Found', data=None),404
-        getRecipe = getRecipe.get()
-
-        # check if id_kategori in recipe is exists
-        getKategori = Kategori.select().where(Kategori.id == recipe.id_kategori)
-        if not getKategori.exists():
-            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
-        
-        # Check Ingredients in recipe is Not Null
-        if recipe.ingredients is not None:
-            for bahan in recipe.ingredients:
-                bahan = Bahan.select().where(Bahan.id == bahan.id_bahan)
-                if not bahan.exists():
-                    return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
-
-        
-        # Update recipe with given id_recipe
-        getRecipe.update(name=recipe.name, description=recipe.description, kategori=recipe.id_kategori).execute()
-
-        if recipe.ingredients is not None:
-            # delete RecipeBahan with given id_recipe
-            RecipeBahan.delete().where(RecipeBahan.recipe == getRecipe.id).execute()
-
-            # loop recipe ingredients and create RecipeBahan
-            for bahan in recipe.ingredients:
-                RecipeBahan.create(recipe=recipe.id_recipe, bahan=bahan.id_bahan, quantity=bahan.quantity, satuan=bahan.satuan)
-
-        # Get updated recipe
-        recipe = model_to_dict(Recipe.get(id=recipe.id_recipe), backrefs=True)
-
-        return ResponseSchema.ResponseJson(success=True, message='Recipe Updated', data=recipe),200
+        # Check the recipe, its kategori and the bahan of its ingredients exist with one query
+        missing = recipe_repository.missing_reference(recipe.id_kategori, recipe.ingredients, id_recipe=recipe.id_recipe)
+        if missing is not None:
+            return ResponseSchema.ResponseJson(success=False, message=f'{missing} Not Found', data=None),404
+
+        # Update recipe and replace its ingredients in one transaction, getting its document back
+        body = recipe_repository.update(recipe)
+        data_changed('recipe', 'recipe:list', f'recipe:{recipe.id_recipe}')
+        bahan_index.set_recipe(recipe.id_recipe, [bahan.id_bahan for bahan in recipe.ingredients] if recipe.ingredients is not None else None)
+        return document_json('Recipe Updated', body, recipe.id_recipe),200
     
     def delete(self):
         try:
@@ -353,22 +447,241 @@ class ResourceRecipe(Resource):
         except ValidationError as e:
             return ResponseSchema.ResponseJson(success=False, message='Recipe Not Deleted', data=None, error=e.errors()),400
         
-        # Check recipe with given id_recipe exists
-        getRecipe = Recipe.select().where(Recipe.id == recipe.id_recipe)
-        if not getRecipe.exists():
+        # Delete recipe and recipebahan with given id_recipe, nothing is deleted when it doesn't exist
+        if not recipe_repository.delete(recipe.id_recipe):
             return ResponseSchema.ResponseJson(success=False, message='Recipe Not Found', data=None),404
-        
-        # Delete recipe and recipebahan with given id_recipe
-        RecipeBahan.delete().where(RecipeBahan.recipe == recipe.id_recipe).execute()
-        Recipe.delete().where(Recipe.id == recipe.id_recipe).execute()
+        data_changed('recipe', 'recipe:list', f'recipe:{recipe.id_recipe}')
+        bahan_index.remove_recipe(recipe.id_recipe)
         return ResponseSchema.ResponseJson(success=True, message='Recipe Deleted', data=None),200
         
 
 
-api.add_resource(ResourceBahan, '/api/bahan')
-api.add_resource(ResourceKategori, '/api/kategori')
-api.add_resource(ResourceRecipe, '/api/recipe')
+class ResourceRecipeSearch(Resource):
+    def get(self):
+        # define the arguments to accept
+        parser = reqparse.RequestParser()
+        parser.add_argument('q', type=str, location='args')
+        parser.add_argument('limit', type=int, location='args')
+        parser.add_argument('offset', type=int, location='args')
+        args = parser.parse_args()
+
+        if not args['q'] or not args['q'].strip():
+            return ResponseSchema.ResponseJson(success=False, message='Query Required', data=None),400
+        if invalid_limit(args):
+            return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+        # Results are ranked, so pages are addressed by offset and next_cursor is the next offset
+        limit = min(args['limit'] or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        offset = max(args['offset'] or 0, 0)
+        ids = text_index.search(args['q'], limit + 1, offset)
+        next_cursor = offset + limit if len(ids) > limit else None
+        ids = ids[:limit]
+
+        recipes = {r['id']: r for r in serialize_recipes(Recipe.select().where(Recipe.id.in_(ids)))} if ids else {}
+        recipe = [recipes[id] for id in ids if id in recipes]
+        return ResponseSchema.ResponseListJson(success=True, message='Recipe Found', data=recipe, next_cursor=next_cursor),200
+
+class ResourceRecipeSearchBahan(Resource):
+    def get(self):
+        # define the arguments to accept, bahan can be given as comma separated ids or names
+        parser = reqparse.RequestParser()
+        parser.add_argument('id_bahan', type=int, action='split', location='args')
+        parser.add_argument('bahan', type=str, action='split', location='args')
+        parser.add_argument('max_missing', type=int, location='args')
+        parser.add_argument('limit', type=int, location='args')
+        args = parser.parse_args()
+
+        if not args['id_bahan'] and not args['bahan']:
+            return ResponseSchema.ResponseJson(success=False, message='Bahan Required', data=None),400
+        if invalid_limit(args):
+            return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+        # bahan names are resolved to ids with one query
+        id_bahan = set(args['id_bahan'] or [])
+        if args['bahan']:
+            id_bahan.update(id for id, in Bahan.select(Bahan.id).where(Bahan.name.in_(args['bahan'])).tuples())
+
+        # Rank recipes from the in-memory index, then serialize only the returned page
+        limit = min(args['limit'] or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        results = bahan_index.search(id_bahan, max_missing=args['max_missing'], limit=limit)
+        recipes = {r['id']: r for r in serialize_recipes(Recipe.select().where(Recipe.id.in_([id for id, _, _ in results])))} if results else {}
+        recipe = [{
+            'recipe': recipes[id_recipe],
+            'matched': matched,
+            'missing': len(missing),
+            'missing_bahan': missing
+        } for id_recipe, matched, missing in results if id_recipe in recipes]
+        return ResponseSchema.ResponseJson(success=True, message='Recipe Found', data=recipe),200
+
+class ResourceRecipeShoppingList(Resource):
+    def post(self):
+        # define the required data to accept, recipes with a multiplier each
+        try:
+            shopping = ShoppingListSchema(**request.json)
+        except ValidationError as e:
+            return ResponseSchema.ResponseJson(success=False, message='Shopping List Not Created', data=None, error=e.errors()),400
+
+        # a recipe listed more than once is counted with the sum of its multipliers
+        multipliers = {}
+        for recipe in shopping.recipes:
+            multipliers[recipe.id_recipe] = multipliers.get(recipe.id_recipe, 0) + recipe.multiplier
+
+        # Sum the ingredients of every recipe in the database
+        bahan = shopping_list(multipliers, normalize_units=shopping.normalize)
+        return ResponseSchema.ResponseJson(success=True, message='Shopping List Created', data=bahan),200
+
+def queue_import(kind):
+    # ?background=1 imports run as a job: the rows are stored with it and the response is the queued job.
+    # A repeated Idempotency-Key header returns the job of the first request.
+    try:
+        rows = [row.decode() if isinstance(row, bytes) else row for _, row in read_rows()]
+    except ValueError as e:
+        return ResponseSchema.ResponseJson(success=False, message='Job Not Queued', data=None, error={"message":str(e)}),400
+    job, created = job_queue.enqueue(kind, {'rows': rows}, idempotency_key=request.headers.get('Idempotency-Key'))
+    return ResponseSchema.ResponseJson(success=True, message='Job Queued', data=job),202 if created else 200
+
+class ResourceBahanImport(Resource):
+    def post(self):
+        if request.args.get('background') == '1':
+            return queue_import('import_bahan')
+        # accept a JSON array or NDJSON of BahanCreateSchema rows
+        try:
+            result = import_named(Bahan, BahanCreateSchema, read_rows())
+        except ValueError as e:
+            return ResponseSchema.ResponseJson(success=False, message='Bahan Not Imported', data=None, error={"message":str(e)}),400
+        data_changed('bahan', 'bahan:list')
+        return ResponseSchema.ResponseJson(success=result['failed'] == 0, message='Bahan Imported', data=result),200
+
+class ResourceBahanExport(Resource):
+    def get(self):
+        return ndjson_response(export_named(Bahan))
+
+class ResourceKategoriImport(Resource):
+    def post(self):
+        if request.args.get('background') == '1':
+            return queue_import('import_kategori')
+        # accept a JSON array or NDJSON of KategoriCreateSchema rows
+        try:
+            result = import_named(Kategori, KategoriCreateSchema, read_rows())
+        except ValueError as e:
+            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Imported', data=None, error={"message":str(e)}),400
+        data_changed('kategori', 'kategori:list')
+        return ResponseSchema.ResponseJson(success=result['failed'] == 0, message='Kategori Imported', data=result),200
+
+class ResourceKategoriExport(Resource):
+    def get(self):
+        return ndjson_response(export_named(Kategori))
+
+class ResourceRecipeImport(Resource):
+    def post(self):
+        if request.args.get('background') == '1':
+            return queue_import('import_recipes')
+        # accept a JSON array or NDJSON of RecipeSchema rows, kategori and bahan may be given by name
+        try:
+            result = import_recipes(RecipeSchema, read_rows())
+        except ValueError as e:
+            return ResponseSchema.ResponseJson(success=False, message='Recipe Not Imported', data=None, error={"message":str(e)}),400
+        data_changed('recipe', 'recipe:list')
+        return ResponseSchema.ResponseJson(success=result['failed'] == 0, message='Recipe Imported', data=result),200
+
+class ResourceRecipeExport(Resource):
+    def get(self):
+        return ndjson_response(export_recipes())
+
+class ResourceJob(Resource):
+    def get(self):
+        # define the arguments to accept
+        parser = reqparse.RequestParser()
+        parser.add_argument('id_job', type=int, required=True, location='args')
+        args = parser.parse_args()
+
+        # status, progress and, once done, the result of the job
+        job = job_queue.get(args['id_job'])
+        if job is None:
+            return ResponseSchema.ResponseJson(success=False, message='Job Not Found', data=None),404
+        return ResponseSchema.ResponseJson(success=True, message='Job Found', data=job),200
+
+    def post(self):
+        # define the required data to accept
+        try:
+            job = JobCreateSchema(**request.json)
+        except ValidationError as e:
+            return ResponseSchema.ResponseJson(success=False, message='Job Not Queued', data=None, error=e.errors()),400
+
+        # Queue the job, an existing job is returned for a known idempotency_key
+        try:
+            queued, created = job_queue.enqueue(job.kind, job.payload, idempotency_key=job.idempotency_key, max_attempts=job.max_attempts)
+        except UnknownJob:
+            return ResponseSchema.ResponseJson(success=False, message='Unknown Job Kind', data=None),400
+        except ValidationError as e:
+            return ResponseSchema.ResponseJson(success=False, message='Job Not Queued', data=None, error=e.errors()),400
+        return ResponseSchema.ResponseJson(success=True, message='Job Queued', data=queued),202 if created else 200
+
+class ResourcePoolMetrics(Resource):
+    def get(self):
+        return ResponseSchema.ResponseJson(success=True, message='Pool Metrics Found', data=database.pool_metrics()),200
+
+
+def create_app(config=None):
+    # Build the Flask app and bind the models to the database of its config. config overrides
+    # the DATABASE_* settings of the environment, nothing connects until the first request.
+    # The Swagger spec of the API is generated by flask-restx on the first request of swagger.json.
+    global _app
+    app = Flask(__name__)
+    app.config.update(config or {})
+    init_database(app.config)
+    # request.remote_addr is the client address forwarded by the trusted proxies in front of the app
+    proxies = int(app.config.get('PROXY_FIX_X_FOR', PROXY_FIX_X_FOR))
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+
+    api = Api(app)
+    # Encode every response with the fast encoder of json_encoder, orjson when it is installed,
+    # or in a compact representation when the Accept header asks for one
+    api.representations.update(REPRESENTATIONS)
+
+    # requests are counted from before admission, so /metrics shows the ones rejected with 429 and 503
+    app.before_request(start_request_stats)
+    app.before_request(admit_request)
+    app.teardown_request(release_request)
+    # after_request hooks run in reverse order, so responses are compressed once they are complete
+    app.after_request(compress_response)
+    app.before_request(open_database_connection)
+    app.teardown_request(close_database_connection)
+    app.before_request(route_reads_to_replica)
+    app.after_request(stick_to_primary)
+    app.after_request(finish_request_stats)
+    app.add_url_rule('/metrics', view_func=prometheus_metrics)
+
+    api.add_resource(ResourceBahan, '/api/bahan')
+    api.add_resource(ResourceKategori, '/api/kategori')
+    api.add_resource(ResourceRecipe, '/api/recipe')
+    api.add_resource(ResourceRecipeSearch, '/api/recipe/search')
+    api.add_resource(ResourceRecipeSearchBahan, '/api/recipe/search/bahan')
+    api.add_resource(ResourceRecipeShoppingList, '/api/recipe/shopping-list')
+    api.add_resource(ResourceBahanImport, '/api/bahan/import')
+    api.add_resource(ResourceBahanExport, '/api/bahan/export')
+    api.add_resource(ResourceKategoriImport, '/api/kategori/import')
+    api.add_resource(ResourceKategoriExport, '/api/kategori/export')
+    api.add_resource(ResourceRecipeImport, '/api/recipe/import')
+    api.add_resource(ResourceRecipeExport, '/api/recipe/export')
+    api.add_resource(ResourceJob, '/api/jobs')
+    api.add_resource(ResourcePoolMetrics, '/api/metrics/pool')
+
+    _app = app
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `app:app` and `from app import app` get the app created last, or one configured from the environment
+    if name == 'app':
+        return _app if _app is not None else create_app()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 if __name__ == '__main__':
-    create_tables()
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    backfill(run_migrations())
+    text_index.ensure()
+    recipe_documents.ensure()
+    app.run(debug=True)
@@ -0,0 +1,329 @@
+import asyncio
+import contextvars
+import io
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags
+
+from app import app as wsgi_app
+from app import ResponseSchema, invalid_limit, invalid_batch, batch_json
+from repository import id_list, in_request_order, paginate, next_page, recipe_document_query, bahan_repository, kategori_repository, recipe_repository
+from models import database, Bahan, Kategori, RecipeDocument
+from etag import body_etag, table_versions
+from json_encoder import EncodedJson, dumps
+from recipe_documents import recipe_documents, document_json, document_list_json, document_batch_json
+from text_search import text_index
+from async_db import build_async_database
+from admission import forwarded_client, rate_limiter
+from representations import JSON, negotiate
+from compression import COMPRESS_ENABLED, COMPRESS_MIN_SIZE, compress, negotiate_encoding
+
+
+# Threads running the requests handed to the sync app (writes, search, import/export, metrics)
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 8))
+# Threads running the rate limiter and version lookups of the async reads, which may call Redis
+LOOKUP_THREADS = int(os.getenv('ASGI_LOOKUP_THREADS', 4))
+
+# ASGI entry point, run with an ASGI server such as `uvicorn asgi:app`.
+# JSON GET /api/bahan, /api/kategori and /api/recipe run on the event loop with an async driver,
+# so a slow database holds a pool connection but no thread. Every other request is handed
+# to the sync Flask app on a small thread pool. `app:app` remains the WSGI application.
+
+async_database = build_async_database()
+executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix='lookup')
+
+
+class InvalidArgument(Exception):
+    def __init__(self, name, message):
+        self.name = name
+        self.message = message
+
+
+def parse_args(args, *names, ids=()):
+    # Integer query args, like the reqparse parsers of the sync resources. The args named in ids
+    # may also be comma separated lists of ids.
+    parsed = {}
+    for name in names:
+        value = args.get(name)
+        try:
+            parsed[name] = (id_list if name in ids else int)(value) if value is not None else None
+        except ValueError as e:
+            raise InvalidArgument(name, str(e))
+    return parsed
+
+
+async def page_of(query, model, args):
+    query, limit = paginate(query, model, args)
+    return next_page(await async_database.fetchall(query), limit)
+
+
+async def get_many(repository, ids):
+    return in_request_order(ids, await async_database.fetchall(repository.many_query(ids)))
+
+
+async def get_bahan(args):
+    args = parse_args(args, 'id_bahan', 'limit', 'after_id', ids=['id_bahan'])
+    if isinstance(args['id_bahan'], list):
+        if invalid_batch(args['id_bahan']):
+            return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+        bahan, not_found = await get_many(bahan_repository, args['id_bahan'])
+        return batch_json('Bahan Found', bahan, not_found),200
+    if args['id_bahan'] is not None:
+        bahan = await async_database.fetchone(Bahan.select().where(Bahan.id == args['id_bahan']))
+        if bahan is None:
+            return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
+        return ResponseSchema.ResponseJson(success=True, message='Bahan Found', data=bahan),200
+
+    if invalid_limit(args):
+        return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+    bahan, next_cursor = await page_of(Bahan.select(), Bahan, args)
+    return ResponseSchema.ResponseListJson(success=True, message='Bahan Found', data=bahan, next_cursor=next_cursor),200
+
+async def get_kategori(args):
+    args = parse_args(args, 'id_kategori', 'limit', 'after_id', ids=['id_kategori'])
+    if isinstance(args['id_kategori'], list):
+        if invalid_batch(args['id_kategori']):
+            return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+        kategori, not_found = await get_many(kategori_repository, args['id_kategori'])
+        return batch_json('Kategori Found', kategori, not_found),200
+    if args['id_kategori'] is not None:
+        kategori = await async_database.fetchone(Kategori.select().where(Kategori.id == args['id_kategori']))
+        if kategori is None:
+            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
+        return ResponseSchema.ResponseJson(success=True, message='Kategori Found', data=kategori),200
+
+    if invalid_limit(args):
+        return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+    kategori, next_cursor = await page_of(Kategori.select(), Kategori, args)
+    return ResponseSchema.ResponseListJson(success=True, message='Kategori Found', data=kategori, next_cursor=next_cursor),200
+
+async def get_recipe(args):
+    args = parse_args(args, 'id_recipe', 'id_kategori', 'id_bahan', 'limit', 'after_id', ids=['id_recipe'])
+    if isinstance(args['id_recipe'], list):
+        if invalid_batch(args['id_recipe']):
+            return ResponseSchema.ResponseJson(success=False, message='Too Many Ids', data=None),400
+        recipes, not_found = in_request_order(args['id_recipe'], await async_database.fetchall(recipe_repository.documents_query(args['id_recipe'])))
+        return document_batch_json('Recipe Found', [recipe['body'] if recipe is not None else None for recipe in recipes], not_found),200
+    if args['id_recipe'] is not None:
+        recipe = await async_database.fetchone(RecipeDocument.select(RecipeDocument.id, RecipeDocument.body).where(RecipeDocument.id == args['id_recipe']))
+        if recipe is None:
+            return ResponseSchema.ResponseJson(success=False, message='Recipe Not Found', data=None),404
+        return document_json('Recipe Found', recipe['body'], recipe['id']),200
+
+    if invalid_limit(args):
+        return ResponseSchema.ResponseJson(success=False, message='Invalid Limit', data=None),400
+
+    if args['id_kategori'] is not None and args['id_bahan'] is None:
+        if await async_database.fetchone(Kategori.select(Kategori.id).where(Kategori.id == args['id_kategori'])) is None:
+            return ResponseSchema.ResponseJson(success=False, message='Kategori Not Found', data=None),404
+    if args['id_bahan'] is not None and args['id_kategori'] is None:
+        if await async_database.fetchone(Bahan.select(Bahan.id).where(Bahan.id == args['id_bahan'])) is None:
+            return ResponseSchema.ResponseJson(success=False, message='Bahan Not Found', data=None),404
+
+    # the documents table is ready once the lifespan startup ran, so building the query doesn't block
+    recipes, next_cursor = await page_of(recipe_document_query(args), RecipeDocument, args)
+    return document_list_json('Recipe Found', [recipe['body'] for recipe in recipes], next_cursor),200
+
+
+# Query args only the sync resources answer
+SYNC_ARGS = {'fields', 'include'}
+
+# path: (handler, ETag namespace, entities), the same as the conditional decorators of the sync resources
+ROUTES = {
+    '/api/bahan': (get_bahan, 'bahan', ['bahan']),
+    '/api/kategori': (get_kategori, 'kategori', ['kategori']),
+    '/api/recipe': (get_recipe, 'recipe', ['recipe', 'kategori', 'bahan']),
+}
+
+
+def request_header(scope, name):
+    for key, value in scope['headers']:
+        if key.decode('latin-1').lower() == name:
+            return value.decode('latin-1')
+    return None
+
+async def send_response(send, status, body, headers=()):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-length', str(len(body)).encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+def admit(client, endpoint, namespace, entities, args):
+    # (seconds to wait, ETag) of an async read. The rate limiter and the versions may call Redis,
+    # so this runs on lookup_executor instead of the event loop.
+    retry_after = rate_limiter.retry_after(client, endpoint)
+    return retry_after, table_versions.etag(namespace, entities, args) if not retry_after else None
+
+async def handle_async(scope, send, route):
+    handler, namespace, entities = route
+    args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+    # rate limited like the sync app, the async pool itself bounds how many reads wait for the database
+    client = forwarded_client(scope['client'][0] if scope.get('client') else None, request_header(scope, 'x-forwarded-for'))
+    retry_after, etag = await asyncio.get_running_loop().run_in_executor(
+        lookup_executor, admit, client, f"GET {scope['path']}", namespace, entities, args)
+    if retry_after:
+        body = dumps(ResponseSchema.ResponseJson(success=False, message='Too Many Requests', data=None)) + b'\n'
+        await send_response(send, 429, body, [(b'content-type', b'application/json'), (b'retry-after', str(math.ceil(retry_after)).encode())])
+        return
+
+    # with shared versions a matching ETag is answered before the handler runs,
+    # otherwise the response gets the weak ETag of its body like in the sync app
+    if_none_match = parse_etags(request_header(scope, 'if-none-match'))
+    if etag is not None and if_none_match.contains_weak(etag):
+        await send_response(send, 304, b'', [(b'etag', f'"{etag}"'.encode()), (b'vary', b'Accept, Accept-Encoding')])
+        return
+
+    try:
+        data, code = await handler(args)
+    except InvalidArgument as e:
+        data, code = {'errors': {e.name: e.message}, 'message': 'Input payload validation failed'}, 400
+    body = data.body if isinstance(data, EncodedJson) else dumps(data) + b'\n'
+    weak = etag is None
+    if code == 200 and weak:
+        etag = body_etag(body)
+        if if_none_match.contains_weak(etag):
+            await send_response(send, 304, b'', [(b'etag', f'W/"{etag}"'.encode()), (b'vary', b'Accept, Accept-Encoding')])
+            return
+    headers = [(b'content-type', b'application/json'), (b'vary', b'Accept, Accept-Encoding')]
+    # compressed like the responses of the sync app, with the weak form of the ETag
+    encoding = negotiate_encoding(request_header(scope, 'accept-encoding') or '') if COMPRESS_ENABLED else None
+    if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+        body = compress(body, encoding)
+        headers.append((b'content-encoding', encoding.encode()))
+        weak = True
+    if code == 200:
+        headers.append((b'etag', (f'W/"{etag}"' if weak else f'"{etag}"').encode()))
+    await send_response(send, code, body, headers)
+
+
+class RequestBody(io.RawIOBase):
+    # wsgi.input of the sync app, reading the request body from the ASGI receive channel as the
+    # app asks for it. The app runs on an executor thread and waits for the event loop to receive.
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self._more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            self._buffer = message.get('body', b'')
+            self._more_body = message['type'] == 'http.request' and message.get('more_body', False)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def start_wsgi(environ):
+    # Call the sync app and read its first chunk, by which start_response has been called
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+    result = wsgi_app(environ, start_response)
+    chunks = iter(result)
+    try:
+        first = next_chunk(chunks)
+    except BaseException:
+        close_wsgi(result)
+        raise
+    return response['status'], response['headers'], result, chunks, first
+
+def next_chunk(chunks):
+    # The next chunk of a response, None once it is complete
+    return next(chunks, None)
+
+def close_wsgi(result):
+    # Ends the request context of a streamed response, which returns its pooled connection
+    if hasattr(result, 'close'):
+        result.close()
+
+def serves_async(scope):
+    # Sparse fieldsets and the compact representations are answered by the sync app
+    args = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+    return not any(key in SYNC_ARGS for key, _ in args) and negotiate(request_header(scope, 'accept') or '') == JSON
+
+async def handle_wsgi(scope, receive, send):
+    # The request body is read as the app reads it, and the response is sent chunk by chunk as the
+    # app yields them, so neither is held in memory whole
+    loop = asyncio.get_running_loop()
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(RequestBody(receive, loop)),
+        # the body ends with the last ASGI message, with or without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for key, value in scope['headers']:
+        key = key.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        environ[key] = value.decode('latin-1')
+
+    # Each step runs on whichever executor thread is free, all of them in one context because
+    # a streamed response keeps the Flask request context in context variables between chunks
+    context = contextvars.copy_context()
+    status, headers, result, chunks, chunk = await loop.run_in_executor(executor, context.run, start_wsgi, environ)
+    try:
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers]})
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(executor, context.run, next_chunk, chunks)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        await loop.run_in_executor(executor, context.run, close_wsgi, result)
+
+
+def prepare_indexes():
+    # Check that the migrations created the tables the async reads depend on before serving
+    with database.connection_context():
+        recipe_documents.ensure()
+        text_index.ensure()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(executor, prepare_indexes)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_database.close()
+            executor.shutdown()
+            lookup_executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    route = ROUTES.get(scope['path'])
+    if route is not None and scope['method'] == 'GET' and serves_async(scope):
+        return await handle_async(scope, send, route)
+    return await handle_wsgi(scope, receive, send)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from playhouse.pool import MaxConnectionsExceeded
+
+from models import database, is_sqlite, pool_options
+
+
+class AsyncDatabase():
+    # Connection pool of an asyncio database driver, used by the ASGI entry point.
+    # Queries are still built with the peewee models and run through query.sql(),
+    # so the sync and async apps share the same SQL. Settings are the ones of the sync pool:
+    # at most max_connections are open, a request waits up to timeout seconds for one,
+    # and connections idle for more than stale_timeout seconds are reopened.
+
+    def __init__(self, max_connections=20, stale_timeout=300, timeout=10):
+        self.max_connections = max_connections
+        self.stale_timeout = stale_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def _connect(self):
+        raise NotImplementedError
+
+    async def _close(self, conn):
+        raise NotImplementedError
+
+    async def _fetchall(self, conn, sql, params):
+        # Return the rows of sql as dicts
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def connection(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise MaxConnectionsExceeded('Exceeded maximum connections.')
+        try:
+            conn = None
+            while self._idle and conn is None:
+                conn, checked_in = self._idle.pop()
+                if self.stale_timeout and time.monotonic() - checked_in > self.stale_timeout:
+                    await self._close(conn)
+                    conn = None
+            if conn is None:
+                conn = await self._connect()
+            try:
+                yield conn
+            except BaseException:
+                # the connection may be in an unknown state, don't return it to the pool
+                await self._close(conn)
+                raise
+            self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    async def fetchall(self, query):
+        sql, params = query.sql()
+        async with self.connection() as conn:
+            return await self._fetchall(conn, sql, params)
+
+    async def fetchone(self, query):
+        rows = await self.fetchall(query)
+        return rows[0] if rows else None
+
+    async def close(self):
+        while self._idle:
+            conn, _ = self._idle.pop()
+            await self._close(conn)
+
+
+class AsyncSqliteDatabase(AsyncDatabase):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    async def _connect(self):
+        try:
+            import aiosqlite
+        except ImportError:
+            raise RuntimeError('The ASGI app on SQLite requires the aiosqlite package')
+        conn = await aiosqlite.connect(self.path, uri=True)
+        await conn.execute('PRAGMA foreign_keys = 1')
+        return conn
+
+    async def _close(self, conn):
+        await conn.close()
+
+    async def _fetchall(self, conn, sql, params):
+        async with conn.execute(sql, params) as cursor:
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
+
+class AsyncMySQLDatabase(AsyncDatabase):
+    def __init__(self, name, connect_params, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.connect_params = connect_params
+
+    async def _connect(self):
+        try:
+            import aiomysql
+        except ImportError:
+            raise RuntimeError('The ASGI app on MySQL requires the aiomysql package')
+        return await aiomysql.connect(db=self.name, autocommit=True, **self.connect_params)
+
+    async def _close(self, conn):
+        conn.close()
+
+    async def _fetchall(self, conn, sql, params):
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
+
+def build_async_database():
+    # Async pool on the same database, and with the same pool settings, as models.database
+    if is_sqlite():
+        return AsyncSqliteDatabase(database.database, **pool_options)
+    connect_params = {key: value for key, value in database.connect_params.items() if key in ('user', 'password', 'host', 'port', 'charset')}
+    if 'passwd' in database.connect_params:
+        connect_params['password'] = database.connect_params['passwd']
+    return AsyncMySQLDatabase(database.database, connect_params, **pool_options)
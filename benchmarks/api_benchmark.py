@@ -0,0 +1,275 @@
+# Load test every endpoint of ResourceBahan, ResourceKategori and ResourceRecipe against a
+# freshly seeded SQLite database and save the results as JSON.
+#
+#   python benchmarks/api_benchmark.py --bahan 10000 --kategori 1000 --recipes 100000
+#   python benchmarks/api_benchmark.py --server --threads 8
+#   python benchmarks/api_benchmark.py --compare benchmarks/results/<old>.json
+#
+# By default requests go through the Flask test client in this thread. With --server the
+# app is served by a multi-threaded werkzeug server and driven by --threads HTTP clients.
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import inspect
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+class QueryCounter():
+    # Count every SQL statement executed against the app database
+    def __init__(self, database):
+        self.count = 0
+        self._lock = threading.Lock()
+        execute_sql = database.obj.execute_sql
+
+        def counting_execute_sql(*args, **kwargs):
+            with self._lock:
+                self.count += 1
+            return execute_sql(*args, **kwargs)
+
+        database.obj.execute_sql = counting_execute_sql
+
+
+class TestClientTransport():
+    def __init__(self, app):
+        self.local = threading.local()
+        self.app = app
+
+    def request(self, method, url, body):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.open(url, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPTransport():
+    def __init__(self, host, port):
+        self.local = threading.local()
+        self.host = host
+        self.port = port
+
+    def request(self, method, url, body):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host, self.port)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        self.local.connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = self.local.connection.getresponse()
+        data = response.read()
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+
+class Workload():
+    # Builds the requests of every scenario from the seeded ids, and remembers the rows
+    # created by POST scenarios so the PUT and DELETE scenarios can use them
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(1)
+        self.names = itertools.count()
+        self.created = {'bahan': [], 'kategori': [], 'recipe': []}
+        self._lock = threading.Lock()
+
+    def bahan(self):
+        return self.rng.randint(1, self.args.bahan)
+
+    def kategori(self):
+        return self.rng.randint(1, self.args.kategori)
+
+    def recipe(self):
+        return self.rng.randint(1, self.args.recipes)
+
+    def name(self, prefix):
+        return f'{prefix} {next(self.names)}'
+
+    def take(self, entity):
+        with self._lock:
+            return self.created[entity].pop()
+
+    def peek(self, entity):
+        with self._lock:
+            return self.rng.choice(self.created[entity])
+
+    def ingredients(self):
+        return [{'id_bahan': id_bahan, 'quantity': 1, 'satuan': 'buah'}
+                for id_bahan in self.rng.sample(range(1, self.args.bahan + 1), self.rng.randint(5, 30))]
+
+    def scenarios(self):
+        return [
+            ('GET /api/bahan', lambda: ('GET', '/api/bahan', None), None),
+            ('GET /api/bahan?id_bahan', lambda: ('GET', f'/api/bahan?id_bahan={self.bahan()}', None), None),
+            ('POST /api/bahan', lambda: ('POST', '/api/bahan', {'name': self.name('Bench Bahan')}), 'bahan'),
+            ('PUT /api/bahan', lambda: ('PUT', '/api/bahan', {'id_bahan': self.peek('bahan'), 'name': self.name('Bench Bahan')}), None),
+            ('GET /api/kategori', lambda: ('GET', '/api/kategori', None), None),
+            ('GET /api/kategori?id_kategori', lambda: ('GET', f'/api/kategori?id_kategori={self.kategori()}', None), None),
+            ('POST /api/kategori', lambda: ('POST', '/api/kategori', {'name': self.name('Bench Kategori')}), 'kategori'),
+            ('PUT /api/kategori', lambda: ('PUT', '/api/kategori', {'id_kategori': self.peek('kategori'), 'name': self.name('Bench Kategori')}), None),
+            ('GET /api/recipe', lambda: ('GET', '/api/recipe', None), None),
+            ('GET /api/recipe?id_recipe', lambda: ('GET', f'/api/recipe?id_recipe={self.recipe()}', None), None),
+            ('GET /api/recipe?id_kategori', lambda: ('GET', f'/api/recipe?id_kategori={self.kategori()}', None), None),
+            ('GET /api/recipe?id_bahan', lambda: ('GET', f'/api/recipe?id_bahan={self.bahan()}', None), None),
+            ('GET /api/recipe?id_kategori&id_bahan', lambda: ('GET', f'/api/recipe?id_kategori={self.kategori()}&id_bahan={self.bahan()}', None), None),
+            ('POST /api/recipe', lambda: ('POST', '/api/recipe', {'name': self.name('Bench Recipe'), 'description': 'Bench', 'id_kategori': self.kategori(), 'ingredients': self.ingredients()}), 'recipe'),
+            ('PUT /api/recipe', lambda: ('PUT', '/api/recipe', {'id_recipe': self.peek('recipe'), 'name': self.name('Bench Recipe'), 'description': 'Bench', 'id_kategori': self.kategori(), 'ingredients': self.ingredients()}), None),
+            ('DELETE /api/recipe', lambda: ('DELETE', '/api/recipe', {'id_recipe': self.take('recipe')}), None),
+            ('DELETE /api/kategori', lambda: ('DELETE', '/api/kategori', {'id_kategori': self.take('kategori')}), None),
+            ('DELETE /api/bahan', lambda: ('DELETE', '/api/bahan', {'id_bahan': self.take('bahan')}), None),
+        ]
+
+
+def percentile(timings, q):
+    return timings[min(len(timings) - 1, int(q * len(timings)))]
+
+
+def run_scenario(transport, workload, counter, build, creates, requests, threads):
+    # Requests are built up front so the timings only cover the HTTP round trip
+    calls = [build() for _ in range(requests)]
+    errors = []
+
+    def send(call):
+        method, url, body = call
+        start = time.perf_counter()
+        status, data = transport.request(method, url, body)
+        elapsed = time.perf_counter() - start
+        if status >= 400:
+            errors.append(status)
+        elif creates is not None:
+            with workload._lock:
+                workload.created[creates].append(data['data']['id'])
+        return elapsed
+
+    queries = counter.count
+    start = time.perf_counter()
+    if threads == 1:
+        timings = [send(call) for call in calls]
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            timings = list(pool.map(send, calls))
+    duration = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        'requests': requests,
+        'errors': len(errors),
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'throughput_rps': requests / duration,
+        'queries_per_request': (counter.count - queries) / requests
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=parentdir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline['commit']}")
+    for name, result in results['endpoints'].items():
+        old = baseline['endpoints'].get(name)
+        if old is None:
+            continue
+        change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0
+        print(f"{name:<40}p95 {old['p95_ms']:>8.2f} -> {result['p95_ms']:>8.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bahan', type=int, default=1000)
+    parser.add_argument('--kategori', type=int, default=100)
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--min-ingredients', type=int, default=5)
+    parser.add_argument('--max-ingredients', type=int, default=30)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--server', action='store_true', help='serve the app with a multi-threaded WSGI server')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients in --server mode')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--output', help='where to save the JSON results')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    # The app reads its database settings from the environment when it is created
+    database_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    os.environ['DATABASE_ENGINE'] = 'sqlite'
+    os.environ['DATABASE_SQLITE_PATH'] = database_path
+    os.environ['DATABASE_MAX_CONNECTIONS'] = str(max(args.threads * 2, 20))
+    os.environ['CACHE_ENABLED'] = '1' if args.cache else '0'
+    # the benchmark clients are far over any rate limit, and are meant to load the database
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    os.environ['ADMISSION_MAX_CONCURRENT'] = '0'
+
+    from app import app, database, recipe_documents, Bahan, Kategori, Recipe, RecipeBahan
+    from seed import seed
+    from migrations import run as run_migrations
+
+    start = time.perf_counter()
+    # the schema the migrations create, with the full-text index the recipe writes update
+    run_migrations()
+    seed(database, args.bahan, args.kategori, args.recipes, args.min_ingredients, args.max_ingredients)
+    recipe_documents.rebuild()
+    database.close()
+    print(f'seeded {args.recipes} recipes in {time.perf_counter() - start:.1f}s')
+
+    counter = QueryCounter(database)
+    if args.server:
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        transport = HTTPTransport('127.0.0.1', server.server_port)
+        threads = args.threads
+    else:
+        transport = TestClientTransport(app)
+        threads = 1
+
+    workload = Workload(args)
+    endpoints = {}
+    for name, build, creates in workload.scenarios():
+        endpoints[name] = run_scenario(transport, workload, counter, build, creates, args.requests, threads)
+        result = endpoints[name]
+        print(f"{name:<40}p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f} ms"
+              f"  {result['throughput_rps']:>8.1f} req/s  {result['queries_per_request']:>5.1f} q/req  {result['errors']} errors")
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': 'server' if args.server else 'test_client',
+        'threads': threads,
+        'scale': {'bahan': args.bahan, 'kategori': args.kategori, 'recipes': args.recipes,
+                  'min_ingredients': args.min_ingredients, 'max_ingredients': args.max_ingredients},
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'endpoints': endpoints
+    }
+    print(f"peak RSS {results['peak_rss_kb'] / 1024:.1f} MB")
+
+    output = args.output or os.path.join(currentdir, 'results', f"{results['commit']}-{results['mode']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'saved {output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
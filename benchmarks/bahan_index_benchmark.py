@@ -0,0 +1,56 @@
+# Time ingredient searches on the in-memory BahanRecipeIndex filled with synthetic recipes.
+#
+#   python benchmarks/bahan_index_benchmark.py --recipes 100000 --bahan 10000
+import argparse
+import os
+import random
+import sys
+import inspect
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from search_index import BahanRecipeIndex
+
+
+class FixedVersions():
+    shared = True
+
+    def current(self, *entities):
+        return [0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bahan', type=int, default=10000)
+    parser.add_argument('--recipes', type=int, default=100000)
+    parser.add_argument('--min-ingredients', type=int, default=5)
+    parser.add_argument('--max-ingredients', type=int, default=30)
+    parser.add_argument('--query-size', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    index = BahanRecipeIndex(FixedVersions())
+    index.version = 0
+    start = time.perf_counter()
+    for id_recipe in range(1, args.recipes + 1):
+        size = random.randint(args.min_ingredients, args.max_ingredients)
+        index.set_recipe(id_recipe, random.sample(range(1, args.bahan + 1), size))
+    print(f'indexed {args.recipes} recipes in {time.perf_counter() - start:.2f}s')
+
+    queries = [random.sample(range(1, args.bahan + 1), args.query_size) for _ in range(args.queries)]
+    timings = []
+    for bahan in queries:
+        start = time.perf_counter()
+        index.search(bahan, limit=20)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    for name, q in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        print(f'{name}: {timings[int(q * (len(timings) - 1))] * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# Compare how the WSGI app (app:app on a threaded werkzeug server) and the ASGI app
+# (asgi:app on uvicorn) scale with the number of concurrent clients while the database is slow.
+#
+#   python benchmarks/concurrency_benchmark.py --clients 10,100,1000 --latency-ms 50
+#
+# Each server runs in its own process on a freshly seeded SQLite database, and every SQL
+# statement is delayed by --latency-ms to stand in for a slow MySQL. Both use the same
+# connection pool size. Clients are asyncio HTTP/1.1 keep-alive connections that read
+# random recipes, reconnecting when the server closes the connection. The server's peak RSS
+# and thread count are read from /proc.
+# The ASGI mode needs the uvicorn and aiosqlite packages.
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+def raise_open_files_limit():
+    # every client and server connection is a file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(args):
+    # Run in the server process: delay every query, then serve the app until killed
+    raise_open_files_limit()
+    delay = args.latency_ms / 1000
+    sys.path.insert(0, currentdir)
+
+    if args.serve == 'wsgi':
+        import logging
+        from werkzeug.serving import make_server
+        from app import app, database
+
+        execute_sql = database.obj.execute_sql
+        def slow_execute_sql(*a, **kwargs):
+            time.sleep(delay)
+            return execute_sql(*a, **kwargs)
+        database.obj.execute_sql = slow_execute_sql
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', args.port, app, threaded=True)
+        server.socket.listen(args.backlog)
+        server.serve_forever()
+    else:
+        import uvicorn
+        from async_db import AsyncDatabase
+
+        fetchall = AsyncDatabase._fetchall
+        async def slow_fetchall(self, *a):
+            await asyncio.sleep(delay)
+            return await fetchall(self, *a)
+        AsyncDatabase._fetchall = slow_fetchall
+
+        uvicorn.run('asgi:app', host='127.0.0.1', port=args.port, log_level='warning', backlog=args.backlog)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_status(pid):
+    # Peak RSS in kB and current thread count of a process
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()[0] if value.split() else ''
+    return int(status.get('VmHWM', 0)), int(status.get('Threads', 0))
+
+
+def start_server(mode, args, env):
+    port = free_port()
+    command = [sys.executable, __file__, '--serve', mode, '--port', str(port), '--latency-ms', str(args.latency_ms), '--backlog', str(args.backlog)]
+    process = subprocess.Popen(command, cwd=parentdir, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def client(port, paths, timings, errors):
+    # One keep-alive connection per client, reopened when the server closes it
+    reader = writer = None
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            close = False
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                if key.lower() == 'content-length':
+                    length = int(value)
+                elif key.lower() == 'connection':
+                    close = value.strip().lower() == 'close'
+            await reader.readexactly(length)
+            timings.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+            if close:
+                writer.close()
+                writer = None
+    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+        errors.append('connection')
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run_clients(port, clients, requests, recipes, timeout):
+    rng = random.Random(1)
+    timings = []
+    errors = []
+    paths = [[f'/api/recipe?id_recipe={rng.randint(1, recipes)}' for _ in range(requests)] for _ in range(clients)]
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(client(port, client_paths, timings, errors)) for client_paths in paths]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+        errors.append('timeout')
+    return timings, errors, time.perf_counter() - start
+
+
+def percentile(timings, q):
+    return timings[min(len(timings) - 1, int(q * len(timings)))] if timings else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', default='10,100,1000', help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=5, help='requests per client')
+    parser.add_argument('--latency-ms', type=float, default=50, help='delay added to every SQL statement')
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=20, help='database pool size of both servers')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--timeout', type=float, default=120, help='seconds before the clients of a run give up')
+    parser.add_argument('--output', help='where to save the JSON results')
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+    raise_open_files_limit()
+
+    # Seed the database once, both servers read it through their own pools
+    database_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    env = dict(os.environ, DATABASE_ENGINE='sqlite', DATABASE_SQLITE_PATH=database_path,
+               DATABASE_MAX_CONNECTIONS=str(args.connections), DATABASE_POOL_TIMEOUT=str(int(args.timeout)),
+               CACHE_ENABLED='0', APP_ENV='production', RATE_LIMIT_ENABLED='0', ADMISSION_MAX_CONCURRENT='0')
+    os.environ.update(env)
+    from app import database, recipe_documents, Bahan, Kategori, Recipe, RecipeBahan
+    from models import init_database
+    from seed import seed
+    from migrations import run as run_migrations
+    init_database()
+    # the schema the migrations create, with the full-text index the recipe writes update
+    run_migrations()
+    seed(database, 200, 20, args.recipes, 5, 30)
+    recipe_documents.rebuild()
+    database.close()
+
+    results = {'latency_ms': args.latency_ms, 'connections': args.connections, 'requests_per_client': args.requests, 'runs': []}
+    for mode in args.modes.split(','):
+        process, port = start_server(mode, args, env)
+        try:
+            for clients in [int(n) for n in args.clients.split(',')]:
+                timings, errors, duration = asyncio.run(run_clients(port, clients, args.requests, args.recipes, args.timeout))
+                timings.sort()
+                peak_rss_kb, threads = process_status(process.pid)
+                run = {
+                    'mode': mode,
+                    'clients': clients,
+                    'requests': len(timings),
+                    'errors': len(errors),
+                    'p50_ms': percentile(timings, 0.50) * 1000,
+                    'p99_ms': percentile(timings, 0.99) * 1000,
+                    'throughput_rps': len(timings) / duration,
+                    'server_peak_rss_kb': peak_rss_kb,
+                    'server_threads': threads
+                }
+                results['runs'].append(run)
+                print(f"{mode:<5}{clients:>6} clients  p50 {run['p50_ms']:>9.1f}  p99 {run['p99_ms']:>9.1f} ms"
+                      f"  {run['throughput_rps']:>8.1f} req/s  {run['errors']} errors"
+                      f"  peak RSS {peak_rss_kb / 1024:>6.1f} MB  {threads} threads")
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'saved {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Time encoding a page of synthetic recipes, shaped like the recipe list responses,
+# with every encoder available in json_encoder.
+#
+#   python benchmarks/json_encoder_benchmark.py --recipes 1000 --ingredients 20
+import argparse
+import os
+import random
+import sys
+import inspect
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from json_encoder import OrjsonEncoder, StdlibEncoder
+
+
+def recipe(id_recipe, ingredients):
+    return {
+        'id': id_recipe,
+        'name': f'Recipe {id_recipe}',
+        'description': 'Lorem ipsum dolor sit amet ' * 5,
+        'kategori': {'id': random.randint(1, 100), 'name': 'Kategori'},
+        'recipe_bahan': [{
+            'id': id_recipe * 100 + i,
+            'bahan': {'id': random.randint(1, 10000), 'name': f'Bahan {i}'},
+            'quantity': random.choice([None, 1, 2, 250]),
+            'satuan': 'gram'
+        } for i in range(ingredients)]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipes', type=int, default=1000, help='recipes per response')
+    parser.add_argument('--ingredients', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(0)
+    response = {'success': True, 'message': 'Recipe Found', 'data': [recipe(i, args.ingredients) for i in range(1, args.recipes + 1)], 'error': None, 'next_cursor': None}
+
+    encoders = [StdlibEncoder()]
+    try:
+        encoders.append(OrjsonEncoder())
+    except ImportError:
+        print('orjson is not installed')
+
+    for encoder in encoders:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            body = encoder.dumps(response)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f'{encoder.name:<8}p50 {timings[len(timings) // 2] * 1000:8.2f} ms  {len(body) / 1024:8.1f} kB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Compare the old join-based recipe filters with the semi-join filters on a seeded SQLite database.
+#
+#   python benchmarks/recipe_fanout_benchmark.py --recipes 2000 --ingredients 10
+import argparse
+import json
+import os
+import sys
+import inspect
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from peewee import SqliteDatabase
+from app import Bahan, Kategori, Recipe, RecipeBahan, serialize_recipes
+from repository import recipe_uses_bahan
+from seed import seed
+
+MODELS = [Bahan, Kategori, Recipe, RecipeBahan]
+
+
+def measure(query, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = json.dumps(serialize_recipes(query))
+        timings.append(time.perf_counter() - start)
+    return len(payload), min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bahan', type=int, default=500)
+    parser.add_argument('--kategori', type=int, default=20)
+    parser.add_argument('--recipes', type=int, default=2000)
+    parser.add_argument('--ingredients', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    database = SqliteDatabase(':memory:')
+    with database.bind_ctx(MODELS):
+        database.create_tables(MODELS)
+        seed(database, args.bahan, args.kategori, args.recipes, args.ingredients, args.ingredients)
+
+        cases = {
+            'all': (
+                Recipe.select().join(RecipeBahan).join(Bahan),
+                Recipe.select(),
+            ),
+            'id_bahan': (
+                Recipe.select().join(RecipeBahan).join(Bahan).where(RecipeBahan.bahan == 1),
+                Recipe.select().where(recipe_uses_bahan(1)),
+            ),
+            'id_kategori+id_bahan': (
+                Recipe.select().join(RecipeBahan).join(Bahan).where(Recipe.kategori == 1, RecipeBahan.bahan == 1),
+                Recipe.select().where(Recipe.kategori == 1, recipe_uses_bahan(1)),
+            ),
+        }
+
+        print(f"{'filter':<22}{'join bytes':>14}{'join ms':>10}{'semi-join bytes':>18}{'semi-join ms':>14}")
+        for name, (join_query, semi_join_query) in cases.items():
+            join_size, join_time = measure(join_query, args.repeat)
+            semi_size, semi_time = measure(semi_join_query, args.repeat)
+            print(f"{name:<22}{join_size:>14}{join_time * 1000:>10.1f}{semi_size:>18}{semi_time * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
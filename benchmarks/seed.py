@@ -0,0 +1,32 @@
+# Seed the recipe tables with synthetic data for the benchmarks
+import random
+
+from models import Bahan, Kategori, Recipe, RecipeBahan
+
+CHUNK_SIZE = 500
+
+
+def insert_chunked(model, rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        model.insert_many(rows[i:i + CHUNK_SIZE]).execute()
+
+
+def seed(database, n_bahan, n_kategori, n_recipes, min_ingredients, max_ingredients, random_seed=0):
+    rng = random.Random(random_seed)
+    with database.atomic():
+        insert_chunked(Bahan, [{'name': f'Bahan {i}'} for i in range(n_bahan)])
+        insert_chunked(Kategori, [{'name': f'Kategori {i}'} for i in range(n_kategori)])
+        insert_chunked(Recipe, [{
+            'name': f'Recipe {i}',
+            'description': f'Description {i} ' + ' '.join(rng.choice(('goreng', 'rebus', 'bakar', 'kukus', 'pedas', 'manis')) for _ in range(3)),
+            'kategori': rng.randint(1, n_kategori)
+        } for i in range(n_recipes)])
+
+        rows = []
+        for id_recipe in range(1, n_recipes + 1):
+            for id_bahan in rng.sample(range(1, n_bahan + 1), rng.randint(min_ingredients, max_ingredients)):
+                rows.append({'recipe': id_recipe, 'bahan': id_bahan, 'quantity': 1, 'satuan': 'buah'})
+            if len(rows) >= 50000:
+                insert_chunked(RecipeBahan, rows)
+                rows = []
+        insert_chunked(RecipeBahan, rows)
@@ -0,0 +1,237 @@
+import json
+import os
+
+from flask import Response, request, stream_with_context
+from pydantic import ValidationError
+
+from models import database, is_sqlite, Kategori, Bahan, Recipe, RecipeBahan
+from schemas.recipe_schema import RecipeImportSchema
+from serializers import serialize_recipes
+from text_search import text_index
+from recipe_documents import recipe_documents
+from json_encoder import dumps
+
+# Number of rows validated and written per transaction on import, and read per page on export
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 500))
+
+
+def read_rows():
+    # Yield (index, row) from a JSON array body or, for any other content type, from NDJSON lines.
+    # NDJSON lines are read from the request stream one at a time and decoded lazily by parse_row.
+    if request.is_json:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError('Expected a JSON array')
+        yield from enumerate(rows)
+        return
+
+    index = 0
+    for line in request.stream:
+        if line.strip():
+            yield index, line
+            index += 1
+
+def chunked(rows, size=BULK_CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def decode_row(row):
+    if isinstance(row, (bytes, str)):
+        return json.loads(row)
+    return row
+
+def parse_row(schema, row):
+    # Validate a decoded row with its pydantic schema, returning (item, error)
+    try:
+        return schema(**row), None
+    except ValidationError as e:
+        return None, e.errors()
+    except TypeError:
+        return None, 'Expected a JSON object'
+
+def row_result(index, id=None, error=None):
+    return {'index': index, 'success': error is None, 'id': id, 'error': error}
+
+def import_summary(results):
+    results.sort(key=lambda result: result['index'])
+    created = sum(result['success'] for result in results)
+    return {'created': created, 'failed': len(results) - created, 'results': results}
+
+
+def import_named(model, schema, rows, checkpoint=None):
+    # Import Bahan or Kategori rows. Each chunk checks existing names with one query,
+    # inserts the new names with one insert_many and reads their ids back with one query.
+    # Names are compared casefolded, as MySQL's case-insensitive collation compares them.
+    # checkpoint(next index, results of the chunk) is called in the transaction of every chunk.
+    results = []
+    for chunk in chunked(rows):
+        first = len(results)
+        names = {}
+        for index, row in chunk:
+            try:
+                item, error = parse_row(schema, decode_row(row))
+            except ValueError as e:
+                item, error = None, str(e)
+            if error is not None:
+                results.append(row_result(index, error=error))
+            elif item.name.casefold() in names:
+                results.append(row_result(index, error='Duplicate Name In Import'))
+            else:
+                names[item.name.casefold()] = (item.name, index)
+
+        with database.atomic():
+            existing = named_ids(model, [name for name, _ in names.values()]) if names else {}
+            new_names = [name for key, (name, _) in names.items() if key not in existing]
+            if new_names:
+                model.insert_many([{'name': name} for name in new_names]).execute()
+                created = named_ids(model, new_names)
+            else:
+                created = {}
+
+            for key, (_, index) in names.items():
+                if key in existing:
+                    results.append(row_result(index, id=existing[key], error='Name Already Exists'))
+                else:
+                    results.append(row_result(index, id=created[key]))
+            if checkpoint is not None:
+                checkpoint(chunk[-1][0] + 1, results[first:])
+    return import_summary(results)
+
+def named_ids(model, names):
+    # {casefolded name: id} of the rows of model named any of names, ignoring case.
+    # MySQL's collation already does, SQLite compares with NOCASE.
+    name = model.name.collate('NOCASE') if is_sqlite() else model.name
+    query = model.select(model.name, model.id).where(name.in_(names))
+    return {name.casefold(): id for name, id in query.tuples()}
+
+def resolve_recipe_names(rows):
+    # Replace kategori and bahan names with their ids, looking up all names of the chunk
+    # with one query per table. A name takes precedence over an id so exports can be
+    # imported into another database, an unknown name leaves the id None.
+    # rows are RecipeImportSchema dicts.
+    kategori_names = {row['kategori'] for row in rows if row['kategori'] is not None}
+    bahan_names = {ingredient['bahan'] for row in rows for ingredient in row['ingredients'] if ingredient['bahan'] is not None}
+    kategori = named_ids(Kategori, list(kategori_names)) if kategori_names else {}
+    bahan = named_ids(Bahan, list(bahan_names)) if bahan_names else {}
+
+    for row in rows:
+        if row['kategori'] is not None:
+            row['id_kategori'] = kategori.get(row['kategori'].casefold())
+        for ingredient in row['ingredients']:
+            if ingredient['bahan'] is not None:
+                ingredient['id_bahan'] = bahan.get(ingredient['bahan'].casefold())
+
+def import_recipes(schema, rows, checkpoint=None):
+    # Import Recipe rows. Each chunk is validated with RecipeImportSchema, resolves names and
+    # checks kategori and bahan ids in bulk, and writes the recipes and one insert_many of all
+    # their ingredients in a transaction, which also calls checkpoint like import_named.
+    # Rows that can't be imported, malformed lines included, are reported in their row result.
+    results = []
+    for chunk in chunked(rows):
+        first = len(results)
+        decoded = []
+        for index, row in chunk:
+            try:
+                item, error = parse_row(RecipeImportSchema, decode_row(row))
+            except ValueError as e:
+                item, error = None, str(e)
+            if error is not None:
+                results.append(row_result(index, error=error))
+            else:
+                decoded.append((index, item.dict()))
+
+        resolve_recipe_names([row for _, row in decoded])
+        recipes = []
+        for index, row in decoded:
+            # unknown names are reported like unknown ids
+            if row['kategori'] is not None and row['id_kategori'] is None:
+                results.append(row_result(index, error='Kategori Not Found'))
+                continue
+            if any(ingredient['bahan'] is not None and ingredient['id_bahan'] is None for ingredient in row['ingredients']):
+                results.append(row_result(index, error='Bahan Not Found'))
+                continue
+            item, error = parse_row(schema, row)
+            if error is not None:
+                results.append(row_result(index, error=error))
+            else:
+                recipes.append((index, item))
+
+        id_kategori = {item.id_kategori for _, item in recipes}
+        id_bahan = {ingredient.id_bahan for _, item in recipes for ingredient in item.ingredients}
+        known_kategori = {id for id, in Kategori.select(Kategori.id).where(Kategori.id.in_(list(id_kategori))).tuples()} if id_kategori else set()
+        known_bahan = {id for id, in Bahan.select(Bahan.id).where(Bahan.id.in_(list(id_bahan))).tuples()} if id_bahan else set()
+
+        valid = []
+        for index, item in recipes:
+            if item.id_kategori not in known_kategori:
+                results.append(row_result(index, error='Kategori Not Found'))
+            elif any(ingredient.id_bahan not in known_bahan for ingredient in item.ingredients):
+                results.append(row_result(index, error='Bahan Not Found'))
+            else:
+                valid.append((index, item))
+
+        with database.atomic():
+            # insert_many can't report the ids of every inserted recipe on MySQL,
+            # so recipes are inserted one by one and their ingredients in bulk
+            ingredients = []
+            texts = []
+            for index, item in valid:
+                id_recipe = Recipe.insert(name=item.name, description=item.description, kategori=item.id_kategori).execute()
+                texts.append((id_recipe, item.name, item.description))
+                ingredients += [{
+                    'recipe': id_recipe,
+                    'bahan': ingredient.id_bahan,
+                    'quantity': ingredient.quantity,
+                    'satuan': ingredient.satuan
+                } for ingredient in item.ingredients]
+                results.append(row_result(index, id=id_recipe))
+            for rows_chunk in chunked(ingredients):
+                RecipeBahan.insert_many(rows_chunk).execute()
+            if texts:
+                text_index.index_recipes(texts)
+                recipe_documents.refresh([id_recipe for id_recipe, _, _ in texts])
+            if checkpoint is not None:
+                checkpoint(chunk[-1][0] + 1, results[first:])
+    return import_summary(results)
+
+
+def export_pages(model, serialize):
+    # Read the whole table one keyset page at a time so only a single page is held in memory
+    last_id = 0
+    while True:
+        page = serialize(model.select().where(model.id > last_id).order_by(model.id).limit(BULK_CHUNK_SIZE))
+        if not page:
+            return
+        yield from page
+        last_id = page[-1]['id']
+
+def export_named(model):
+    return export_pages(model, lambda query: list(query.dicts()))
+
+def export_recipes():
+    def serialize(query):
+        return [{
+            'id': recipe['id'],
+            'name': recipe['name'],
+            'description': recipe['description'],
+            'id_kategori': recipe['kategori']['id'],
+            'kategori': recipe['kategori']['name'],
+            'ingredients': [{
+                'id_bahan': recipe_bahan['bahan']['id'],
+                'bahan': recipe_bahan['bahan']['name'],
+                'quantity': recipe_bahan['quantity'],
+                'satuan': recipe_bahan['satuan']
+            } for recipe_bahan in recipe['recipe_bahan']]
+        } for recipe in serialize_recipes(query)]
+    return export_pages(Recipe, serialize)
+
+def ndjson_response(rows):
+    # Stream rows as NDJSON. The request context, and so the pooled connection,
+    # stays open until the generator is exhausted.
+    return Response(stream_with_context(dumps(row) + b'\n' for row in rows), mimetype='application/x-ndjson')
@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+from json_encoder import EncodedJson
+from representations import JSON, negotiate, output
+
+
+logger = logging.getLogger('cache')
+
+class LRUCache():
+    # In-process LRU cache with per-entry TTL. It implements the subset of the Redis client
+    # API used by ResponseCache and TableVersions (get, set, delete, sadd, expire, smembers, incr, mget),
+    # so a redis.Redis client or a local fake can be used in its place.
+    # Counters created by incr are never evicted. An entry that expires or is evicted is also
+    # removed from the sets holding it, so tag sets never outgrow the entries.
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._sets = {}
+        # member -> keys of the sets holding it
+        self._member_of = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _remove_entry(self, key):
+        if self._entries.pop(key, None) is None:
+            return False
+        for set_key in self._member_of.pop(key, ()):
+            members = self._sets.get(set_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._sets[set_key]
+        return True
+
+    def _remove_set(self, key):
+        members = self._sets.pop(key, None)
+        if members is None:
+            return False
+        for member in members:
+            sets = self._member_of.get(member)
+            if sets is not None:
+                sets.discard(key)
+                if not sets:
+                    del self._member_of[member]
+        return True
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove_entry(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ex=None, nx=False):
+        now = time.monotonic()
+        expires = now + ex if ex else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if nx and entry is not None and (entry[1] is None or entry[1] >= now):
+                return None
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._remove_entry(next(iter(self._entries)))
+        return True
+
+    def delete(self, *keys):
+        deleted = 0
+        with self._lock:
+            for key in keys:
+                deleted += self._remove_entry(key)
+                deleted += self._remove_set(key)
+        return deleted
+
+    def sadd(self, key, *members):
+        with self._lock:
+            values = self._sets.setdefault(key, set())
+            before = len(values)
+            values.update(members)
+            for member in members:
+                self._member_of.setdefault(member, set()).add(key)
+            return len(values) - before
+
+    def expire(self, key, seconds):
+        # Only entries expire, a set already shrinks with the entries it holds
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], time.monotonic() + seconds)
+            return entry is not None or key in self._sets
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._sets.get(key, ()))
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def mget(self, *keys):
+        with self._lock:
+            return [self._counters.get(key) for key in keys]
+
+    def flushdb(self):
+        with self._lock:
+            self._entries.clear()
+            self._sets.clear()
+            self._member_of.clear()
+            self._counters.clear()
+        return True
+
+
+class ResponseCache():
+    # Read-through cache of encoded GET responses. Every entry is registered under tags
+    # such as 'bahan:list' or 'bahan:1', and write handlers invalidate the tags they affect.
+    # Keys are built from the query parameters the handler reads, any other parameter is
+    # ignored so arbitrary query strings can't fill the cache with copies of one response.
+
+    def __init__(self, backend, ttl=None, enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+
+    def key(self, namespace, params, mediatype=JSON):
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)) if k in params)
+        return f'response:{namespace}?{args}' if mediatype == JSON else f'response:{namespace}?{args}#{mediatype}'
+
+    def cached(self, namespace, tags, params):
+        # Decorate a Resource.get returning (response, code), params are the names of the
+        # query parameters it reads. Hits are served from the
+        # cached body without calling the handler, only 200 responses are stored.
+        # A handler may also return a streamed Response, which is sent as it is and never stored.
+        # Requests reading from a replica bypass the cache: a lagging replica would store a stale
+        # response, and serve it to a client reading the primary after its write.
+        def decorator(method):
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or g.get('reads_replica'):
+                    result = method(*args, **kwargs)
+                    return result if isinstance(result, Response) else output(*result)
+
+                # every representation of a response is cached on its own
+                mediatype = negotiate()
+                key = self.key(namespace, params, mediatype)
+                body = self.backend.get(key)
+                if body is not None:
+                    response = make_response(body, 200)
+                    response.mimetype = mediatype
+                    return response
+
+                result = method(*args, **kwargs)
+                if isinstance(result, Response):
+                    return result
+                data, code = result
+                response = output(data, code)
+                if code == 200:
+                    self.backend.set(key, response.get_data(), ex=self.ttl)
+                    for tag in tags(data.data if isinstance(data, EncodedJson) else data['data']):
+                        self.backend.sadd(f'tag:{tag}', key)
+                        # a tag set outlives its entries by at most ttl, so tags nobody invalidates don't grow forever
+                        if self.ttl:
+                            self.backend.expire(f'tag:{tag}', self.ttl)
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            keys = self.backend.smembers(f'tag:{tag}')
+            self.backend.delete(*keys, f'tag:{tag}')
+
+
+def build_backend():
+    if os.getenv('CACHE_BACKEND', 'memory') == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_BACKEND=redis requires the redis package')
+        return redis.Redis.from_url(os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+    # a write only invalidates the cache of the process handling it
+    if int(os.getenv('WEB_CONCURRENCY') or 1) > 1:
+        logger.warning('CACHE_BACKEND=memory with WEB_CONCURRENCY=%s: writes invalidate the cache of one worker only, '
+                       'the others serve stale responses for up to CACHE_TTL seconds. Use CACHE_BACKEND=redis.',
+                       os.getenv('WEB_CONCURRENCY'))
+    return LRUCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 1024)))
+
+
+response_cache = ResponseCache(build_backend(), ttl=int(os.getenv('CACHE_TTL', 60)), enabled=os.getenv('CACHE_ENABLED', '1') == '1')
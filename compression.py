@@ -0,0 +1,101 @@
+import os
+import zlib
+
+from flask import request
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from representations import COLUMNAR
+
+
+# Responses are compressed with brotli, when the brotli package is installed, or gzip, whichever
+# the Accept-Encoding header prefers. Bodies smaller than COMPRESS_MIN_SIZE bytes are sent as they are,
+# streamed responses are compressed chunk by chunk.
+COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', '1') == '1'
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE = {'application/json', COLUMNAR, 'application/x-ndjson', 'text/plain'}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding(accept_encoding):
+    # Content-Encoding for an Accept-Encoding header, None when the body is sent as it is
+    return parse_accept_header(accept_encoding, Accept).best_match(ENCODINGS)
+
+
+class GzipCompressor():
+    def __init__(self):
+        self._compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data):
+        # compressed data, flushed so the client can decode everything it received so far
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor():
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compressor(encoding):
+    return BrotliCompressor() if encoding == 'br' else GzipCompressor()
+
+def compress(body, encoding):
+    compressing = compressor(encoding)
+    return compressing.compress(body) + compressing.finish()
+
+def compress_chunks(chunks, encoding):
+    compressing = compressor(encoding)
+    try:
+        for chunk in chunks:
+            data = compressing.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressing.finish()
+    finally:
+        # close the wrapped generator, which ends the request context it keeps open
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    # after_request hook compressing the response for the Accept-Encoding of the request
+    if (not COMPRESS_ENABLED or response.mimetype not in COMPRESSIBLE or response.status_code in (204, 206, 304)
+            or response.status_code < 200 or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # the ETag names the uncompressed representation, so it becomes weak once the body is compressed
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
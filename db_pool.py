@@ -0,0 +1,97 @@
+import contextvars
+import itertools
+import threading
+import time
+
+from playhouse.pool import PooledMySQLDatabase, PooledSqliteDatabase
+
+from instrumentation import QueryStatsMixin
+
+
+class PoolMetricsMixin():
+    # Records how long callers wait to borrow a connection and how much of the pool is in use
+
+    def __init__(self, *args, **kwargs):
+        self._metrics_lock = threading.Lock()
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        super().__init__(*args, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        start = time.perf_counter()
+        opened = super().connect(reuse_if_open)
+        if opened:
+            waited = time.perf_counter() - start
+            with self._metrics_lock:
+                self._wait_count += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        return opened
+
+    def pool_metrics(self):
+        in_use = len(self._in_use)
+        with self._metrics_lock:
+            return {
+                'max_connections': self._max_connections,
+                'in_use': in_use,
+                'idle': len(self._connections),
+                'utilization': in_use / self._max_connections if self._max_connections else None,
+                'wait_count': self._wait_count,
+                'wait_seconds_total': self._wait_total,
+                'wait_seconds_max': self._wait_max
+            }
+
+
+class ReplicaRouterMixin():
+    # Primary database that sends the SELECTs of a request to a read replica once the request
+    # called read_from_replica(). Writes, statements inside a transaction and every statement of
+    # other requests run on the primary. A request keeps the replica it was given, round robin,
+    # so all its reads see the same snapshot.
+
+    def __init__(self, *args, replicas=(), **kwargs):
+        self.replicas = list(replicas)
+        self._next_replica = itertools.cycle(self.replicas)
+        self._replica_lock = threading.Lock()
+        self._replica = contextvars.ContextVar(f'replica_{id(self)}', default=None)
+        super().__init__(*args, **kwargs)
+
+    def read_from_replica(self):
+        # Route the reads of the current request to a replica, returns it or None without replicas
+        if not self.replicas:
+            return None
+        with self._replica_lock:
+            replica = next(self._next_replica)
+        self._replica.set(replica)
+        return replica
+
+    def read_from_primary(self):
+        # Stop routing the reads of the current request and return its replica connection to its pool
+        replica = self._replica.get()
+        self._replica.set(None)
+        if replica is not None and not replica.is_closed():
+            replica.close()
+
+    def execute_sql(self, sql, params=None, commit=None):
+        replica = self._replica.get()
+        if replica is not None and not self.in_transaction() and sql.lstrip()[:6].upper() == 'SELECT':
+            return replica.execute_sql(sql, params)
+        return super().execute_sql(sql, params)
+
+
+class MetricsPooledMySQLDatabase(QueryStatsMixin, ReplicaRouterMixin, PoolMetricsMixin, PooledMySQLDatabase):
+    pass
+
+
+class MetricsPooledSqliteDatabase(QueryStatsMixin, ReplicaRouterMixin, PoolMetricsMixin, PooledSqliteDatabase):
+    pass
+
+
+# Replicas are only reached through the router of their primary, which already records their statements
+
+class ReplicaPooledMySQLDatabase(PoolMetricsMixin, PooledMySQLDatabase):
+    pass
+
+
+class ReplicaPooledSqliteDatabase(PoolMetricsMixin, PooledSqliteDatabase):
+    pass
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import secrets
+from functools import wraps
+
+from flask import g, make_response, request
+from werkzeug.http import generate_etag
+
+from cache import build_backend, response_cache
+from representations import JSON, negotiate
+
+
+class TableVersions():
+    # Version counter per entity (bahan, kategori, recipe), bumped by every write handler.
+    # With a shared backend (CACHE_BACKEND=redis) every app worker and the job worker see the same
+    # counters, and conditional GETs are answered from them with a strong ETag before the handler
+    # runs. The ETag also carries a random epoch stored next to the counters, replaced whenever a
+    # counter starts over, so counters lost by Redis can't repeat an ETag sent before.
+    # The counters of the memory backend are per process and start over on restart, so they are
+    # never sent as validators: responses get a weak ETag hashed from their body instead, which
+    # saves sending an unchanged response but not building it.
+
+    def __init__(self, backend, shared):
+        self.backend = backend
+        self.shared = shared
+
+    def bump(self, *entities):
+        for entity in entities:
+            if self.backend.incr(f'version:{entity}') == 1:
+                self.backend.set('version:epoch', secrets.token_hex(8))
+
+    def current(self, *entities):
+        versions = self.backend.mget(*[f'version:{entity}' for entity in entities])
+        return [int(version or 0) for version in versions]
+
+    def epoch(self):
+        epoch = self.backend.get('version:epoch')
+        if epoch is None:
+            self.backend.set('version:epoch', secrets.token_hex(8), nx=True)
+            epoch = self.backend.get('version:epoch')
+        return epoch.decode() if isinstance(epoch, bytes) else epoch
+
+    def etag(self, namespace, entities, args=None, mediatype=JSON):
+        # Strong ETag built from the epoch, the versions of every entity a response depends on,
+        # the query args and the representation, None unless the backend is shared.
+        # args defaults to the args of the current Flask request.
+        if not self.shared:
+            return None
+        args = request.args if args is None else args
+        args = '&'.join(f'{k}={v}' for k, v in sorted(args.items(multi=True)))
+        if mediatype != JSON:
+            args += f'#{mediatype}'
+        versions = '.'.join(str(version) for version in self.current(*entities))
+        return f'{namespace}-{self.epoch()}.{versions}-{hashlib.sha1(args.encode()).hexdigest()[:16]}'
+
+    def conditional(self, namespace, entities):
+        # Decorate a Resource.get so a matching If-None-Match is answered with 304, before the
+        # handler runs any query or serialization when the versions are shared. A response read
+        # from a replica may predate the versions, it gets the weak ETag of its body instead.
+        def decorator(method):
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                etag = self.etag(namespace, entities, mediatype=negotiate()) if not g.get('reads_replica') else None
+                # weak comparison, compressed responses carry the weak form of the ETag
+                if etag is not None and request.if_none_match.contains_weak(etag):
+                    return not_modified(etag)
+
+                response = method(*args, **kwargs)
+                if response.status_code == 200 and etag is not None:
+                    response.set_etag(etag)
+                elif response.status_code == 200 and not response.is_streamed:
+                    etag = body_etag(response.get_data())
+                    if request.if_none_match.contains_weak(etag):
+                        return not_modified(etag, weak=True)
+                    response.set_etag(etag, weak=True)
+                response.vary.add('Accept')
+                return response
+            return wrapper
+        return decorator
+
+
+def body_etag(body):
+    # ETag of a response of the memory backend, sent weak
+    return generate_etag(body)
+
+def not_modified(etag, weak=False):
+    response = make_response('', 304)
+    response.set_etag(etag, weak=weak)
+    response.vary.add('Accept')
+    return response
+
+
+table_versions = TableVersions(build_backend(), shared=os.getenv('CACHE_BACKEND', 'memory') == 'redis')
+
+
+def data_changed(entity, *tags):
+    # Called after every write: bump the entity version used for ETags and drop the cached responses it affects
+    table_versions.bump(entity)
+    response_cache.invalidate(*tags)
+
+def recipes_changed(ids):
+    # Called when the documents of these recipes were refreshed by a bahan or kategori rename
+    data_changed('recipe', 'recipe:list', *[f'recipe:{id}' for id in ids])
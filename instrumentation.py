@@ -0,0 +1,150 @@
+import contextvars
+import cProfile
+import heapq
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+logger = logging.getLogger('instrumentation')
+
+# Requests and single statements slower than these (milliseconds) are logged, 0 disables the log
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 0))
+# Number of slowest statements kept per request
+SLOWEST_QUERIES = int(os.getenv('SLOWEST_QUERIES', 5))
+# ?profile=1 is only honoured when PROFILING_ENABLED=1 is set explicitly, and never in production
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1' and os.getenv('APP_ENV', 'production') != 'production'
+
+current_stats = contextvars.ContextVar('current_stats', default=None)
+
+
+class RequestStats():
+    # SQL statements executed while handling one request
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = []
+
+    def record(self, sql, params, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        entry = (elapsed, self.queries, sql, params)
+        if len(self.slowest) < SLOWEST_QUERIES:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def slowest_queries(self):
+        return [{'ms': elapsed * 1000, 'sql': sql, 'params': list(params or ())}
+                for elapsed, _, sql, params in sorted(self.slowest, reverse=True)]
+
+
+class QueryStatsMixin():
+    # Times every statement and records it on the stats of the request being handled
+
+    def execute_sql(self, sql, params=None, commit=None):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = current_stats.get()
+            if stats is not None:
+                stats.record(sql, params, elapsed)
+            if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+                logger.warning('slow query %.1f ms: %s %r', elapsed * 1000, sql, params)
+
+
+class Metrics():
+    # In-process request and SQL metrics rendered in the Prometheus text format
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._durations = {}
+        self._queries = {}
+
+    def observe(self, method, endpoint, status, duration, stats):
+        with self._lock:
+            key = (method, endpoint, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            histogram = self._durations.setdefault((method, endpoint), [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += duration
+            histogram[2] += 1
+
+            queries = self._queries.setdefault((method, endpoint), [0, 0.0])
+            queries[0] += stats.queries
+            queries[1] += stats.db_time
+
+    def render(self, pool_metrics=None):
+        def labels(**values):
+            return '{' + ','.join(f'{k}="{v}"' for k, v in values.items()) + '}'
+
+        lines = []
+        with self._lock:
+            lines += ['# HELP http_requests_total Requests handled.', '# TYPE http_requests_total counter']
+            for (method, endpoint, status), count in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{labels(method=method, endpoint=endpoint, status=status)} {count}')
+
+            lines += ['# HELP http_request_duration_seconds Request latency.', '# TYPE http_request_duration_seconds histogram']
+            for (method, endpoint), (counts, total, count) in sorted(self._durations.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f'http_request_duration_seconds_bucket{labels(method=method, endpoint=endpoint, le=bound)} {bucket}')
+                lines.append(f'http_request_duration_seconds_bucket{labels(method=method, endpoint=endpoint, le="+Inf")} {count}')
+                lines.append(f'http_request_duration_seconds_sum{labels(method=method, endpoint=endpoint)} {total}')
+                lines.append(f'http_request_duration_seconds_count{labels(method=method, endpoint=endpoint)} {count}')
+
+            lines += ['# HELP db_queries_total SQL statements executed.', '# TYPE db_queries_total counter']
+            for (method, endpoint), (count, _) in sorted(self._queries.items()):
+                lines.append(f'db_queries_total{labels(method=method, endpoint=endpoint)} {count}')
+            lines += ['# HELP db_query_duration_seconds_total Time spent executing SQL.', '# TYPE db_query_duration_seconds_total counter']
+            for (method, endpoint), (_, total) in sorted(self._queries.items()):
+                lines.append(f'db_query_duration_seconds_total{labels(method=method, endpoint=endpoint)} {total}')
+
+        for name, value in (pool_metrics or {}).items():
+            if value is not None:
+                lines += [f'# TYPE db_pool_{name} gauge', f'db_pool_{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def start_request(profile=False):
+    # Start collecting SQL stats for this request, and a profiler when asked for
+    stats = RequestStats()
+    current_stats.set(stats)
+    if profile and PROFILING_ENABLED:
+        stats.profiler = cProfile.Profile()
+        stats.profiler.enable()
+    return stats
+
+def finish_request(stats, method, endpoint, status):
+    # Record the request in the metrics, log it when slow and return the Server-Timing header
+    current_stats.set(None)
+    duration = time.perf_counter() - stats.started
+    metrics.observe(method, endpoint, status, duration, stats)
+    if SLOW_REQUEST_MS and duration * 1000 >= SLOW_REQUEST_MS:
+        logger.warning('slow request %s %s %.1f ms, %d queries in %.1f ms, slowest: %r',
+                       method, endpoint, duration * 1000, stats.queries, stats.db_time * 1000, stats.slowest_queries())
+    return (f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+            f'total;dur={duration * 1000:.2f}')
+
+def profile_report(stats):
+    # Stop the profiler and return the request's profile and SQL statements as text
+    stats.profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(stats.profiler, stream=output).sort_stats('cumulative').print_stats(40)
+    output.write(f'\n{stats.queries} queries in {stats.db_time * 1000:.2f} ms, slowest:\n')
+    for query in stats.slowest_queries():
+        output.write(f"{query['ms']:.2f} ms  {query['sql']}  {query['params']}\n")
+    return output.getvalue()
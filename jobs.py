@@ -0,0 +1,317 @@
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+
+from peewee import IntegrityError
+
+from models import database, init_database, Bahan, Job, Kategori, Recipe, RecipeBahan
+from schemas.bahan_schema import BahanCreateSchema
+from schemas.kategori_schema import KategoriCreateSchema
+from schemas.recipe_schema import RecipeSchema
+from schemas.job_schema import DeleteRecipesJobPayload, ImportJobPayload
+from bulk import BULK_CHUNK_SIZE, chunked, import_named, import_recipes
+from etag import data_changed, table_versions
+from json_encoder import dumps
+from recipe_documents import recipe_documents
+from text_search import text_index
+
+
+# Attempts of a job before it fails, and the delay before its first retry in seconds, doubled on every retry
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 5))
+# A running job whose worker hasn't finished it after this many seconds is queued again
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 3600))
+# Seconds an idle worker waits before looking for queued jobs again
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+
+logger = logging.getLogger('jobs')
+
+
+def now():
+    return datetime.datetime.now()
+
+
+class UnknownJob(Exception):
+    pass
+
+class JobLost(Exception):
+    # The job was requeued or finished by someone else while this worker ran it
+    pass
+
+
+class Checkpoint():
+    # Progress of an import job, saved in the transaction of every chunk it writes. A retried or
+    # requeued job resumes after the last chunk that was committed instead of writing its rows again.
+    # Saving is fenced by the attempt: a worker whose job was requeued can't commit another chunk.
+
+    def __init__(self, job):
+        self.job = job
+        state = json.loads(job.checkpoint) if job.checkpoint else {}
+        self.rows = self.resumed_at = state.get('rows', 0)
+        self.created = state.get('created', 0)
+        self.failed = state.get('failed', 0)
+
+    def save(self, rows, results):
+        # checkpoint callback of import_named and import_recipes: rows read so far and the results of the chunk
+        created = self.created + sum(result['success'] for result in results)
+        failed = self.failed + sum(not result['success'] for result in results)
+        state = dumps({'rows': rows, 'created': created, 'failed': failed}).decode()
+        if not Job.update(checkpoint=state).where(attempt(self.job)).execute():
+            raise JobLost(f'job {self.job.id} is no longer run by this worker')
+        self.rows, self.created, self.failed = rows, created, failed
+
+    def result(self, summary):
+        # Result of the import: the counts of every attempt, the results of the rows of this one
+        summary = {**summary, 'created': self.created, 'failed': self.failed}
+        if self.resumed_at:
+            summary['resumed_at'] = self.resumed_at
+        return summary
+
+
+def attempt(job):
+    # Condition matching the job only while it runs the attempt of this worker
+    return (Job.id == job.id) & (Job.attempts == job.attempts) & (Job.status == 'running')
+
+
+class JobQueue():
+    # Background jobs stored in the job table of the app database, so no broker is needed.
+    # Requests enqueue a job and answer with its id right away, worker processes
+    # (`python jobs.py --workers N`) claim queued jobs and run the handler of their kind.
+    # A failed job is retried with an exponential delay until it ran max_attempts times,
+    # import jobs resume from their Checkpoint.
+    # Jobs enqueued with the same idempotency key are the same job.
+    #
+    # Writes made by jobs bump the table versions and invalidate the response cache from the
+    # worker process, which reaches the app workers through CACHE_BACKEND=redis.
+
+    def __init__(self):
+        self.handlers = {}
+        self.schemas = {}
+
+    def handler(self, kind, schema=None):
+        # Register the function running the jobs of a kind. It is called with the decoded
+        # payload, a progress(fraction) callback and the Checkpoint of the job, and returns
+        # the JSON result of the job. The payload is validated with the pydantic schema on enqueue.
+        def decorator(function):
+            self.handlers[kind] = function
+            if schema is not None:
+                self.schemas[kind] = schema
+            return function
+        return decorator
+
+    def enqueue(self, kind, payload, idempotency_key=None, max_attempts=None):
+        # Returns the job and whether it was created, an existing job is returned for a known idempotency key.
+        # Raises UnknownJob, or ValidationError for a payload its handler can't run.
+        if kind not in self.handlers:
+            raise UnknownJob(kind)
+        if kind in self.schemas:
+            payload = self.schemas[kind](**payload).dict()
+        if idempotency_key is not None:
+            job = self.get(idempotency_key=idempotency_key)
+            if job is not None:
+                return job, False
+        created_at = now()
+        try:
+            id_job = Job.insert(
+                kind=kind,
+                payload=dumps(payload).decode(),
+                max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+                idempotency_key=idempotency_key,
+                run_after=created_at,
+                created_at=created_at
+            ).execute()
+        except IntegrityError:
+            # enqueued by a concurrent request with the same key
+            return self.get(idempotency_key=idempotency_key), False
+        return self.get(id_job), True
+
+    def get(self, id_job=None, idempotency_key=None):
+        # The job as a dict with its result decoded, or None
+        where = Job.id == id_job if idempotency_key is None else Job.idempotency_key == idempotency_key
+        job = Job.select().where(where).dicts().get_or_none()
+        if job is None:
+            return None
+        del job['payload']
+        del job['checkpoint']
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        for field in ('run_after', 'started_at', 'finished_at', 'created_at'):
+            job[field] = job[field].isoformat() if job[field] is not None else None
+        return job
+
+    def requeue_stale(self):
+        # Queue again the jobs left running by a worker that died or was killed, or fail them once
+        # they ran max_attempts times so a job killing its worker isn't run forever
+        stale = (Job.status == 'running') & (Job.started_at < now() - datetime.timedelta(seconds=JOB_TIMEOUT))
+        (Job
+         .update(status='failed', error=f'Timed out after {JOB_TIMEOUT} seconds', finished_at=now())
+         .where(stale, Job.attempts >= Job.max_attempts)
+         .execute())
+        return Job.update(status='queued').where(stale, Job.attempts < Job.max_attempts).execute()
+
+    def claim(self):
+        # Take the oldest queued job that is due, or return None. The update only succeeds for one
+        # worker, another worker that read the same id tries the next one.
+        while True:
+            started_at = now()
+            row = Job.select(Job.id).where(Job.status == 'queued', Job.run_after <= started_at).order_by(Job.run_after, Job.id).tuples().first()
+            if row is None:
+                return None
+            claimed = (Job
+                       .update(status='running', started_at=started_at, attempts=Job.attempts + 1)
+                       .where(Job.id == row[0], Job.status == 'queued')
+                       .execute())
+            if claimed:
+                return Job.get_by_id(row[0])
+
+    def progress(self, job):
+        # progress(fraction) callback of a running job, written at most once per percent
+        last = [job.progress]
+        def update(fraction):
+            fraction = round(min(max(fraction, 0), 1), 2)
+            if fraction != last[0]:
+                Job.update(progress=fraction).where(attempt(job)).execute()
+                last[0] = fraction
+        return update
+
+    def run(self, job):
+        # Run a claimed job and record its result, or schedule its retry. Every update is fenced
+        # by the attempt, a job requeued in the meantime belongs to another worker.
+        try:
+            result = self.handlers[job.kind](json.loads(job.payload), self.progress(job), Checkpoint(job))
+            finished = (Job
+                        .update(status='done', progress=1, result=dumps(result).decode(), error=None, finished_at=now())
+                        .where(attempt(job))
+                        .execute())
+            if not finished:
+                raise JobLost(f'job {job.id} is no longer run by this worker')
+        except JobLost as e:
+            logger.warning('job %s (%s) attempt %s abandoned: %s', job.id, job.kind, job.attempts, e)
+            return False
+        except Exception as e:
+            logger.warning('job %s (%s) attempt %s failed: %s', job.id, job.kind, job.attempts, e)
+            error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            if job.attempts < job.max_attempts:
+                retry_at = now() + datetime.timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+                Job.update(status='queued', error=error, run_after=retry_at).where(attempt(job)).execute()
+            else:
+                Job.update(status='failed', error=error, finished_at=now()).where(attempt(job)).execute()
+            return False
+        return True
+
+    def run_once(self):
+        # Claim and run one job, returns False when no job was due
+        with database.connection_context():
+            self.requeue_stale()
+            job = self.claim()
+            if job is None:
+                return False
+            self.run(job)
+            return True
+
+    def work(self, poll_interval=JOB_POLL_INTERVAL):
+        # Loop of a worker process. An error recording a job, a lost connection for example, doesn't
+        # end it: the job stays running until requeue_stale queues or fails it.
+        while True:
+            try:
+                ran = self.run_once()
+            except Exception:
+                logger.exception('job worker error')
+                ran = False
+            if not ran:
+                time.sleep(poll_interval)
+
+
+job_queue = JobQueue()
+
+
+def tracked(rows, progress, start=0):
+    # Enumerate the rows of an import from start, reporting the share of rows read once per chunk
+    for index, row in enumerate(rows[start:], start):
+        if (index - start) % BULK_CHUNK_SIZE == 0:
+            progress(index / len(rows))
+        yield index, row
+
+@job_queue.handler('import_bahan', ImportJobPayload)
+def import_bahan_job(payload, progress, checkpoint):
+    result = import_named(Bahan, BahanCreateSchema, tracked(payload['rows'], progress, checkpoint.rows), checkpoint.save)
+    data_changed('bahan', 'bahan:list')
+    return checkpoint.result(result)
+
+@job_queue.handler('import_kategori', ImportJobPayload)
+def import_kategori_job(payload, progress, checkpoint):
+    result = import_named(Kategori, KategoriCreateSchema, tracked(payload['rows'], progress, checkpoint.rows), checkpoint.save)
+    data_changed('kategori', 'kategori:list')
+    return checkpoint.result(result)
+
+@job_queue.handler('import_recipes', ImportJobPayload)
+def import_recipes_job(payload, progress, checkpoint):
+    result = import_recipes(RecipeSchema, tracked(payload['rows'], progress, checkpoint.rows), checkpoint.save)
+    data_changed('recipe', 'recipe:list')
+    return checkpoint.result(result)
+
+@job_queue.handler('delete_recipes', DeleteRecipesJobPayload)
+def delete_recipes_job(payload, progress, checkpoint):
+    # Delete recipes with their ingredients, index entries and documents, one transaction per chunk of ids
+    ids = payload['ids']
+    deleted = []
+    for start, chunk in enumerate(chunked(ids)):
+        progress(start * BULK_CHUNK_SIZE / len(ids))
+        with database.atomic():
+            found = [id for id, in Recipe.select(Recipe.id).where(Recipe.id.in_(chunk)).tuples()]
+            RecipeBahan.delete().where(RecipeBahan.recipe.in_(chunk)).execute()
+            Recipe.delete().where(Recipe.id.in_(chunk)).execute()
+            for id_recipe in found:
+                text_index.remove_recipe(id_recipe)
+            recipe_documents.refresh(chunk)
+        deleted += found
+    data_changed('recipe', 'recipe:list', *[f'recipe:{id}' for id in deleted])
+    return {'deleted': len(deleted), 'not_found': sorted(set(ids) - set(deleted))}
+
+@job_queue.handler('rebuild_documents')
+def rebuild_documents_job(payload, progress, checkpoint):
+    count = recipe_documents.rebuild()
+    data_changed('recipe', 'recipe:list')
+    return {'rebuilt': count}
+
+
+def require_shared_versions():
+    # Writes of a worker process bump the table versions and invalidate the response cache of the
+    # app workers only through a shared backend, with the memory one they would serve stale data
+    if not table_versions.shared:
+        raise RuntimeError('Job workers require CACHE_BACKEND=redis, the memory backend only invalidates the cache of the worker itself')
+
+def worker_process():
+    # A spawned process imports this module again, and binds the models to the database of its environment
+    require_shared_versions()
+    if database.obj is None:
+        init_database()
+    job_queue.work()
+
+def start_workers(count):
+    # Worker processes share nothing but the database, each one opens its own connections
+    workers = [multiprocessing.Process(target=worker_process, name=f'job-worker-{i}', daemon=True) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the background job workers')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('JOB_WORKERS', 2)), help='number of worker processes')
+    parser.add_argument('--once', action='store_true', help='run the queued jobs that are due and exit')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    require_shared_versions()
+    init_database()
+
+    if args.once:
+        while job_queue.run_once():
+            pass
+    else:
+        for worker in start_workers(args.workers):
+            worker.join()
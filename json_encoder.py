@@ -0,0 +1,114 @@
+import json
+import os
+
+from flask import Response, current_app, make_response, stream_with_context
+from peewee import BaseQuery
+
+
+def default(obj):
+    # peewee queries, such as Model.select().dicts() or .tuples(), are encoded as the list
+    # of their rows, so handlers can return them without building model instances
+    if isinstance(obj, BaseQuery):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class StdlibEncoder():
+    name = 'json'
+
+    def dumps(self, data, indent=None):
+        return json.dumps(data, default=default, indent=indent).encode()
+
+
+class OrjsonEncoder():
+    # orjson encodes straight to UTF-8 bytes and is several times faster than json on large lists
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, data, indent=None):
+        option = self.orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= self.orjson.OPT_INDENT_2
+        return self.orjson.dumps(data, default=default, option=option)
+
+
+def build_encoder():
+    # JSON_ENCODER=orjson or json, by default orjson when it is installed
+    name = os.getenv('JSON_ENCODER', 'auto')
+    if name == 'json':
+        return StdlibEncoder()
+    try:
+        return OrjsonEncoder()
+    except ImportError:
+        if name == 'orjson':
+            raise RuntimeError('JSON_ENCODER=orjson requires the orjson package')
+        return StdlibEncoder()
+
+
+encoder = build_encoder()
+
+
+class EncodedJson():
+    # Response body that is already JSON encoded. Handlers may return it in place of a dict,
+    # data is what the response cache tags are computed from.
+
+    def __init__(self, body, data):
+        self.body = body
+        self.data = data
+
+
+def dumps(data):
+    # Encode data to UTF-8 JSON bytes
+    return encoder.dumps(data)
+
+
+def output_json(data, code, headers=None):
+    # flask-restx representation of application/json, encoded with the configured encoder.
+    # Responses are indented in debug mode like the default representation.
+    if isinstance(data, EncodedJson):
+        response = make_response(data.body, code)
+    else:
+        response = make_response(encoder.dumps(data, indent=4 if current_app.debug else None) + b'\n', code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
+
+def encode_rows(rows):
+    # Comma separated encoding of a list of rows, to be written inside a JSON array
+    return dumps(rows)[1:-1]
+
+
+# Rows encoded at a time by a streamed list
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 100))
+
+def stream_list_json(message, rows, limit, encode=encode_rows):
+    # ResponseListJson envelope written around the rows of a paginated query while they are read
+    # from its cursor, STREAM_CHUNK_SIZE rows at a time. rows yields (id, row) pairs, at most limit + 1
+    # like the queries of paginate, the extra one only telling that there is a next page.
+    # encode returns the comma separated encoding of a list of rows.
+    yield f'{{"success": true, "message": {dumps(message).decode()}, "data": ['.encode()
+    chunk = []
+    separator = b''
+    last_id = next_cursor = None
+    for index, (id, row) in enumerate(rows):
+        if index == limit:
+            next_cursor = last_id
+            break
+        chunk.append(row)
+        last_id = id
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            yield separator + encode(chunk)
+            separator = b', '
+            chunk = []
+    if chunk:
+        yield separator + encode(chunk)
+    yield f'], "error": null, "next_cursor": {dumps(next_cursor).decode()}}}\n'.encode()
+
+def streamed_json(chunks):
+    # JSON response sent while chunks are produced. The request context, and so the pooled
+    # connection, stays open until the generator is exhausted.
+    return Response(stream_with_context(chunks), mimetype='application/json')
+
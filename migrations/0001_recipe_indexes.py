@@ -0,0 +1,29 @@
+from playhouse.migrate import migrate
+
+from migrations import MigrationError
+
+
+def upgrade(migrator):
+    # A bahan may only be used once per recipe. Copies of an ingredient row with the same quantity
+    # and satuan are removed, keeping the first. Copies that differ can't be merged without
+    # guessing which one is right, so the migration stops and lists them to be fixed by hand.
+    conflicts = migrator.database.execute_sql(
+        'SELECT rb.id_recipe, rb.id_bahan, rb.id, rb.quantity, rb.satuan FROM recipebahan AS rb JOIN '
+        '(SELECT id_recipe, id_bahan FROM recipebahan GROUP BY id_recipe, id_bahan '
+        'HAVING MIN(COALESCE(quantity, -1)) <> MAX(COALESCE(quantity, -1)) OR MIN(satuan) <> MAX(satuan)) AS conflict '
+        'ON rb.id_recipe = conflict.id_recipe AND rb.id_bahan = conflict.id_bahan '
+        'ORDER BY rb.id_recipe, rb.id_bahan, rb.id').fetchall()
+    if conflicts:
+        raise MigrationError('recipebahan has different rows for the same recipe and bahan, keep one of each and migrate again:\n' +
+                             '\n'.join(f'  id_recipe={id_recipe} id_bahan={id_bahan}: id={id} quantity={quantity} satuan={satuan!r}'
+                                       for id_recipe, id_bahan, id, quantity, satuan in conflicts))
+
+    # The inner select is wrapped in a derived table because MySQL can't read the table it deletes from
+    migrator.database.execute_sql(
+        'DELETE FROM recipebahan WHERE id NOT IN '
+        '(SELECT id FROM (SELECT MIN(id) AS id FROM recipebahan GROUP BY id_recipe, id_bahan) AS keep)')
+    migrate(
+        migrator.add_index('recipe', ('name',), False),
+        migrator.add_index('recipebahan', ('id_recipe', 'id_bahan'), True),
+        migrator.add_index('recipebahan', ('id_bahan', 'id_recipe'), False),
+    )
@@ -0,0 +1,31 @@
+from peewee import AutoField, CharField, DateTimeField, FloatField, IntegerField, Model, TextField
+
+
+class Job(Model):
+    # the job table as this migration creates it, later migrations change it
+    id = AutoField()
+    kind = CharField()
+    payload = TextField()
+    status = CharField(default='queued')
+    progress = FloatField(default=0)
+    result = TextField(null=True)
+    error = TextField(null=True)
+    attempts = IntegerField(default=0)
+    max_attempts = IntegerField()
+    idempotency_key = CharField(null=True, unique=True)
+    run_after = DateTimeField()
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+    created_at = DateTimeField()
+
+    class Meta:
+        table_name = 'job'
+        indexes = (
+            (('status', 'run_after'), False),
+        )
+
+
+def upgrade(migrator):
+    # Table of the background job queue
+    with migrator.database.bind_ctx([Job]):
+        Job.create_table()
@@ -0,0 +1,14 @@
+from peewee import SqliteDatabase
+
+
+def upgrade(migrator):
+    # Full-text index of text_search.py on recipe(name, description): a FULLTEXT index on MySQL,
+    # kept in sync by InnoDB, or an FTS5 table on SQLite, filled here and kept in sync by the recipe writes
+    if isinstance(migrator.database, SqliteDatabase):
+        migrator.database.execute_sql('CREATE VIRTUAL TABLE "recipe_fts" USING fts5 ("name", "description")')
+        migrator.database.execute_sql('INSERT INTO "recipe_fts" ("rowid", "name", "description") SELECT "id", "name", "description" FROM "recipe"')
+    else:
+        migrator.database.execute_sql('CREATE FULLTEXT INDEX recipe_fulltext ON recipe (name, description)')
+
+# the models don't declare the full-text index, so it is also created for a new database
+create = upgrade
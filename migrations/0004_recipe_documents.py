@@ -0,0 +1,32 @@
+from peewee import IntegerField, Model, SqliteDatabase
+from playhouse.migrate import migrate
+
+from models import LongTextField
+
+
+class RecipeDocument(Model):
+    # the recipedocument table as this migration creates it
+    id = IntegerField(primary_key=True)
+    kategori = IntegerField(index=True, column_name='id_kategori')
+    body = LongTextField()
+
+    class Meta:
+        table_name = 'recipedocument'
+
+
+def upgrade(migrator):
+    # Table of the materialized recipe documents of recipe_documents.py. It used to be created by the
+    # first request, with a TEXT body that MySQL limits to 64 KB.
+    with migrator.database.bind_ctx([RecipeDocument]):
+        if not RecipeDocument.table_exists():
+            RecipeDocument.create_table()
+        elif not isinstance(migrator.database, SqliteDatabase):
+            migrate(migrator.alter_column_type('recipedocument', 'body', LongTextField()))
+
+
+def backfill():
+    # Write the documents of the existing recipes, in a transaction per batch. Run by
+    # `python -m migrations` once the migration is applied, `python -m recipe_documents`
+    # and the rebuild_documents job do the same.
+    from recipe_documents import recipe_documents
+    recipe_documents.rebuild()
@@ -0,0 +1,16 @@
+from peewee import SqliteDatabase
+from playhouse.migrate import migrate
+
+from models import LongTextField
+
+
+def upgrade(migrator):
+    # Checkpoint of the import jobs, and LONGTEXT payloads and results: MySQL limits TEXT to 64 KB,
+    # less than the rows of a large import
+    operations = [migrator.add_column('job', 'checkpoint', LongTextField(null=True))]
+    if not isinstance(migrator.database, SqliteDatabase):
+        operations += [
+            migrator.alter_column_type('job', 'payload', LongTextField()),
+            migrator.alter_column_type('job', 'result', LongTextField(null=True)),
+        ]
+    migrate(*operations)
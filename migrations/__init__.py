@@ -0,0 +1,98 @@
+import datetime
+import importlib
+import os
+import re
+
+from peewee import CharField, DateTimeField, IntegerField
+from playhouse.migrate import SchemaMigrator
+
+from models import database, BaseModel, Recipe, create_tables
+
+
+# Versioned schema migrations. Every NNNN_name.py module of this package defines
+# upgrade(migrator), which receives a playhouse.migrate SchemaMigrator. Applied versions
+# are recorded in the schema_version table.
+#
+# A database without tables is created from the models, which already declare the result of
+# every migration, and all migrations are recorded as applied. A migration creating something
+# the models can't declare also defines create(migrator), which runs for a new database.
+# Migrations of an existing database run in order, each in a transaction (MySQL commits DDL
+# statements implicitly). A migration whose new table has to be filled from existing data defines
+# backfill(), which runs after the migrations are applied instead of in their transaction.
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class MigrationError(Exception):
+    # A migration can't be applied to the data of the database, nothing of it is applied
+    pass
+
+
+class SchemaVersion(BaseModel):
+    version = IntegerField(primary_key=True)
+    name = CharField()
+    applied_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'schema_version'
+
+
+def available():
+    # [(version, name)] of every migration module, in version order
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'^(\d{4})_(\w+)\.py$', filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2)))
+    return sorted(migrations)
+
+
+def applied():
+    if not SchemaVersion.table_exists():
+        return set()
+    return {version for version, in SchemaVersion.select(SchemaVersion.version).tuples()}
+
+
+def pending():
+    done = applied()
+    return [(version, name) for version, name in available() if version not in done]
+
+
+def import_migration(version, name):
+    return importlib.import_module(f'{__name__}.{version:04d}_{name}')
+
+
+def run(target=None):
+    # Apply the pending migrations up to target and return the [(version, name)] applied
+    with database.connection_context():
+        migrator = SchemaMigrator.from_database(database.obj)
+        if not Recipe.table_exists():
+            create_tables()
+            for version, name in available():
+                module = import_migration(version, name)
+                if hasattr(module, 'create'):
+                    module.create(migrator)
+            database.create_tables([SchemaVersion])
+            SchemaVersion.insert_many(available(), fields=[SchemaVersion.version, SchemaVersion.name]).execute()
+            return []
+
+        database.create_tables([SchemaVersion])
+        done = []
+        for version, name in pending():
+            if target is not None and version > target:
+                break
+            module = import_migration(version, name)
+            with database.atomic():
+                module.upgrade(migrator)
+                SchemaVersion.create(version=version, name=name)
+            done.append((version, name))
+        return done
+
+
+def backfill(migrations):
+    # Run the backfill of the applied [(version, name)] that define one
+    with database.connection_context():
+        for version, name in migrations:
+            module = import_migration(version, name)
+            if hasattr(module, 'backfill'):
+                module.backfill()
@@ -0,0 +1,26 @@
+import argparse
+import sys
+
+from migrations import MigrationError, applied, available, backfill, run
+from models import init_database
+
+
+parser = argparse.ArgumentParser(prog='python -m migrations', description='Apply the pending schema migrations')
+parser.add_argument('--target', type=int, help='stop after this version')
+parser.add_argument('--list', action='store_true', help='list the migrations and whether they are applied')
+args = parser.parse_args()
+init_database()
+
+if args.list:
+    done = applied()
+    for version, name in available():
+        print(f"{version:04d} {name:<40} {'applied' if version in done else 'pending'}")
+else:
+    try:
+        migrations = run(args.target)
+    except MigrationError as e:
+        sys.exit(f'migration failed: {e}')
+    for version, name in migrations:
+        print(f'applied {version:04d} {name}')
+    print(f'{len(migrations)} migrations applied')
+    backfill(migrations)
@@ -0,0 +1,133 @@
+from peewee import *
+
+from db_pool import MetricsPooledMySQLDatabase, MetricsPooledSqliteDatabase, ReplicaPooledMySQLDatabase, ReplicaPooledSqliteDatabase
+
+import dotenv, os
+
+
+# settings of the other modules are read from the environment when they are imported
+dotenv.load_dotenv()
+
+# The models are bound to this proxy, and the proxy to a database by init_database, so
+# importing the models needs no configuration and opens no connection.
+database = DatabaseProxy()
+
+# Connection pool settings of the bound database, shared by every database backend
+pool_options = {}
+
+
+def build_database(config):
+    # Database described by config, a mapping like os.environ
+    def setting(key, default=None):
+        return config.get(key, default)
+
+    pool_options.clear()
+    pool_options.update({
+        'max_connections': int(setting('DATABASE_MAX_CONNECTIONS', 20)),
+        'stale_timeout': int(setting('DATABASE_STALE_TIMEOUT', 300)),
+        'timeout': int(setting('DATABASE_POOL_TIMEOUT', 10))
+    })
+
+    if setting('DATABASE_ENGINE') == 'sqlite':
+        # SQLITE, the path may be a URI such as file:name?mode=memory&cache=shared
+        db = setting('DATABASE_SQLITE_PATH', 'mydatabase.db')
+        # read replicas, comma separated file paths
+        replicas = [ReplicaPooledSqliteDatabase(path, pragmas={'foreign_keys': 1}, check_same_thread=False, uri=True, **pool_options)
+                    for path in setting('DATABASE_SQLITE_REPLICAS', '').split(',') if path]
+        # pooled connections are handed to whichever thread borrows them next
+        return MetricsPooledSqliteDatabase(db, pragmas={'foreign_keys': 1}, check_same_thread=False, uri=True, replicas=replicas, **pool_options)
+
+    # MySQL PRODUCTION
+    # return MetricsPooledMySQLDatabase(setting('DATABASE_NAME'), user=setting('DATABASE_PROD_USER'), password=setting('DATABASE_PROD_PASSWORD'), host=setting('DATABASE_PROD_HOST'), port=int(setting('DATABASE_PROD_PORT')), **pool_options)
+
+    # read replicas, comma separated host:port with the user of the primary
+    replicas = [ReplicaPooledMySQLDatabase(setting('DATABASE_NAME'), user=setting('DATABASE_DEV_USER'), host=host, port=int(port), **pool_options)
+                for host, _, port in (replica.partition(':') for replica in setting('DATABASE_REPLICA_HOSTS', '').split(',') if replica)]
+
+    # MySQL DEV
+    return MetricsPooledMySQLDatabase(setting('DATABASE_NAME'), user=setting('DATABASE_DEV_USER'), host=setting('DATABASE_DEV_HOST'), port=int(setting('DATABASE_DEV_PORT')), replicas=replicas, **pool_options)
+
+def init_database(config=None):
+    # Bind the models to the database described by the environment, overridden by config.
+    # No connection is opened until the first query.
+    database.initialize(build_database({**os.environ, **(config or {})}))
+    return database.obj
+
+def is_sqlite():
+    return isinstance(database.obj, SqliteDatabase)
+
+class LongTextField(TextField):
+    # TEXT holds at most 64 KB on MySQL, LONGTEXT 4 GB. SQLite has no limit for either.
+    field_type = 'LONGTEXT'
+
+class BaseModel(Model):
+    class Meta:
+        database = database
+
+class Bahan(BaseModel):
+    id = AutoField()
+    name = CharField(unique=True)
+
+class Kategori(BaseModel):
+    id = AutoField()
+    name = CharField(unique=True)
+
+class Recipe(BaseModel):
+    id = AutoField()
+    name = CharField(index=True)
+    description = TextField()
+    kategori = ForeignKeyField(Kategori, backref='recipes', column_name = 'id_kategori')
+
+class RecipeBahan(BaseModel):
+    id = AutoField()
+    recipe = ForeignKeyField(Recipe, backref='recipe_bahan', column_name = 'id_recipe')
+    bahan = ForeignKeyField(Bahan, backref='recipe_bahan', column_name = 'id_bahan')
+    quantity = IntegerField(null=True)
+    satuan = CharField()
+
+    class Meta:
+        indexes = (
+            # a bahan is used once per recipe
+            (('recipe', 'bahan'), True),
+            # covers recipe_uses_bahan, id_bahan -> id_recipe without reading the rows
+            (('bahan', 'recipe'), False),
+        )
+
+class RecipeDocument(BaseModel):
+    # Recipe serialized with its kategori and ingredients, kept current by recipe_documents
+    id = IntegerField(primary_key=True)
+    # secondary indexes end with the primary key, so this also serves `id_kategori = ? AND id > ? ORDER BY id`
+    kategori = IntegerField(index=True, column_name = 'id_kategori')
+    body = LongTextField()
+
+class Job(BaseModel):
+    # Background job of the job queue in jobs.py
+    id = AutoField()
+    kind = CharField()
+    payload = LongTextField()
+    # queued, running, done or failed
+    status = CharField(default='queued')
+    progress = FloatField(default=0)
+    result = LongTextField(null=True)
+    error = TextField(null=True)
+    # progress of the job committed with its writes, a retried job resumes from it
+    checkpoint = LongTextField(null=True)
+    attempts = IntegerField(default=0)
+    max_attempts = IntegerField()
+    idempotency_key = CharField(null=True, unique=True)
+    # a queued job is not run before run_after, retries are delayed through it
+    run_after = DateTimeField()
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+    created_at = DateTimeField()
+
+    class Meta:
+        indexes = (
+            # covers the queue scan of workers: status = 'queued' AND run_after <= now
+            (('status', 'run_after'), False),
+        )
+
+def create_tables():
+    with database:
+        database.create_tables([Bahan, Kategori, Recipe, RecipeBahan, RecipeDocument, Job])
+
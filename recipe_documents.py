@@ -0,0 +1,138 @@
+import argparse
+import os
+
+from json_encoder import EncodedJson, dumps
+from models import database, init_database, Recipe, RecipeBahan, RecipeDocument
+from serializers import serialize_recipes
+
+
+# Number of recipes serialized per batch when documents are written
+DOCUMENT_BATCH_SIZE = int(os.getenv('DOCUMENT_BATCH_SIZE', 500))
+
+
+class RecipeDocuments():
+    # Materialized recipe documents: every recipe serialized once, with its kategori and
+    # ingredient names, and stored as JSON text keyed by the recipe id. Recipe writes and
+    # bahan/kategori renames refresh the documents they change, so recipe reads are a primary
+    # key or range lookup returning JSON that is already encoded.
+    # The table is created by migration 0004 and filled by its backfill, this process only checks
+    # once that it exists.
+
+    def __init__(self):
+        self._ready = False
+
+    def ensure(self):
+        if not self._ready:
+            if not RecipeDocument.table_exists():
+                raise RuntimeError('The recipe documents table is missing, run `python -m migrations`')
+            self._ready = True
+
+    def _write(self, ids):
+        # Serialize the given recipes in batches, documents of recipes that no longer exist are removed.
+        # Returns the written documents by recipe id.
+        ids = list(ids)
+        bodies = {}
+        for start in range(0, len(ids), DOCUMENT_BATCH_SIZE):
+            batch = ids[start:start + DOCUMENT_BATCH_SIZE]
+            recipes = serialize_recipes(Recipe.select().where(Recipe.id.in_(batch)))
+            RecipeDocument.delete().where(RecipeDocument.id.in_(batch)).execute()
+            if recipes:
+                rows = [{
+                    'id': recipe['id'],
+                    'kategori': recipe['kategori']['id'],
+                    'body': dumps(recipe).decode()
+                } for recipe in recipes]
+                RecipeDocument.insert_many(rows).execute()
+                bodies.update((row['id'], row['body']) for row in rows)
+        return bodies
+
+    def refresh(self, ids):
+        # Returns the refreshed documents by recipe id
+        self.ensure()
+        return self._write(ids)
+
+    def remove(self, id_recipe):
+        self.ensure()
+        RecipeDocument.delete().where(RecipeDocument.id == id_recipe).execute()
+
+    def refresh_kategori(self, id_kategori):
+        # Refresh the documents embedding a renamed kategori and return their ids
+        ids = [id for id, in Recipe.select(Recipe.id).where(Recipe.kategori == id_kategori).tuples()]
+        self.refresh(ids)
+        return ids
+
+    def refresh_bahan(self, id_bahan):
+        # Refresh the documents embedding a renamed bahan and return their ids
+        ids = [id for id, in RecipeBahan.select(RecipeBahan.recipe).where(RecipeBahan.bahan == id_bahan).distinct().tuples()]
+        self.refresh(ids)
+        return ids
+
+    def rebuild(self):
+        # Rewrite every document, one transaction per batch of recipe ids, and drop the documents
+        # of deleted recipes. Returns the number of documents written.
+        self.ensure()
+        count = 0
+        after_id = 0
+        while True:
+            ids = [id for id, in Recipe.select(Recipe.id).where(Recipe.id > after_id).order_by(Recipe.id).limit(DOCUMENT_BATCH_SIZE).tuples()]
+            if not ids:
+                break
+            with database.atomic():
+                self._write(ids)
+            count += len(ids)
+            after_id = ids[-1]
+        RecipeDocument.delete().where(RecipeDocument.id.not_in(Recipe.select(Recipe.id))).execute()
+        return count
+
+    def get(self, id_recipe):
+        # Encoded document of one recipe, or None
+        self.ensure()
+        row = RecipeDocument.select(RecipeDocument.body).where(RecipeDocument.id == id_recipe).tuples().first()
+        return row[0] if row is not None else None
+
+    def select(self, *where):
+        # Query of the (id, body) of the documents matching where, to be paginated by the caller
+        self.ensure()
+        query = RecipeDocument.select(RecipeDocument.id, RecipeDocument.body)
+        return query.where(*where) if where else query
+
+
+def document_json(message, body, id_recipe):
+    # ResponseJson envelope around one encoded document
+    body = f'{{"success": true, "message": {dumps(message).decode()}, "data": {body}, "error": null}}\n'
+    return EncodedJson(body.encode(), {'id': id_recipe})
+
+def document_list_json(message, bodies, next_cursor):
+    # ResponseListJson envelope around a page of encoded documents
+    data = '[' + ', '.join(bodies) + ']'
+    body = f'{{"success": true, "message": {dumps(message).decode()}, "data": {data}, "error": null, "next_cursor": {dumps(next_cursor).decode()}}}\n'
+    return EncodedJson(body.encode(), [])
+
+def encode_documents(bodies):
+    # Comma separated encoded documents, for stream_list_json
+    return ', '.join(bodies).encode()
+
+def document_batch_json(message, bodies, not_found):
+    # ResponseJson envelope around documents read by id, null for the ids listed in not_found
+    data = '[' + ', '.join(body if body is not None else 'null' for body in bodies) + ']'
+    error = dumps({'not_found': not_found}).decode() if not_found else 'null'
+    body = f'{{"success": true, "message": {dumps(message).decode()}, "data": {data}, "error": {error}}}\n'
+    return EncodedJson(body.encode(), [])
+
+
+recipe_documents = RecipeDocuments()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the materialized recipe documents')
+    parser.add_argument('--recipe', type=int, nargs='+', help='only refresh the documents of these recipe ids')
+    args = parser.parse_args()
+    init_database()
+
+    with database:
+        if args.recipe:
+            with database.atomic():
+                recipe_documents.refresh(args.recipe)
+            print(f'refreshed {len(args.recipe)} recipe documents')
+        else:
+            print(f'rebuilt {recipe_documents.rebuild()} recipe documents')
@@ -0,0 +1,301 @@
+import os
+import sqlite3
+
+from peewee import SQL, Case, Select, Value, fn
+
+from models import database, is_sqlite, Bahan, Kategori, Recipe, RecipeBahan, RecipeDocument
+from recipe_documents import recipe_documents
+from serializers import serialize_recipe_bahan
+from text_search import text_index
+from units import normalize, number
+
+
+# Data access shared by the resources. Reads return dict rows or None instead of raising,
+# so a handler fetches a row and answers 404 with a single query, and writes check
+# existence from the write itself rather than with a select before it.
+
+# Page size used by list endpoints when no limit is given, and the largest page a client may ask for
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+# Largest number of ids a batch read may ask for
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 100))
+
+# Recipe columns that may be asked for with fields=, and relations with include=
+RECIPE_FIELDS = ('id', 'name', 'description')
+RECIPE_RELATIONS = ('kategori', 'recipe_bahan')
+
+def supports_returning():
+    # UPDATE ... RETURNING is available on SQLite 3.35+ and Postgres, not on MySQL
+    return sqlite3.sqlite_version_info >= (3, 35, 0) if is_sqlite() else database.returning_clause
+
+
+def paginate(query, model, args):
+    # Keyset pagination: pages are read with an indexed `id > after_id` range scan instead of OFFSET.
+    # One extra row is fetched to know whether there is a next page.
+    limit = min(args['limit'] or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    if args['after_id'] is not None:
+        query = query.where(model.id > args['after_id'])
+    return query.order_by(model.id).limit(limit + 1), limit
+
+def next_page(rows, limit):
+    # Trim the extra row fetched by paginate and return the page with its next cursor
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['id']
+    return rows, None
+
+def id_list(value):
+    # Type of the id query args: an id, or a list of ids for a batch read when the value is comma separated
+    if ',' in value:
+        return [int(id) for id in value.split(',')]
+    return int(value)
+
+def field_list(allowed):
+    # Type of the fields and include query args: comma separated names out of allowed
+    def parse(value):
+        names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown {', '.join(unknown)}, expected some of {', '.join(allowed)}")
+        return names
+    return parse
+
+def in_request_order(ids, rows):
+    # Rows of a batch read in the order of ids with None for the ids that weren't found,
+    # and the list of those ids
+    by_id = {row['id']: row for row in rows}
+    return [by_id.get(id) for id in ids], [id for id in dict.fromkeys(ids) if id not in by_id]
+
+def recipe_uses_bahan(id_bahan, column=Recipe.id):
+    # Semi-join on RecipeBahan: filters recipes by ingredient without joining, so each recipe is returned once
+    return column.in_(RecipeBahan.select(RecipeBahan.recipe).where(RecipeBahan.bahan == id_bahan))
+
+def recipe_filters(args, id_column=Recipe.id, kategori_column=Recipe.kategori):
+    # Conditions of the id_kategori and id_bahan filters of ResourceRecipe.get
+    where = []
+    if args['id_kategori'] is not None:
+        where.append(kategori_column == args['id_kategori'])
+    if args['id_bahan'] is not None:
+        where.append(recipe_uses_bahan(args['id_bahan'], id_column))
+    return where
+
+def recipe_document_query(args):
+    # Documents matching the id_kategori and id_bahan filters of ResourceRecipe.get
+    return recipe_documents.select(*recipe_filters(args, RecipeDocument.id, RecipeDocument.kategori))
+
+def insert_ingredients(id_recipe, ingredients):
+    # Insert all RecipeBahan rows of a recipe with one insert_many
+    RecipeBahan.insert_many([{
+        'recipe': id_recipe,
+        'bahan': bahan.id_bahan,
+        'quantity': bahan.quantity,
+        'satuan': bahan.satuan
+    } for bahan in ingredients]).execute()
+
+def shopping_list(multipliers, normalize_units=True):
+    # Total quantity of every bahan used by the recipes of multipliers ({id_recipe: multiplier}),
+    # each recipe's quantities scaled by its multiplier. Totals are computed by one
+    # `GROUP BY id_bahan, satuan` query, then totals in units with the same base unit are merged.
+    quantity = RecipeBahan.quantity
+    if any(multiplier != 1 for multiplier in multipliers.values()):
+        # converter=False keeps fractional multipliers from being cast to int like the quantity column
+        quantity = quantity * Case(RecipeBahan.recipe, [(id, Value(multiplier, converter=False)) for id, multiplier in multipliers.items()])
+    query = (RecipeBahan
+             .select(RecipeBahan.bahan.alias('id_bahan'), Bahan.name, RecipeBahan.satuan, fn.SUM(quantity).alias('quantity'))
+             .join(Bahan)
+             .where(RecipeBahan.recipe.in_(list(multipliers)))
+             .group_by(RecipeBahan.bahan, Bahan.name, RecipeBahan.satuan)
+             .order_by(RecipeBahan.bahan, RecipeBahan.satuan)
+             .dicts())
+
+    totals = {}
+    for row in query:
+        quantity, satuan = normalize(row['quantity'], row['satuan']) if normalize_units else (row['quantity'], row['satuan'])
+        total = totals.setdefault((row['id_bahan'], satuan), {'id_bahan': row['id_bahan'], 'name': row['name'], 'quantity': None, 'satuan': satuan})
+        # quantity is NULL for amounts such as 'Secukupnya'
+        if quantity is not None:
+            total['quantity'] = (total['quantity'] or 0) + quantity
+    for total in totals.values():
+        total['quantity'] = number(total['quantity'])
+    return list(totals.values())
+
+def count(model, *where):
+    # `SELECT COUNT(*)` subquery, to read several counts in one round trip
+    return model.select(fn.COUNT(SQL('*'))).where(*where)
+
+
+class InUse(Exception):
+    # The row is used by a recipe and can't be deleted
+    pass
+
+
+class NamedRepository():
+    # Bahan and Kategori rows: an id and a unique name
+
+    def __init__(self, model, used_by, refresh_documents):
+        self.model = model
+        # column referencing this model, a row is in use while it is referenced
+        self.used_by = used_by
+        # refreshes the recipe documents showing a renamed row and returns their ids
+        self.refresh_documents = refresh_documents
+
+    def get(self, id):
+        return self.model.select().where(self.model.id == id).dicts().get_or_none()
+
+    def exists(self, id):
+        return self.model.select(self.model.id).where(self.model.id == id).exists()
+
+    def many_query(self, ids):
+        return self.model.select().where(self.model.id.in_(list(set(ids)))).dicts()
+
+    def get_many(self, ids):
+        # Rows in the order of ids, None for the ids that weren't found, and those ids
+        return in_request_order(ids, self.many_query(ids))
+
+    def page(self, args):
+        query, limit = paginate(self.model.select(), self.model, args)
+        return next_page(list(query.dicts()), limit)
+
+    def page_iterator(self, args):
+        # (id, row) pairs of a page read from the cursor as they are consumed, and the page size
+        query, limit = paginate(self.model.select(), self.model, args)
+        return ((row['id'], row) for row in query.dicts().iterator()), limit
+
+    def create(self, name):
+        return {'id': self.model.insert(name=name).execute(), 'name': name}
+
+    def rename(self, id, name):
+        # Returns the renamed row, or None when no row has this id, and the ids of the recipes
+        # whose documents were refreshed
+        with database.atomic():
+            update = self.model.update(name=name).where(self.model.id == id)
+            if supports_returning():
+                row = next(iter(update.returning(self.model.id, self.model.name).dicts().execute()), None)
+            elif self.exists(id):
+                # MySQL counts only changed rows, so the affected row count can't tell a missing row apart
+                update.execute()
+                row = {'id': id, 'name': name}
+            else:
+                row = None
+            return row, self.refresh_documents(id) if row is not None else []
+
+    def delete(self, id):
+        # Delete the row unless it is used. Returns False when no row has this id, raises InUse
+        used = fn.EXISTS(self.used_by.model.select(SQL('1')).where(self.used_by == id))
+        if self.model.delete().where(self.model.id == id, ~used).execute():
+            return True
+        if self.exists(id):
+            raise InUse()
+        return False
+
+
+class RecipeRepository():
+    # Recipes are written to their tables, the full-text index and their documents in one
+    # transaction, and read from the documents
+
+    def document(self, id):
+        # Encoded document of the recipe, or None
+        return recipe_documents.get(id)
+
+    def documents_query(self, ids):
+        return recipe_documents.select(RecipeDocument.id.in_(list(set(ids)))).dicts()
+
+    def documents(self, ids):
+        # Encoded documents in the order of ids, None for the ids that weren't found, and those ids
+        rows, not_found = in_request_order(ids, self.documents_query(ids))
+        return [row['body'] if row is not None else None for row in rows], not_found
+
+    def page(self, args):
+        # Encoded documents of a page of recipes matching the filters of args, and the next cursor
+        query, limit = paginate(recipe_document_query(args), RecipeDocument, args)
+        rows, next_cursor = next_page(list(query.dicts()), limit)
+        return [row['body'] for row in rows], next_cursor
+
+    def page_iterator(self, args):
+        # (id, encoded document) pairs of a page read from the cursor as they are consumed, and the page size
+        query, limit = paginate(recipe_document_query(args), RecipeDocument, args)
+        return query.tuples().iterator(), limit
+
+    def sparse_query(self, fields, include, *where):
+        # Recipes with only the columns in fields, and the id. The kategori is joined only when it is
+        # included, recipe_bahan is loaded by sparse.
+        query = Recipe.select(Recipe.id, *[getattr(Recipe, field) for field in fields if field != 'id'])
+        if 'kategori' in include:
+            query = query.select_extend(Kategori.id.alias('kategori_id'), Kategori.name.alias('kategori_name')).join(Kategori)
+        return query.where(*where) if where else query
+
+    def sparse(self, rows, include):
+        # Rows of a sparse_query with their included relations, recipe_bahan costs one more query
+        if 'kategori' in include:
+            for row in rows:
+                row['kategori'] = {'id': row.pop('kategori_id'), 'name': row.pop('kategori_name')}
+        if 'recipe_bahan' in include and rows:
+            recipe_bahan = serialize_recipe_bahan([row['id'] for row in rows])
+            for row in rows:
+                row['recipe_bahan'] = recipe_bahan[row['id']]
+        return rows
+
+    def get_sparse(self, id, fields, include):
+        rows = self.sparse(list(self.sparse_query(fields, include, Recipe.id == id).dicts()), include)
+        return rows[0] if rows else None
+
+    def get_many_sparse(self, ids, fields, include):
+        # Sparse recipes in the order of ids, None for the ids that weren't found, and those ids
+        query = self.sparse_query(fields, include, Recipe.id.in_(list(set(ids))))
+        return in_request_order(ids, self.sparse(list(query.dicts()), include))
+
+    def page_sparse(self, args, fields, include):
+        # A page of sparse recipes matching the filters of args, and the next cursor
+        query, limit = paginate(self.sparse_query(fields, include, *recipe_filters(args)), Recipe, args)
+        rows, next_cursor = next_page(list(query.dicts()), limit)
+        return self.sparse(rows, include), next_cursor
+
+    def missing_reference(self, id_kategori, ingredients=None, id_recipe=None):
+        # Check the recipe, kategori and bahan a write refers to with one query and return the
+        # name of the first one that doesn't exist, or None
+        id_bahan = {bahan.id_bahan for bahan in ingredients or []}
+        columns = [count(Kategori, Kategori.id == id_kategori).alias('kategori')]
+        if id_recipe is not None:
+            columns.append(count(Recipe, Recipe.id == id_recipe).alias('recipe'))
+        if id_bahan:
+            columns.append(count(Bahan, Bahan.id.in_(list(id_bahan))).alias('bahan'))
+        found = Select(columns=columns).bind(database).dicts().get()
+        if id_recipe is not None and not found['recipe']:
+            return 'Recipe'
+        if not found['kategori']:
+            return 'Kategori'
+        if id_bahan and found['bahan'] != len(id_bahan):
+            return 'Bahan'
+        return None
+
+    def create(self, recipe):
+        # Returns the id and the encoded document of the new recipe
+        with database.atomic():
+            id_recipe = Recipe.insert(name=recipe.name, description=recipe.description, kategori=recipe.id_kategori).execute()
+            insert_ingredients(id_recipe, recipe.ingredients)
+            text_index.index_recipes([(id_recipe, recipe.name, recipe.description)])
+            return id_recipe, recipe_documents.refresh([id_recipe])[id_recipe]
+
+    def update(self, recipe):
+        # Returns the encoded document of the updated recipe, ingredients are replaced when given
+        with database.atomic():
+            Recipe.update(name=recipe.name, description=recipe.description, kategori=recipe.id_kategori).where(Recipe.id == recipe.id_recipe).execute()
+            if recipe.ingredients is not None:
+                RecipeBahan.delete().where(RecipeBahan.recipe == recipe.id_recipe).execute()
+                insert_ingredients(recipe.id_recipe, recipe.ingredients)
+            text_index.index_recipes([(recipe.id_recipe, recipe.name, recipe.description)])
+            return recipe_documents.refresh([recipe.id_recipe])[recipe.id_recipe]
+
+    def delete(self, id):
+        # Returns False when no recipe has this id
+        with database.atomic():
+            RecipeBahan.delete().where(RecipeBahan.recipe == id).execute()
+            if not Recipe.delete().where(Recipe.id == id).execute():
+                return False
+            text_index.remove_recipe(id)
+            recipe_documents.remove(id)
+            return True
+
+
+bahan_repository = NamedRepository(Bahan, RecipeBahan.bahan, recipe_documents.refresh_bahan)
+kategori_repository = NamedRepository(Kategori, Recipe.kategori, recipe_documents.refresh_kategori)
+recipe_repository = RecipeRepository()
@@ -0,0 +1,71 @@
+import json
+
+from flask import make_response, request
+from peewee import BaseQuery
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from json_encoder import EncodedJson, encoder, output_json
+
+
+# Compact representations of the responses, negotiated with the Accept header. Lists of objects
+# in data are sent as columns and rows, so every key is sent once instead of once per row:
+#   {"success": true, ..., "data": {"columns": ["id", "name"], "rows": [[1, "Nasi Goreng"], ...]}}
+# application/vnd.tlab.columnar+json encodes them as JSON, application/msgpack as MessagePack
+# when the msgpack package is installed.
+JSON = 'application/json'
+COLUMNAR = 'application/vnd.tlab.columnar+json'
+MSGPACK = 'application/msgpack'
+
+
+def columnar(data):
+    # A list of objects as {'columns': [...], 'rows': [[...], ...]}, anything else as it is
+    if isinstance(data, BaseQuery):
+        data = list(data)
+    if not isinstance(data, list) or not data or not all(isinstance(row, dict) for row in data):
+        return data
+    columns = list(dict.fromkeys(key for row in data for key in row))
+    return {'columns': columns, 'rows': [[row.get(column) for column in columns] for row in data]}
+
+def compact(data):
+    # The response envelope with its data in columnar form, encoded bodies are decoded first
+    if isinstance(data, EncodedJson):
+        data = json.loads(data.body)
+    if isinstance(data, dict) and 'data' in data:
+        data = {**data, 'data': columnar(data['data'])}
+    return data
+
+def output_columnar(data, code, headers=None):
+    response = make_response(encoder.dumps(compact(data)) + b'\n', code)
+    response.headers.extend(headers or {})
+    response.mimetype = COLUMNAR
+    return response
+
+
+REPRESENTATIONS = {JSON: output_json, COLUMNAR: output_columnar}
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+if msgpack is not None:
+    def output_msgpack(data, code, headers=None):
+        response = make_response(msgpack.packb(compact(data), default=lambda obj: list(obj) if isinstance(obj, BaseQuery) else obj), code)
+        response.headers.extend(headers or {})
+        response.mimetype = MSGPACK
+        return response
+
+    REPRESENTATIONS[MSGPACK] = output_msgpack
+    REPRESENTATIONS['application/x-msgpack'] = output_msgpack
+
+
+def negotiate(accept=None):
+    # Media type of the response: the best match of the Accept header, of the current request
+    # unless it is given, and JSON when nothing else is asked for
+    accept = request.accept_mimetypes if accept is None else parse_accept_header(accept, MIMEAccept)
+    return accept.best_match(REPRESENTATIONS, default=JSON)
+
+def output(data, code, headers=None):
+    # Response in the negotiated representation
+    return REPRESENTATIONS[negotiate()](data, code, headers)
@@ -0,0 +1,15 @@
+from typing import Optional
+from pydantic import *
+
+class JobCreateSchema(BaseModel):
+    kind: str
+    payload: dict = {}
+    idempotency_key: Optional[constr(max_length=255)] = None
+    max_attempts: Optional[conint(ge=1, le=10)] = None
+
+class ImportJobPayload(BaseModel):
+    # rows of an import, validated one by one when the job runs
+    rows: list
+
+class DeleteRecipesJobPayload(BaseModel):
+    ids: conlist(int, min_items=1)
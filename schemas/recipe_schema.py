@@ -7,12 +7,20 @@ class Ingredient(BaseModel):
     quantity: Optional[int] = None
     satuan: str
 
+def unique_bahan(ingredients):
+    # RecipeBahan is unique on (id_recipe, id_bahan)
+    if ingredients is not None and len({ingredient.id_bahan for ingredient in ingredients}) != len(ingredients):
+        raise ValueError('Duplicate id_bahan in ingredients')
+    return ingredients
+
 class RecipeSchema(BaseModel):
     name: str
     description: str
     id_kategori: int
     ingredients: conlist(Ingredient, min_items=1)
 
+    _unique_bahan = validator('ingredients', allow_reuse=True)(unique_bahan)
+
 class RecipeUpdateSchema(BaseModel):
     id_recipe: int
     name: str
@@ -20,5 +28,30 @@ class RecipeUpdateSchema(BaseModel):
     id_kategori: int
     ingredients: Optional[conlist(Ingredient, min_items=1)] = None
 
+    _unique_bahan = validator('ingredients', allow_reuse=True)(unique_bahan)
+
+class IngredientImport(BaseModel):
+    # an ingredient of an imported recipe, its bahan given by id or by name
+    id_bahan: Optional[int] = None
+    bahan: Optional[str] = None
+    quantity: Optional[int] = None
+    satuan: str
+
+class RecipeImportSchema(BaseModel):
+    # shape of an imported recipe row before its kategori and bahan names are resolved to ids
+    name: str
+    description: str
+    id_kategori: Optional[int] = None
+    kategori: Optional[str] = None
+    ingredients: conlist(IngredientImport, min_items=1)
+
 class RecipeDeleteSchema(BaseModel):
-    id_recipe: int
\ No newline at end of file
+    id_recipe: int
+
+class ShoppingListRecipe(BaseModel):
+    id_recipe: int
+    multiplier: confloat(gt=0) = 1
+
+class ShoppingListSchema(BaseModel):
+    recipes: conlist(ShoppingListRecipe, min_items=1, max_items=1000)
+    normalize: bool = True
@@ -0,0 +1,125 @@
+import heapq
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from bisect import bisect_left, insort
+from itertools import chain
+
+from models import RecipeBahan
+from etag import table_versions
+
+
+# Seconds an index may miss the writes of other processes when the version counters aren't shared
+BAHAN_INDEX_MAX_AGE = float(os.getenv('BAHAN_INDEX_MAX_AGE', 60))
+
+
+class BahanRecipeIndex():
+    # In-memory inverted index from bahan id to the sorted ids of the recipes using it.
+    # It is built from RecipeBahan on first use and kept up to date by the recipe write
+    # handlers of this process. The index is rebuilt on the next search when the recipe version
+    # moves without this process seeing the write (a bulk import, or another worker when the
+    # versions are shared). The versions of the memory backend only count the writes of this
+    # process, so then the index is also rebuilt once it is older than max_age seconds.
+    #
+    # Recipe ids and bahan ids are kept in array('i'), and the ingredient count of every recipe in
+    # an array indexed by recipe id, which keeps the index small and the ranking loop fast.
+
+    def __init__(self, versions, max_age=BAHAN_INDEX_MAX_AGE):
+        self.versions = versions
+        self.max_age = max_age
+        self.version = None
+        self.built_at = None
+        self._postings = {}
+        self._recipes = {}
+        self._sizes = array('I')
+        self._lock = threading.RLock()
+
+    def build(self):
+        with self._lock:
+            version = self.versions.current('recipe')[0]
+            built_at = time.monotonic()
+            recipes = {}
+            query = RecipeBahan.select(RecipeBahan.recipe, RecipeBahan.bahan).order_by(RecipeBahan.recipe).tuples()
+            for id_recipe, id_bahan in query.iterator():
+                recipes.setdefault(id_recipe, []).append(id_bahan)
+
+            postings = {}
+            for id_recipe, bahan in recipes.items():
+                for id_bahan in set(bahan):
+                    postings.setdefault(id_bahan, array('i')).append(id_recipe)
+            self._postings = postings
+            self._recipes = {id_recipe: array('i', sorted(set(bahan))) for id_recipe, bahan in recipes.items()}
+            self._sizes = array('I', bytes(4 * (max(recipes, default=0) + 1)))
+            for id_recipe, bahan in self._recipes.items():
+                self._sizes[id_recipe] = len(bahan)
+            self.version = version
+            self.built_at = built_at
+
+    def ensure_current(self):
+        if self.version != self.versions.current('recipe')[0]:
+            self.build()
+        elif not self.versions.shared and time.monotonic() - self.built_at > self.max_age:
+            self.build()
+
+    def _adopt_version(self):
+        # Keep the index version in step only if our own write was the sole change
+        current = self.versions.current('recipe')[0]
+        if self.version is not None and current == self.version + 1:
+            self.version = current
+
+    def _remove(self, id_recipe):
+        if id_recipe < len(self._sizes):
+            self._sizes[id_recipe] = 0
+        for id_bahan in self._recipes.pop(id_recipe, ()):
+            posting = self._postings[id_bahan]
+            i = bisect_left(posting, id_recipe)
+            if i < len(posting) and posting[i] == id_recipe:
+                posting.pop(i)
+            if not posting:
+                del self._postings[id_bahan]
+
+    def set_recipe(self, id_recipe, bahan_ids=None):
+        # bahan_ids None means the recipe was written without changing its ingredients
+        with self._lock:
+            if self.version is None:
+                return
+            if bahan_ids is not None:
+                self._remove(id_recipe)
+                bahan = array('i', sorted(set(bahan_ids)))
+                self._recipes[id_recipe] = bahan
+                if id_recipe >= len(self._sizes):
+                    self._sizes.frombytes(bytes(4 * (id_recipe + 1 - len(self._sizes))))
+                self._sizes[id_recipe] = len(bahan)
+                for id_bahan in bahan:
+                    insort(self._postings.setdefault(id_bahan, array('i')), id_recipe)
+            self._adopt_version()
+
+    def remove_recipe(self, id_recipe):
+        with self._lock:
+            if self.version is None:
+                return
+            self._remove(id_recipe)
+            self._adopt_version()
+
+    def search(self, bahan_ids, max_missing=None, limit=None):
+        # Rank recipes using any of bahan_ids by the number of ingredients still missing,
+        # then by the number of ingredients matched. Returns (id_recipe, matched, missing bahan ids).
+        self.ensure_current()
+        bahan_ids = set(bahan_ids)
+        with self._lock:
+            # Counter counts the chained posting lists in C
+            postings = self._postings
+            matched = Counter(chain.from_iterable(postings.get(id_bahan, ()) for id_bahan in bahan_ids))
+
+            sizes = self._sizes
+            ranked = [(sizes[id_recipe] - count, -count, id_recipe) for id_recipe, count in matched.items()]
+            if max_missing is not None:
+                ranked = [rank for rank in ranked if rank[0] <= max_missing]
+            ranked = heapq.nsmallest(limit, ranked) if limit is not None else sorted(ranked)
+            return [(id_recipe, -count, [id_bahan for id_bahan in self._recipes[id_recipe] if id_bahan not in bahan_ids])
+                    for missing, count, id_recipe in ranked]
+
+
+bahan_index = BahanRecipeIndex(table_versions)
@@ -0,0 +1,42 @@
+from models import Bahan, Kategori, RecipeBahan
+
+
+def serialize_recipes(recipes):
+    # Serialize a Recipe select query into the same shape as model_to_dict(recipe, backrefs=True).
+    # kategori, recipe_bahan and bahan are loaded in bulk, so the number of queries stays fixed
+    # no matter how many recipes are returned.
+    recipes = list(recipes.dicts())
+    if not recipes:
+        return []
+
+    # Load every kategori referenced by the recipes in one query
+    kategori_ids = {r['kategori'] for r in recipes}
+    kategori = {k['id']: k for k in Kategori.select().where(Kategori.id.in_(kategori_ids)).dicts()}
+
+    recipe_bahan = serialize_recipe_bahan([r['id'] for r in recipes])
+
+    return [{
+        'id': r['id'],
+        'name': r['name'],
+        'description': r['description'],
+        'kategori': kategori[r['kategori']],
+        'recipe_bahan': recipe_bahan[r['id']]
+    } for r in recipes]
+
+def serialize_recipe_bahan(ids):
+    # The recipe_bahan list of every recipe id, each row with its bahan, loaded in one query
+    recipe_bahan = {id: [] for id in ids}
+    query = (RecipeBahan
+             .select(RecipeBahan.id, RecipeBahan.recipe, Bahan.id, Bahan.name, RecipeBahan.quantity, RecipeBahan.satuan)
+             .join(Bahan)
+             .where(RecipeBahan.recipe.in_(list(recipe_bahan)))
+             .order_by(RecipeBahan.id)
+             .tuples())
+    for id_recipe_bahan, id_recipe, id_bahan, bahan_name, quantity, satuan in query:
+        recipe_bahan[id_recipe].append({
+            'id': id_recipe_bahan,
+            'bahan': {'id': id_bahan, 'name': bahan_name},
+            'quantity': quantity,
+            'satuan': satuan
+        })
+    return recipe_bahan
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from admission import ConcurrencyLimiter, TokenBuckets, forwarded_client, parse_endpoint_limits, parse_limit, rate_limiter, expensive_requests
+
+
+@pytest.fixture()
+def limits(monkeypatch):
+    # fresh buckets with the rate limiter enabled, the suite runs with it disabled
+    monkeypatch.setattr(rate_limiter, 'backend', TokenBuckets())
+    monkeypatch.setattr(rate_limiter, 'enabled', True)
+    monkeypatch.setattr(rate_limiter, 'client_limit', None)
+    monkeypatch.setattr(rate_limiter, 'endpoint_limits', {})
+    return rate_limiter
+
+def test_parse_limits():
+    assert parse_limit('20:40') == (20, 40)
+    assert parse_limit('5') == (5, 5)
+    assert parse_limit('') is None
+    assert parse_limit('0') is None
+    assert parse_endpoint_limits('GET /api/recipe=1:2, POST /api/recipe/shopping-list=0.5') == {
+        'GET /api/recipe': (1, 2),
+        'POST /api/recipe/shopping-list': (0.5, 1),
+    }
+
+def test_token_bucket_refills():
+    buckets = TokenBuckets()
+    assert buckets.take([('a', 10, 2)]) == 0
+    assert buckets.take([('a', 10, 2)]) == 0
+    wait = buckets.take([('a', 10, 2)])
+    assert 0 < wait <= 0.1
+    # other buckets are unaffected, and a rejected request takes no token from them
+    assert buckets.take([('b', 10, 1), ('a', 10, 2)]) > 0
+    assert buckets.take([('b', 10, 1)]) == 0
+    time.sleep(wait)
+    assert buckets.take([('a', 10, 2)]) == 0
+
+def test_client_over_its_limit_is_rejected(client, limits):
+    limits.client_limit = (0.5, 2)
+    assert client.get('/api/kategori?id_kategori=1').status_code == 200
+    assert client.get('/api/kategori?id_kategori=1').status_code == 200
+    res = client.get('/api/kategori?id_kategori=1')
+    assert res.status_code == 429
+    assert res.json['message'] == 'Too Many Requests'
+    assert res.headers['Retry-After'] == '2'
+
+def test_clients_behind_a_proxy_are_limited_by_forwarded_address(app, client, limits, monkeypatch):
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    limits.client_limit = (0.5, 1)
+    assert client.get('/api/kategori?id_kategori=1', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 200
+    assert client.get('/api/kategori?id_kategori=1', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 429
+    assert client.get('/api/kategori?id_kategori=1', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 200
+
+def test_forwarded_client():
+    assert forwarded_client('127.0.0.1', '10.0.0.1, 10.0.0.2', trusted=1) == '10.0.0.2'
+    assert forwarded_client('127.0.0.1', '10.0.0.1, 10.0.0.2', trusted=2) == '10.0.0.1'
+    # the header is ignored without trusted proxies, or when it has fewer addresses than them
+    assert forwarded_client('127.0.0.1', '10.0.0.1', trusted=0) == '127.0.0.1'
+    assert forwarded_client('127.0.0.1', '10.0.0.1', trusted=2) == '127.0.0.1'
+    assert forwarded_client('127.0.0.1', None, trusted=1) == '127.0.0.1'
+
+def test_rejected_requests_are_counted(client, limits):
+    limits.endpoint_limits = {'GET /api/bahan': (0.5, 1)}
+    assert client.get('/api/bahan?id_bahan=1').status_code == 200
+    assert client.get('/api/bahan?id_bahan=1').status_code == 429
+    assert 'http_requests_total{method="GET",endpoint="/api/bahan",status="429"}' in client.get('/metrics').data.decode()
+
+def test_endpoint_limit_leaves_other_endpoints(client, limits):
+    limits.endpoint_limits = {'GET /api/recipe': (0.5, 1)}
+    assert client.get('/api/recipe?limit=1').status_code == 200
+    assert client.get('/api/recipe?limit=1').status_code == 429
+    assert client.get('/api/kategori').status_code == 200
+
+def test_expensive_requests_are_shed(client, monkeypatch):
+    monkeypatch.setattr(expensive_requests, 'limit', 1)
+    monkeypatch.setattr(expensive_requests, 'queue_size', 0)
+    assert expensive_requests.acquire()
+    try:
+        res = client.get('/api/recipe?limit=1')
+        assert res.status_code == 503
+        assert res.json['message'] == 'Server Busy'
+        # cheap endpoints and lookups by id don't wait for the expensive requests
+        assert client.get('/api/kategori').status_code == 200
+        assert client.get('/api/recipe?id_recipe=1').status_code == 200
+    finally:
+        expensive_requests.release()
+    assert client.get('/api/recipe?limit=1').status_code == 200
+    assert expensive_requests.running == 0
+
+def test_concurrency_limiter_queue():
+    limiter = ConcurrencyLimiter(1, queue_size=1, queue_timeout=5)
+    assert limiter.acquire()
+
+    # a queued request runs once the running one is released
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire()))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+    # the queue is full
+    assert not limiter.acquire()
+    limiter.release()
+    waiter.join()
+    assert admitted == [True]
+    assert limiter.running == 1
+
+    # a queued request gives up after queue_timeout
+    limiter.queue_timeout = 0.01
+    assert not limiter.acquire()
+    assert limiter.waiting == 0
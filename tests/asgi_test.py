@@ -0,0 +1,127 @@
+import asyncio
+import importlib
+import json
+
+import pytest
+
+from models import is_sqlite
+
+
+@pytest.fixture()
+def asgi():
+    # the ASGI app needs the async driver of the configured database
+    pytest.importorskip('aiosqlite' if is_sqlite() else 'aiomysql')
+    module = importlib.import_module('asgi')
+    # what the lifespan startup of the server does
+    module.prepare_indexes()
+    return module
+
+def call(asgi, method, path, body=None, headers=(), chunks=None, messages=None):
+    # Send one request to the ASGI app and return (status, headers, body). The body is JSON unless
+    # it is given as chunks of bytes, each sent in its own message. messages collects what the app sent.
+    path, _, query_string = path.partition('?')
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string.encode(),
+        'headers': [(b'content-type', b'application/json'), *[(key.encode(), value.encode()) for key, value in headers]],
+    }
+    chunks = list(chunks) if chunks is not None else [json.dumps(body).encode() if body is not None else b'']
+    messages = [] if messages is None else messages
+
+    async def receive():
+        body = chunks.pop(0)
+        return {'type': 'http.request', 'body': body, 'more_body': bool(chunks)}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        try:
+            await asgi.app(scope, receive, send)
+        finally:
+            # pooled connections belong to the event loop of this call
+            await asgi.async_database.close()
+
+    asyncio.run(run())
+    start, *bodies = messages
+    assert not bodies[-1].get('more_body', False)
+    return start['status'], {key.decode(): value.decode() for key, value in start['headers']}, b''.join(body['body'] for body in bodies)
+
+def test_async_reads_match_sync_app(asgi, client):
+    for path in ['/api/bahan', '/api/bahan?id_bahan=1', '/api/kategori?limit=1', '/api/recipe',
+                 '/api/recipe?id_recipe=1', '/api/recipe?id_bahan=2&limit=1', '/api/recipe?id_kategori=2&id_bahan=1',
+                 '/api/bahan?id_bahan=2,1000000,1', '/api/kategori?id_kategori=1,2', '/api/recipe?id_recipe=1,1000000',
+                 '/api/recipe?limit=2&fields=name&include=kategori']:
+        status, headers, body = call(asgi, 'GET', path)
+        res = client.get(path)
+        assert status == res.status_code == 200
+        assert json.loads(body) == res.json
+        assert headers['etag'] == res.headers['ETag']
+
+    for path in ['/api/bahan?id_bahan=1000000', '/api/recipe?id_recipe=1000000', '/api/recipe?id_kategori=1000000', '/api/recipe?limit=0']:
+        status, headers, body = call(asgi, 'GET', path)
+        res = client.get(path)
+        assert status == res.status_code
+        assert json.loads(body) == res.json
+
+    status, headers, body = call(asgi, 'GET', '/api/recipe?id_recipe=x')
+    assert status == 400
+
+def test_compact_representation_runs_on_sync_app(asgi, client):
+    accept = 'application/vnd.tlab.columnar+json'
+    status, headers, body = call(asgi, 'GET', '/api/bahan?limit=2', headers=[('accept', accept)])
+    res = client.get('/api/bahan?limit=2', headers={'Accept': accept})
+    assert status == 200
+    assert headers['content-type'] == accept
+    assert json.loads(body) == res.json
+
+def test_async_not_modified(asgi):
+    status, headers, body = call(asgi, 'GET', '/api/recipe?id_recipe=1')
+    status, _, body = call(asgi, 'GET', '/api/recipe?id_recipe=1', headers=[('if-none-match', headers['etag'])])
+    assert status == 304
+    assert body == b''
+
+def test_writes_run_on_sync_app(asgi):
+    status, _, body = call(asgi, 'POST', '/api/bahan', body={'name': 'Bahan ASGI'})
+    assert status == 201
+    id_bahan = json.loads(body)['data']['id']
+
+    status, _, body = call(asgi, 'GET', f'/api/bahan?id_bahan={id_bahan}')
+    assert json.loads(body)['data']['name'] == 'Bahan ASGI'
+
+    status, _, body = call(asgi, 'DELETE', '/api/bahan', body={'id_bahan': id_bahan})
+    assert status == 200
+
+def test_async_reads_are_rate_limited(asgi, monkeypatch):
+    from admission import TokenBuckets, rate_limiter
+
+    monkeypatch.setattr(rate_limiter, 'backend', TokenBuckets())
+    monkeypatch.setattr(rate_limiter, 'enabled', True)
+    monkeypatch.setattr(rate_limiter, 'client_limit', None)
+    monkeypatch.setattr(rate_limiter, 'endpoint_limits', {'GET /api/kategori': (1, 1)})
+    assert call(asgi, 'GET', '/api/kategori')[0] == 200
+    status, headers, body = call(asgi, 'GET', '/api/kategori')
+    assert status == 429
+    assert headers['retry-after'] == '1'
+
+def test_sync_app_bodies_are_streamed(asgi, client):
+    # an NDJSON import sent in several messages, split inside a row
+    rows = b'{"name": "Bahan ASGI Stream 1"}\n{"name": "Bahan ASGI Stream 2"}\n'
+    status, _, body = call(asgi, 'POST', '/api/bahan/import', chunks=[rows[:10], rows[10:40], rows[40:]],
+                           headers=[('content-type', 'application/x-ndjson')])
+    assert status == 200
+    results = json.loads(body)['data']['results']
+    assert [r['success'] for r in results] == [True, True]
+
+    # the export is sent a row at a time as the app yields them
+    messages = []
+    status, _, body = call(asgi, 'GET', '/api/bahan/export', messages=messages)
+    assert status == 200
+    exported = [json.loads(line) for line in body.decode().splitlines()]
+    assert len(messages) - 2 >= len(exported) > 1
+    assert [row['name'] for row in exported if row['id'] in {r['id'] for r in results}] == ['Bahan ASGI Stream 1', 'Bahan ASGI Stream 2']
+
+    for result in results:
+        assert client.delete('/api/bahan', json={'id_bahan': result['id']}).status_code == 200
@@ -20,6 +20,17 @@ def test_get_bahan_by_id_not_found(client):
     assert res.status_code == 404
     assert res.json == expected_error
 
+def test_get_bahan_batch(client):
+    res = client.get('/api/bahan?id_bahan=2,100000,1,2')
+    assert res.status_code == 200
+    assert [bahan and bahan['id'] for bahan in res.json['data']] == [2, None, 1, 2]
+    assert res.json['error'] == {'not_found': [100000]}
+
+def test_get_bahan_batch_too_many_ids(client):
+    res = client.get('/api/bahan?id_bahan=' + ','.join(str(id) for id in range(1, 1000)))
+    assert res.status_code == 400
+    assert res.json['message'] == 'Too Many Ids'
+
 def test_create_bahan(client):
     # Crete bahan
     res = client.post('/api/bahan', json={'name': 'Bahan Test Create'})
@@ -71,4 +82,44 @@ def test_delete_bahan(client):
     response_json  = res.json
 
     assert res.status_code == 200
-    assert response_json['success'] == True
\ No newline at end of file
+    assert response_json['success'] == True
+
+def test_get_bahan_paginated(client):
+    # walk all bahan one page at a time
+    res = client.get('/api/bahan')
+    assert res.status_code == 200
+    all_bahan = res.json['data']
+
+    pages = []
+    res = client.get('/api/bahan?limit=1')
+    while True:
+        assert res.status_code == 200
+        assert len(res.json['data']) <= 1
+        pages += res.json['data']
+        if res.json['next_cursor'] is None:
+            break
+        res = client.get(f"/api/bahan?limit=1&after_id={res.json['next_cursor']}")
+    assert pages == all_bahan
+
+def test_get_bahan_invalid_limit(client):
+    res = client.get('/api/bahan?limit=0')
+    assert res.status_code == 400
+    assert res.json['success'] == False
+
+def test_get_bahan_streamed(client, monkeypatch):
+    import app
+    import json_encoder
+    from cache import response_cache
+
+    monkeypatch.setattr(response_cache, 'enabled', False)
+    built = client.get("/api/bahan?limit=1").json
+
+    monkeypatch.setattr(app, 'STREAM_MIN_ROWS', 1)
+    monkeypatch.setattr(json_encoder, 'STREAM_CHUNK_SIZE', 1)
+    res = client.get("/api/bahan?limit=1")
+    assert res.is_streamed
+    assert res.json == built
+
+    res = client.get("/api/bahan?limit=1000")
+    assert res.json['next_cursor'] is None
+    assert len(res.json['data']) == len({r['id'] for r in res.json['data']}) > 1
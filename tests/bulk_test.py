@@ -0,0 +1,109 @@
+import json
+
+
+def test_import_bahan_ndjson(client):
+    body = '\n'.join(json.dumps(row) for row in [
+        {'name': 'Bahan Import 1'},
+        {'name': 'Bahan Import 2'},
+        {'name': 'Bahan Import 1'},
+        {'nama': 'Bahan Import 3'},
+    ])
+    res = client.post('/api/bahan/import', data=body, content_type='application/x-ndjson')
+    response_json = res.json
+
+    assert res.status_code == 200
+    assert response_json['success'] == False
+    assert response_json['data']['created'] == 2
+    assert response_json['data']['failed'] == 2
+    results = response_json['data']['results']
+    assert [r['success'] for r in results] == [True, True, False, False]
+
+    # importing the same name again reports the existing id
+    res = client.post('/api/bahan/import', json=[{'name': 'Bahan Import 1'}])
+    assert res.json['data']['results'][0]['id'] == results[0]['id']
+    assert res.json['data']['results'][0]['success'] == False
+
+    # delete bahan
+    for result in results[:2]:
+        assert client.delete('/api/bahan', json={'id_bahan': result['id']}).status_code == 200
+
+def test_import_invalid_body(client):
+    res = client.post('/api/kategori/import', json={'name': 'Not An Array'})
+    assert res.status_code == 400
+    assert res.json['success'] == False
+
+def test_import_and_export_recipe(client):
+    # Create Kategori and Bahan referenced by name
+    kategori = client.post('/api/kategori/import', json=[{'name': 'Kategori Import'}]).json['data']['results']
+    bahan = client.post('/api/bahan/import', json=[{'name': 'Bahan Recipe Import'}, {'name': 'Bahan Recipe Import 2'}]).json['data']['results']
+
+    rows = [
+        {'name': 'Recipe Import', 'description': 'By name', 'kategori': 'Kategori Import',
+         'ingredients': [{'bahan': 'Bahan Recipe Import', 'quantity': 1, 'satuan': 'buah'}, {'bahan': 'Bahan Recipe Import 2', 'satuan': 'buah'}]},
+        {'name': 'Recipe Import 2', 'description': 'By id', 'id_kategori': kategori[0]['id'],
+         'ingredients': [{'id_bahan': bahan[0]['id'], 'satuan': 'buah'}]},
+        {'name': 'Recipe Import 3', 'description': 'Unknown bahan', 'id_kategori': kategori[0]['id'],
+         'ingredients': [{'id_bahan': 999999, 'satuan': 'buah'}]},
+    ]
+    res = client.post('/api/recipe/import', data='\n'.join(json.dumps(row) for row in rows), content_type='application/x-ndjson')
+    assert res.status_code == 200
+    results = res.json['data']['results']
+    assert [r['success'] for r in results] == [True, True, False]
+
+    res = client.get(f"/api/recipe?id_recipe={results[0]['id']}")
+    assert [rb['bahan']['id'] for rb in res.json['data']['recipe_bahan']] == [bahan[0]['id'], bahan[1]['id']]
+
+    # export streams every recipe as one NDJSON line
+    res = client.get('/api/recipe/export')
+    assert res.status_code == 200
+    assert res.mimetype == 'application/x-ndjson'
+    exported = {row['id']: row for row in map(json.loads, res.data.decode().splitlines())}
+    assert exported[results[0]['id']]['kategori'] == 'Kategori Import'
+    assert exported[results[1]['id']]['ingredients'][0]['bahan'] == 'Bahan Recipe Import'
+
+    # remove recipes, kategori and bahan
+    for result in results[:2]:
+        assert client.delete('/api/recipe', json={'id_recipe': result['id']}).status_code == 200
+    assert client.delete('/api/kategori', json={'id_kategori': kategori[0]['id']}).status_code == 200
+    for result in bahan:
+        assert client.delete('/api/bahan', json={'id_bahan': result['id']}).status_code == 200
+
+def test_export_bahan(client):
+    res = client.get('/api/bahan/export')
+    assert res.status_code == 200
+    exported = [json.loads(line) for line in res.data.decode().splitlines()]
+    assert any(row['id'] == 1 for row in exported)
+
+def test_import_names_ignore_case(client):
+    res = client.post('/api/bahan/import', json=[{'name': 'Bahan Case'}, {'name': 'BAHAN CASE'}])
+    results = res.json['data']['results']
+    assert [r['success'] for r in results] == [True, False]
+    assert results[1]['error'] == 'Duplicate Name In Import'
+
+    res = client.post('/api/bahan/import', json=[{'name': 'bahan case'}])
+    assert res.status_code == 200
+    assert res.json['data']['results'][0]['error'] == 'Name Already Exists'
+    assert client.delete('/api/bahan', json={'id_bahan': results[0]['id']}).status_code == 200
+
+def test_import_recipe_invalid_row(client):
+    rows = [
+        {'name': 'Recipe Invalid Row', 'description': 'Ok', 'id_kategori': 1, 'ingredients': [{'id_bahan': 1, 'satuan': 'buah'}]},
+        {'name': 'Recipe Invalid Row 2', 'description': 'Not a list', 'id_kategori': 1, 'ingredients': 5},
+    ]
+    res = client.post('/api/recipe/import', data='\n'.join([json.dumps(row) for row in rows] + ['{not json', '[1, 2]']), content_type='application/x-ndjson')
+    assert res.status_code == 200
+    assert res.json['success'] == False
+    # malformed rows are reported on their own, the valid row is imported
+    results = res.json['data']['results']
+    assert [r['success'] for r in results] == [True, False, False, False]
+    assert results[1]['error'][0]['loc'] == ['ingredients']
+    assert results[3]['error'] == 'Expected a JSON object'
+    assert client.delete('/api/recipe', json={'id_recipe': results[0]['id']}).status_code == 200
+
+def test_import_recipe_unknown_names(client):
+    rows = [
+        {'name': 'Recipe Unknown Kategori', 'description': 'Unknown kategori', 'kategori': 'Kategori Unknown', 'ingredients': [{'id_bahan': 1, 'satuan': 'buah'}]},
+        {'name': 'Recipe Unknown Bahan', 'description': 'Unknown bahan', 'id_kategori': 1, 'ingredients': [{'bahan': 'Bahan Unknown', 'satuan': 'buah'}]},
+    ]
+    results = client.post('/api/recipe/import', json=rows).json['data']['results']
+    assert [r['error'] for r in results] == ['Kategori Not Found', 'Bahan Not Found']
@@ -0,0 +1,201 @@
+import time
+
+import pytest
+
+
+class FakeRedis():
+    # minimal stand-in for redis.Redis with the commands used by the response cache
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def sadd(self, key, *members):
+        self.values.setdefault(key, set()).update(members)
+
+    def expire(self, key, seconds):
+        self.expires[key] = seconds
+
+    def smembers(self, key):
+        return set(self.values.get(key, ()))
+
+
+@pytest.fixture()
+def fake_redis(monkeypatch):
+    from cache import response_cache
+
+    backend = FakeRedis()
+    monkeypatch.setattr(response_cache, 'backend', backend)
+    return backend
+
+@pytest.fixture()
+def shared_versions(monkeypatch):
+    # the versions of CACHE_BACKEND=redis, the single test process shares its memory backend
+    from etag import table_versions
+
+    monkeypatch.setattr(table_versions, 'shared', True)
+    return table_versions
+
+def test_cache_hit_skips_database(client, query_counter):
+    res = client.get('/api/kategori?id_kategori=1')
+    assert res.status_code == 200
+
+    query_counter['count'] = 0
+    res_cached = client.get('/api/kategori?id_kategori=1')
+    assert res_cached.status_code == 200
+    assert res_cached.json == res.json
+    assert query_counter['count'] == 0
+
+def test_write_invalidates_list(client, fake_redis):
+    res = client.get('/api/bahan')
+    assert res.status_code == 200
+    assert any(key.startswith('response:bahan') for key in fake_redis.values)
+
+    # Create bahan, the cached list must not be served anymore
+    res_create = client.post('/api/bahan', json={'name': 'Bahan Test Cache'})
+    assert res_create.status_code == 201
+    id_bahan = res_create.json['data']['id']
+    assert not any(key.startswith('response:bahan') for key in fake_redis.values)
+
+    res = client.get(f'/api/bahan?after_id={id_bahan - 1}')
+    assert res.json['data'][0]['name'] == 'Bahan Test Cache'
+
+    # delete bahan
+    res_delete = client.delete('/api/bahan', json={'id_bahan': id_bahan})
+    assert res_delete.status_code == 200
+
+def test_rename_bahan_invalidates_recipe(client, fake_redis):
+    # Create Kategori, Bahan and Recipe
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Cache'}).json['data']['id']
+    id_bahan = client.post("/api/bahan", json={'name':'Bahan Cache'}).json['data']['id']
+    payload = {
+        "name": "Recipe Cache",
+        "description": "Recipe Cache",
+        "id_kategori": id_kategori,
+        "ingredients":[{'id_bahan':id_bahan,'satuan':'buah'}]
+    }
+    id_recipe = client.post("/api/recipe", json=payload).json['data']['id']
+
+    res = client.get(f"/api/recipe?id_recipe={id_recipe}")
+    assert res.json['data']['recipe_bahan'][0]['bahan']['name'] == 'Bahan Cache'
+
+    # Rename the bahan and kategori used by the cached recipe
+    assert client.put("/api/bahan", json={'id_bahan':id_bahan, 'name':'Bahan Cache 2'}).status_code == 200
+    res = client.get(f"/api/recipe?id_recipe={id_recipe}")
+    assert res.json['data']['recipe_bahan'][0]['bahan']['name'] == 'Bahan Cache 2'
+
+    assert client.put("/api/kategori", json={'id_kategori':id_kategori, 'name':'Kategori Cache 2'}).status_code == 200
+    res = client.get(f"/api/recipe?id_recipe={id_recipe}")
+    assert res.json['data']['kategori']['name'] == 'Kategori Cache 2'
+
+    # remove recipe, kategori and bahan
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe}).status_code == 200
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan}).status_code == 200
+
+def test_evicted_entries_leave_tag_sets():
+    from cache import LRUCache
+
+    cache = LRUCache(max_entries=2)
+    for i in range(3):
+        cache.set(f'response:{i}', b'body')
+        cache.sadd('tag:list', f'response:{i}')
+    assert cache.smembers('tag:list') == {'response:1', 'response:2'}
+
+    cache.set('response:3', b'body', ex=0.001)
+    cache.sadd('tag:3', 'response:3')
+    time.sleep(0.002)
+    assert cache.get('response:3') is None
+    assert cache.smembers('tag:3') == set()
+    assert cache._sets.keys() == {'tag:list'}
+
+def test_unknown_params_share_the_cache_key(client, fake_redis):
+    res = client.get('/api/kategori?id_kategori=1&x=1')
+    assert res.status_code == 200
+    assert client.get('/api/kategori?id_kategori=1&x=2').json == res.json
+    assert [key for key in fake_redis.values if key.startswith('response:kategori')] == ['response:kategori?id_kategori=1']
+
+def test_tag_sets_expire(client, fake_redis):
+    from cache import response_cache
+
+    assert client.get('/api/recipe?id_recipe=1').status_code == 200
+    tags = [key for key in fake_redis.values if key.startswith('tag:')]
+    assert 'tag:recipe:1' in tags
+    assert all(fake_redis.expires[tag] >= response_cache.ttl for tag in tags)
+
+def test_get_not_modified(client, query_counter, shared_versions):
+    res = client.get('/api/recipe?id_recipe=1')
+    assert res.status_code == 200
+    etag = res.headers['ETag']
+
+    # a matching ETag is answered without any query
+    query_counter['count'] = 0
+    res = client.get('/api/recipe?id_recipe=1', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    assert res.headers['ETag'] == etag
+    assert query_counter['count'] == 0
+
+    # ETags differ per query
+    res = client.get('/api/recipe?id_recipe=2', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+
+def test_write_changes_etag(client, shared_versions):
+    res = client.get('/api/recipe?id_recipe=1')
+    etag = res.headers['ETag']
+
+    # Any bahan write changes the recipe ETag
+    res_create = client.post('/api/bahan', json={'name': 'Bahan Test ETag'})
+    assert res_create.status_code == 201
+
+    res = client.get('/api/recipe?id_recipe=1', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
+
+    # delete bahan
+    res_delete = client.delete('/api/bahan', json={'id_bahan': res_create.json['data']['id']})
+    assert res_delete.status_code == 200
+
+def test_versions_of_restarted_backend_dont_repeat_etags(app):
+    from cache import LRUCache
+    from etag import TableVersions
+
+    with app.test_request_context('/api/recipe?id_recipe=1'):
+        versions = TableVersions(LRUCache(), shared=True)
+        versions.bump('recipe')
+        etag = versions.etag('recipe', ['recipe'])
+        # the backend lost its data and the counter starts over
+        versions.backend.flushdb()
+        versions.bump('recipe')
+        assert versions.current('recipe') == [1]
+        assert versions.etag('recipe', ['recipe']) != etag
+
+def test_unshared_versions_send_weak_body_etags(client, monkeypatch):
+    from cache import response_cache
+    from models import database, Kategori
+
+    monkeypatch.setattr(response_cache, 'enabled', False)
+    res = client.get('/api/kategori?id_kategori=1')
+    etag = res.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/api/kategori?id_kategori=1', headers={'If-None-Match': etag}).status_code == 304
+
+    # a write by another process, unseen by the version counters of this one, still changes the ETag
+    name = res.json['data']['name']
+    with database.connection_context():
+        Kategori.update(name='Kategori Other Worker').where(Kategori.id == 1).execute()
+    try:
+        res = client.get('/api/kategori?id_kategori=1', headers={'If-None-Match': etag})
+        assert res.status_code == 200
+        assert res.json['data']['name'] == 'Kategori Other Worker'
+    finally:
+        with database.connection_context():
+            Kategori.update(name=name).where(Kategori.id == 1).execute()
@@ -0,0 +1,48 @@
+import gzip
+import json
+
+import pytest
+
+import compression
+
+
+@pytest.fixture()
+def small_threshold(monkeypatch):
+    # the test database is small, compress every body
+    monkeypatch.setattr(compression, 'COMPRESS_MIN_SIZE', 16)
+
+def test_gzip_above_threshold(client, small_threshold):
+    plain = client.get('/api/recipe')
+    res = client.get('/api/recipe', headers={'Accept-Encoding': 'gzip'})
+    assert res.status_code == 200
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in res.headers['Vary']
+    assert json.loads(gzip.decompress(res.data)) == plain.json
+    assert res.headers['ETag'] == f"W/{plain.headers['ETag'].removeprefix('W/')}"
+
+    # the weak ETag of a compressed response is revalidated
+    assert client.get('/api/recipe', headers={'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']}).status_code == 304
+
+def test_small_and_unaccepted_bodies_are_not_compressed(client, monkeypatch):
+    res = client.get('/api/kategori?id_kategori=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in res.headers
+    assert res.json['data']['id'] == 1
+
+    monkeypatch.setattr(compression, 'COMPRESS_MIN_SIZE', 0)
+    for accept_encoding in ('', 'identity', 'gzip;q=0'):
+        res = client.get('/api/kategori', headers={'Accept-Encoding': accept_encoding})
+        assert 'Content-Encoding' not in res.headers
+        assert res.json['success']
+
+def test_brotli(client, small_threshold):
+    brotli = pytest.importorskip('brotli')
+    plain = client.get('/api/recipe')
+    res = client.get('/api/recipe', headers={'Accept-Encoding': 'gzip, br'})
+    assert res.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(res.data)) == plain.json
+
+def test_streamed_responses_are_compressed(client):
+    res = client.get('/api/bahan/export', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['Content-Encoding'] == 'gzip'
+    rows = [json.loads(line) for line in gzip.decompress(res.data).splitlines()]
+    assert rows == [json.loads(line) for line in client.get('/api/bahan/export').data.splitlines()]
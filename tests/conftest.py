@@ -2,13 +2,45 @@ import pytest
 import os
 import sys
 import inspect
+import sqlite3
+from contextlib import contextmanager
 
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
-from app import app as flask_app
+# the suite sends its requests faster than any client limit
+os.environ['RATE_LIMIT_ENABLED'] = '0'
 
+from app import create_app
+from migrations import backfill, run as run_migrations
+
+
+def memory_database():
+    # Every pytest-xdist worker runs against its own in-memory copy of the SQLite test database.
+    # A shared-cache memory database lives while a connection to it is open, so one is kept for the session.
+    uri = f"file:test_{os.getenv('PYTEST_XDIST_WORKER', 'main')}?mode=memory&cache=shared"
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    with sqlite3.connect(os.getenv('DATABASE_SQLITE_PATH', os.path.join(parentdir, 'mydatabase.db'))) as source:
+        source.backup(keeper)
+    return uri, keeper
+
+# The suite runs against an in-memory copy of mydatabase.db, whatever database .env points at.
+# TEST_DATABASE_ENGINE=mysql runs it against the MySQL database of the environment instead, which
+# it migrates and writes to, so only a database named *_test is accepted.
+if os.getenv('TEST_DATABASE_ENGINE', 'sqlite') == 'sqlite':
+    test_database, keep_test_database = memory_database()
+    flask_app = create_app({'TESTING': True, 'DATABASE_ENGINE': 'sqlite', 'DATABASE_SQLITE_PATH': test_database})
+elif os.getenv('DATABASE_NAME', '').endswith('_test'):
+    flask_app = create_app({'TESTING': True})
+else:
+    pytest.exit(f"TEST_DATABASE_ENGINE=mysql migrates the database under test, DATABASE_NAME={os.getenv('DATABASE_NAME')!r} doesn't end in _test", returncode=4)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def migrated_database():
+    # bring the test database to the current schema, with the data of the new tables
+    backfill(run_migrations())
 
 @pytest.fixture()
 def app():
@@ -16,4 +48,40 @@ def app():
 
 @pytest.fixture()
 def client(app):
-    return app.test_client()
\ No newline at end of file
+    return app.test_client()
+
+@pytest.fixture()
+def query_counter(monkeypatch):
+    # count every SQL statement executed against the app database
+    from app import database
+
+    counter = {'count': 0}
+    execute_sql = database.obj.execute_sql
+
+    def counting_execute_sql(*args, **kwargs):
+        counter['count'] += 1
+        return execute_sql(*args, **kwargs)
+
+    monkeypatch.setattr(database.obj, 'execute_sql', counting_execute_sql)
+    return counter
+
+@pytest.fixture()
+def query_budget(query_counter, monkeypatch):
+    # `with query_budget(n):` asserts the block executes exactly n SQL statements.
+    # The response cache is disabled and the lazily created tables are ready, so every
+    # request reaches the database and only runs its own queries.
+    from cache import response_cache
+    from recipe_documents import recipe_documents
+    from text_search import text_index
+
+    monkeypatch.setattr(response_cache, 'enabled', False)
+    recipe_documents.ensure()
+    text_index.ensure()
+
+    @contextmanager
+    def budget(expected):
+        start = query_counter['count']
+        yield
+        used = query_counter['count'] - start
+        assert used == expected, f'executed {used} queries, the budget is {expected}'
+    return budget
@@ -0,0 +1,45 @@
+def test_server_timing_header(client):
+    res = client.get('/api/recipe?id_recipe=1')
+    assert res.status_code == 200
+    assert 'db;dur=' in res.headers['Server-Timing']
+    assert 'total;dur=' in res.headers['Server-Timing']
+
+def test_metrics(client):
+    res = client.get('/api/kategori?id_kategori=1')
+    assert res.status_code == 200
+
+    res = client.get('/metrics')
+    assert res.status_code == 200
+    assert res.mimetype == 'text/plain'
+    body = res.data.decode()
+    assert 'http_requests_total{method="GET",endpoint="/api/kategori",status="200"}' in body
+    assert 'db_queries_total{method="GET",endpoint="/api/kategori"}' in body
+    assert 'db_pool_in_use' in body
+
+def test_request_stats_record_slowest():
+    from instrumentation import RequestStats
+
+    stats = RequestStats()
+    for i in range(10):
+        stats.record(f'SELECT {i}', [i], i / 1000)
+    assert stats.queries == 10
+    slowest = stats.slowest_queries()
+    assert [query['sql'] for query in slowest][0] == 'SELECT 9'
+    assert len(slowest) <= 5
+
+def test_profile(client, monkeypatch):
+    import instrumentation
+
+    monkeypatch.setattr(instrumentation, 'PROFILING_ENABLED', True)
+    res = client.get('/api/bahan?profile=1')
+    assert res.status_code == 200
+    assert res.mimetype == 'text/plain'
+    assert 'queries in' in res.data.decode()
+
+def test_profile_disabled_in_production(client, monkeypatch):
+    import instrumentation
+
+    monkeypatch.setattr(instrumentation, 'PROFILING_ENABLED', False)
+    res = client.get('/api/bahan?profile=1')
+    assert res.status_code == 200
+    assert res.json['success'] == True
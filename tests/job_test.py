@@ -0,0 +1,128 @@
+import datetime
+
+import pytest
+
+import jobs
+from jobs import job_queue
+from models import Bahan, Job
+
+
+def run_jobs():
+    # what a worker does, until no job is due
+    while job_queue.run_once():
+        pass
+
+def test_background_import(client):
+    rows = [{'name': 'Bahan Job 1'}, {'name': 'Bahan Job 2'}, {'name': 'Bahan Job 1'}]
+    res = client.post('/api/bahan/import?background=1', json=rows, headers={'Idempotency-Key': 'test-background-import'})
+    assert res.status_code == 202
+    job = res.json['data']
+    assert job['status'] == 'queued'
+
+    # the same key returns the same job instead of queueing the import again
+    res = client.post('/api/bahan/import?background=1', json=rows, headers={'Idempotency-Key': 'test-background-import'})
+    assert res.status_code == 200
+    assert res.json['data']['id'] == job['id']
+
+    run_jobs()
+    res = client.get(f"/api/jobs?id_job={job['id']}")
+    assert res.status_code == 200
+    assert res.json['data']['status'] == 'done'
+    assert res.json['data']['progress'] == 1
+    result = res.json['data']['result']
+    assert (result['created'], result['failed']) == (2, 1)
+
+    for row in result['results']:
+        if row['success']:
+            assert client.delete('/api/bahan', json={'id_bahan': row['id']}).status_code == 200
+
+def test_delete_recipes_job(client):
+    id_kategori = client.post('/api/kategori', json={'name': 'Kategori Job'}).json['data']['id']
+    id_bahan = client.post('/api/bahan', json={'name': 'Bahan Job'}).json['data']['id']
+    payload = {
+        'name': 'Recipe Job',
+        'description': 'Recipe Job',
+        'id_kategori': id_kategori,
+        'ingredients': [{'id_bahan': id_bahan, 'quantity': 1, 'satuan': 'buah'}]
+    }
+    id_recipes = [client.post('/api/recipe', json=payload).json['data']['id'] for _ in range(3)]
+
+    res = client.post('/api/jobs', json={'kind': 'delete_recipes', 'payload': {'ids': id_recipes + [100000]}})
+    assert res.status_code == 202
+    run_jobs()
+
+    job = client.get(f"/api/jobs?id_job={res.json['data']['id']}").json['data']
+    assert job['result'] == {'deleted': 3, 'not_found': [100000]}
+    res = client.get('/api/recipe?id_recipe=' + ','.join(str(id) for id in id_recipes))
+    assert res.json['data'] == [None, None, None]
+
+    assert client.delete('/api/kategori', json={'id_kategori': id_kategori}).status_code == 200
+    assert client.delete('/api/bahan', json={'id_bahan': id_bahan}).status_code == 200
+
+def test_failed_job_is_retried(client, monkeypatch):
+    calls = []
+    def flaky(payload, progress, checkpoint):
+        calls.append(payload)
+        if len(calls) < payload['fail']:
+            raise RuntimeError('temporary failure')
+        return 'ok'
+    monkeypatch.setitem(job_queue.handlers, 'flaky', flaky)
+    monkeypatch.setattr(jobs, 'JOB_RETRY_DELAY', 0)
+
+    id_retried = client.post('/api/jobs', json={'kind': 'flaky', 'payload': {'fail': 2}}).json['data']['id']
+    run_jobs()
+    job = client.get(f'/api/jobs?id_job={id_retried}').json['data']
+    assert (job['status'], job['attempts'], job['result']) == ('done', 2, 'ok')
+
+    calls.clear()
+    id_failed = client.post('/api/jobs', json={'kind': 'flaky', 'payload': {'fail': 10}, 'max_attempts': 2}).json['data']['id']
+    run_jobs()
+    job = client.get(f'/api/jobs?id_job={id_failed}').json['data']
+    assert (job['status'], job['attempts']) == ('failed', 2)
+    assert 'temporary failure' in job['error']
+
+def test_import_resumes_from_checkpoint(client):
+    rows = [{'name': 'Bahan Checkpoint 1'}, {'name': 'Bahan Checkpoint 2'}, {'name': 'Bahan Checkpoint 3'}]
+    id_job = client.post('/api/bahan/import?background=1', json=rows).json['data']['id']
+    # an earlier attempt committed the chunk of the first two rows
+    Job.update(checkpoint='{"rows": 2, "created": 1, "failed": 1}').where(Job.id == id_job).execute()
+    run_jobs()
+
+    result = client.get(f'/api/jobs?id_job={id_job}').json['data']['result']
+    assert (result['created'], result['failed'], result['resumed_at']) == (2, 1, 2)
+    assert [row['index'] for row in result['results']] == [2]
+    assert Bahan.select().where(Bahan.name.startswith('Bahan Checkpoint')).count() == 1
+    assert client.delete('/api/bahan', json={'id_bahan': result['results'][0]['id']}).status_code == 200
+
+def test_stale_jobs_are_requeued_until_max_attempts(client, monkeypatch):
+    monkeypatch.setitem(job_queue.handlers, 'stale', lambda payload, progress, checkpoint: 'ok')
+    started_at = jobs.now() - datetime.timedelta(seconds=jobs.JOB_TIMEOUT + 1)
+    ids = [client.post('/api/jobs', json={'kind': 'stale', 'max_attempts': 2}).json['data']['id'] for _ in range(2)]
+    # the workers running them died, the second job was already run max_attempts times
+    for id_job, attempts in zip(ids, (1, 2)):
+        Job.update(status='running', attempts=attempts, started_at=started_at).where(Job.id == id_job).execute()
+    run_jobs()
+
+    requeued, poisoned = [client.get(f'/api/jobs?id_job={id_job}').json['data'] for id_job in ids]
+    assert (requeued['status'], requeued['attempts'], requeued['result']) == ('done', 2, 'ok')
+    assert (poisoned['status'], poisoned['attempts']) == ('failed', 2)
+    assert 'Timed out' in poisoned['error']
+
+def test_requeued_job_is_not_recorded_by_its_old_worker(client, monkeypatch):
+    monkeypatch.setitem(job_queue.handlers, 'stale', lambda payload, progress, checkpoint: 'ok')
+    id_job = client.post('/api/jobs', json={'kind': 'stale'}).json['data']['id']
+    job = job_queue.claim()
+    # requeued and claimed by another worker while this one ran it
+    Job.update(attempts=Job.attempts + 1).where(Job.id == id_job).execute()
+    assert not job_queue.run(job)
+    assert client.get(f'/api/jobs?id_job={id_job}').json['data']['status'] == 'running'
+    Job.update(status='done').where(Job.id == id_job).execute()
+
+def test_unknown_job(client):
+    assert client.post('/api/jobs', json={'kind': 'unknown'}).status_code == 400
+    # payloads are validated for their kind before they are queued
+    res = client.post('/api/jobs', json={'kind': 'delete_recipes', 'payload': {}})
+    assert res.status_code == 400
+    assert res.json['error'][0]['loc'] == ['ids']
+    assert client.post('/api/jobs', json={'kind': 'import_bahan', 'payload': {'rows': 'nope'}}).status_code == 400
+    assert client.get('/api/jobs?id_job=100000').status_code == 404
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import json_encoder
+from json_encoder import OrjsonEncoder, StdlibEncoder
+from models import Bahan
+
+
+def encoders():
+    try:
+        return [StdlibEncoder(), OrjsonEncoder()]
+    except ImportError:
+        return [StdlibEncoder()]
+
+@pytest.mark.parametrize('encoder', encoders(), ids=lambda encoder: encoder.name)
+def test_encoders_write_peewee_rows(encoder):
+    # dicts and tuples queries are encoded as lists of their rows
+    data = {
+        'dicts': Bahan.select().where(Bahan.id == 1).dicts(),
+        'tuples': Bahan.select(Bahan.id, Bahan.name).where(Bahan.id == 1).tuples(),
+        'name': 'Pisang Goreng Ñ'
+    }
+    bahan = Bahan.get(id=1)
+    assert json.loads(encoder.dumps(data)) == {
+        'dicts': [{'id': 1, 'name': bahan.name}],
+        'tuples': [[1, bahan.name]],
+        'name': 'Pisang Goreng Ñ'
+    }
+
+    with pytest.raises(TypeError):
+        encoder.dumps({'bahan': bahan})
+
+@pytest.mark.parametrize('encoder', encoders(), ids=lambda encoder: encoder.name)
+def test_responses_use_configured_encoder(client, monkeypatch, encoder):
+    monkeypatch.setattr(json_encoder, 'encoder', encoder)
+    res = client.get('/api/recipe/search?q=Pisang')
+    assert res.status_code == 200
+    assert res.mimetype == 'application/json'
+    assert res.get_data() == encoder.dumps(res.json) + b'\n'
@@ -0,0 +1,101 @@
+import pytest
+from peewee import SqliteDatabase
+
+import migrations
+from repository import paginate, recipe_document_query
+from models import database, is_sqlite, RecipeBahan, RecipeDocument
+from recipe_documents import recipe_documents
+from text_search import text_index
+
+
+def full_scans(query):
+    # Tables a query reads with a full table scan, according to the database's query plan
+    sql, params = query.sql()
+    if is_sqlite():
+        plan = database.execute_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        # 'SCAN t1' is a full scan, 'SCAN t1 USING INDEX' or 'SEARCH ...' use an index
+        return [detail for _, _, _, detail in plan if detail.startswith('SCAN') and 'INDEX' not in detail]
+    cursor = database.execute_sql('EXPLAIN ' + sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [row['table'] for row in (dict(zip(columns, row)) for row in cursor.fetchall()) if row['type'] == 'ALL']
+
+@pytest.mark.parametrize('filters', [
+    {'id_kategori': 1},
+    {'id_bahan': 1},
+    {'id_kategori': 1, 'id_bahan': 1},
+    {'after_id': 1},
+], ids=lambda filters: '&'.join(filters))
+def test_recipe_filters_use_indexes(filters):
+    # the queries of every ResourceRecipe.get list branch
+    recipe_documents.ensure()
+    args = {'id_kategori': None, 'id_bahan': None, 'limit': None, 'after_id': None, **filters}
+    query, _ = paginate(recipe_document_query(args), RecipeDocument, args)
+    assert full_scans(query) == []
+
+def test_recipe_by_id_uses_primary_key():
+    recipe_documents.ensure()
+    assert full_scans(RecipeDocument.select(RecipeDocument.body).where(RecipeDocument.id == 1)) == []
+
+def test_test_database_is_migrated():
+    assert migrations.pending() == []
+    indexes = {index.name: index for index in database.get_indexes('recipebahan')}
+    assert indexes['recipebahan_id_recipe_id_bahan'].unique
+    assert 'recipebahan_id_bahan_id_recipe' in indexes
+    assert 'recipe_name' in {index.name for index in database.get_indexes('recipe')}
+
+@pytest.fixture()
+def temporary_database(tmp_path, monkeypatch):
+    # run the migrations against an empty SQLite file instead of the app database
+    temporary = SqliteDatabase(str(tmp_path / 'migrations.db'), pragmas={'foreign_keys': 1})
+    # the models are bound to the proxy, which points at the temporary database during the test
+    monkeypatch.setattr(database, 'obj', temporary)
+    yield temporary
+
+def test_new_database_is_created_from_models(temporary_database):
+    assert migrations.run() == []
+    assert migrations.pending() == []
+    assert 'recipebahan_id_recipe_id_bahan' in {index.name for index in temporary_database.get_indexes('recipebahan')}
+    assert text_index.exists()
+
+def test_migrations_upgrade_existing_database(temporary_database):
+    # schema created before the migrations, with a copied and a conflicting ingredient
+    for sql in [
+        'CREATE TABLE "bahan" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL)',
+        'CREATE TABLE "kategori" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL)',
+        'CREATE TABLE "recipe" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL, "description" TEXT NOT NULL, "id_kategori" INTEGER NOT NULL)',
+        'CREATE TABLE "recipebahan" ("id" INTEGER NOT NULL PRIMARY KEY, "id_recipe" INTEGER NOT NULL, "id_bahan" INTEGER NOT NULL, "quantity" INTEGER, "satuan" VARCHAR(255) NOT NULL)',
+        "INSERT INTO bahan VALUES (1, 'Pisang')",
+        "INSERT INTO kategori VALUES (1, 'Desert')",
+        "INSERT INTO recipe VALUES (1, 'Pisang Goreng', 'Pisang Goreng', 1)",
+        "INSERT INTO recipebahan VALUES (1, 1, 1, 1, 'buah'), (2, 1, 1, 2, 'buah'), (3, 1, 1, 1, 'buah')",
+    ]:
+        temporary_database.execute_sql(sql)
+
+    # rows that differ are reported instead of dropped, and nothing is applied
+    with pytest.raises(migrations.MigrationError) as error:
+        migrations.run()
+    assert "id=2 quantity=2 satuan='buah'" in str(error.value)
+    assert migrations.applied() == set()
+    assert RecipeBahan.select().count() == 3
+
+    # once the conflict is resolved, the copy of row 1 is removed
+    temporary_database.execute_sql('DELETE FROM recipebahan WHERE id = 2')
+
+    applied = migrations.run()
+    assert applied == [(1, 'recipe_indexes'), (2, 'jobs'), (3, 'recipe_text_index'), (4, 'recipe_documents'), (5, 'job_checkpoint')]
+    assert migrations.pending() == []
+    assert [id for id, in RecipeBahan.select(RecipeBahan.id).tuples()] == [1]
+    indexes = {index.name: index for index in temporary_database.get_indexes('recipebahan')}
+    assert indexes['recipebahan_id_recipe_id_bahan'].unique
+    # the full-text index is filled from the existing recipes, the recipe documents by the backfill
+    assert text_index.search('goreng', 10) == [1]
+    assert RecipeDocument.select().count() == 0
+    migrations.backfill(applied)
+    assert [id for id, in RecipeDocument.select(RecipeDocument.id).tuples()] == [1]
+
+def test_search_requires_migrated_text_index(temporary_database):
+    from text_search import SqliteTextIndex
+
+    # requests only check that the index exists, creating it is up to the migrations
+    with pytest.raises(RuntimeError):
+        SqliteTextIndex().ensure()
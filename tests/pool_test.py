@@ -0,0 +1,17 @@
+def test_request_returns_connection_to_pool(client):
+    from app import database
+
+    res = client.get('/api/kategori')
+    assert res.status_code == 200
+    assert database.is_closed()
+
+def test_get_pool_metrics(client):
+    res = client.get('/api/kategori')
+    assert res.status_code == 200
+
+    res = client.get('/api/metrics/pool')
+    response_json = res.json
+    assert res.status_code == 200
+    assert response_json['success'] == True
+    assert response_json['data']['wait_count'] >= 1
+    assert 0 <= response_json['data']['utilization'] <= 1
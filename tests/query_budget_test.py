@@ -0,0 +1,137 @@
+import pytest
+
+from repository import supports_returning
+
+
+# Exact number of SQL statements run by each endpoint, counting the BEGIN of a transaction.
+# A change that adds a round trip to a handler has to update its budget here.
+
+@pytest.fixture()
+def recipe(client):
+    # a kategori, two bahan and a recipe using them, removed after the test
+    id_kategori = client.post('/api/kategori', json={'name': 'Kategori Query Budget'}).json['data']['id']
+    id_bahan = [client.post('/api/bahan', json={'name': f'Bahan Query Budget {i}'}).json['data']['id'] for i in range(2)]
+    payload = {
+        'name': 'Recipe Query Budget',
+        'description': 'Recipe Query Budget',
+        'id_kategori': id_kategori,
+        'ingredients': [{'id_bahan': id, 'quantity': 1, 'satuan': 'buah'} for id in id_bahan]
+    }
+    id_recipe = client.post('/api/recipe', json=payload).json['data']['id']
+    yield {'id_recipe': id_recipe, 'id_kategori': id_kategori, 'id_bahan': id_bahan, 'payload': payload}
+    client.delete('/api/recipe', json={'id_recipe': id_recipe})
+    client.delete('/api/kategori', json={'id_kategori': id_kategori})
+    for id in id_bahan:
+        client.delete('/api/bahan', json={'id_bahan': id})
+
+@pytest.mark.parametrize('url', [
+    '/api/bahan?id_bahan=1',
+    '/api/bahan?id_bahan=100000',
+    '/api/bahan',
+    '/api/kategori?id_kategori=1',
+    '/api/kategori?id_kategori=100000',
+    '/api/kategori',
+    '/api/recipe?id_recipe=1',
+    '/api/recipe?id_recipe=100000',
+    '/api/recipe',
+    '/api/recipe?id_kategori=1',
+    '/api/recipe?id_bahan=1',
+    '/api/recipe?id_kategori=1&id_bahan=1',
+    '/api/bahan?id_bahan=1,2,100000',
+    '/api/kategori?id_kategori=1,2,100000',
+    '/api/recipe?id_recipe=1,2,100000',
+    '/api/recipe?fields=id,name',
+    '/api/recipe?id_recipe=1&fields=name&include=kategori',
+    '/api/recipe?id_kategori=1&id_bahan=1&include=kategori',
+])
+def test_read_is_one_query(client, query_budget, url):
+    with query_budget(1):
+        client.get(url)
+
+@pytest.mark.parametrize('url, message', [
+    ('/api/recipe?id_kategori=100000', 'Kategori Not Found'),
+    ('/api/recipe?id_bahan=100000', 'Bahan Not Found'),
+])
+def test_missing_filter_is_checked_after_empty_page(client, query_budget, url, message):
+    with query_budget(2):
+        res = client.get(url)
+    assert res.status_code == 404
+    assert res.json['message'] == message
+
+@pytest.mark.parametrize('resource', ['bahan', 'kategori'])
+def test_named_writes(client, query_budget, resource):
+    with query_budget(1):
+        id = client.post(f'/api/{resource}', json={'name': f'{resource} query budget'}).json['data']['id']
+
+    # the update returns the row, then the ids of the recipes using it are selected
+    with query_budget(3 if supports_returning() else 4):
+        res = client.put(f'/api/{resource}', json={f'id_{resource}': id, 'name': f'{resource} query budget renamed'})
+    assert res.json['data'] == {'id': id, 'name': f'{resource} query budget renamed'}
+
+    with query_budget(2 if supports_returning() else 3):
+        assert client.put(f'/api/{resource}', json={f'id_{resource}': 100000, 'name': 'missing'}).status_code == 404
+
+    with query_budget(1):
+        assert client.delete(f'/api/{resource}', json={f'id_{resource}': id}).status_code == 200
+
+    with query_budget(2):
+        assert client.delete(f'/api/{resource}', json={f'id_{resource}': id}).status_code == 404
+
+@pytest.mark.parametrize('resource', ['bahan', 'kategori'])
+def test_delete_used_named_row(client, query_budget, recipe, resource):
+    id = recipe['id_bahan'][0] if resource == 'bahan' else recipe['id_kategori']
+    with query_budget(2):
+        res = client.delete(f'/api/{resource}', json={f'id_{resource}': id})
+    assert res.status_code == 400
+
+@pytest.mark.parametrize('resource', ['bahan', 'kategori'])
+def test_rename_refreshes_recipe_documents(client, query_budget, recipe, resource):
+    id = recipe['id_bahan'][0] if resource == 'bahan' else recipe['id_kategori']
+    # rename, select the recipe ids, serialize the recipes and rewrite their documents
+    with query_budget((3 if supports_returning() else 4) + 5):
+        assert client.put(f'/api/{resource}', json={f'id_{resource}': id, 'name': f'{resource} query budget renamed'}).status_code == 200
+
+def test_included_ingredients_are_one_more_query(client, query_budget):
+    with query_budget(2):
+        client.get('/api/recipe?limit=5&fields=name&include=recipe_bahan')
+    with query_budget(2):
+        client.get('/api/recipe?id_recipe=1,2&include=kategori,recipe_bahan')
+
+def test_shopping_list_is_one_query(client, query_budget, recipe):
+    with query_budget(1):
+        res = client.post('/api/recipe/shopping-list', json={'recipes': [{'id_recipe': recipe['id_recipe'], 'multiplier': 3}, {'id_recipe': 100000}]})
+    assert [bahan['quantity'] for bahan in res.json['data']] == [3, 3]
+
+def test_recipe_writes(client, query_budget, recipe):
+    payload = recipe['payload']
+
+    # check references, insert the recipe and its ingredients, index it and write its document
+    with query_budget(11):
+        res = client.post('/api/recipe', json=payload)
+    assert res.status_code == 201
+    id_recipe = res.json['data']['id']
+
+    with query_budget(12):
+        assert client.put('/api/recipe', json={'id_recipe': id_recipe, **payload}).status_code == 200
+
+    with query_budget(1):
+        res = client.put('/api/recipe', json={'id_recipe': 100000, **payload})
+    assert res.json['message'] == 'Recipe Not Found'
+
+    with query_budget(1):
+        res = client.post('/api/recipe', json={**payload, 'id_kategori': 100000})
+    assert res.json['message'] == 'Kategori Not Found'
+
+    with query_budget(5):
+        assert client.delete('/api/recipe', json={'id_recipe': id_recipe}).status_code == 200
+
+    with query_budget(3):
+        assert client.delete('/api/recipe', json={'id_recipe': id_recipe}).status_code == 404
+
+@pytest.mark.parametrize('url', ['/api/bahan', '/api/kategori', '/api/recipe', '/api/recipe?id_bahan=1'])
+def test_streamed_list_is_one_query(client, query_budget, monkeypatch, url):
+    import app
+
+    monkeypatch.setattr(app, 'STREAM_MIN_ROWS', 1)
+    with query_budget(1):
+        assert client.get(url).is_streamed
@@ -0,0 +1,57 @@
+import json
+
+from models import Recipe, RecipeDocument
+from playhouse.shortcuts import model_to_dict
+from recipe_documents import recipe_documents
+
+
+def test_document_matches_recipe(client):
+    # The stored document is the same recipe the serializer builds from the four tables
+    recipe_documents.ensure()
+    document = json.loads(RecipeDocument.get(id=1).body)
+    assert document == model_to_dict(Recipe.get(id=1), backrefs=True)
+
+    response = client.get("/api/recipe")
+    assert response.status_code == 200
+    assert response.json['data'][0] == document
+
+def test_rename_refreshes_documents(client):
+    # Create Kategori, Bahan and Recipe
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Document'}).json['data']['id']
+    id_bahan = client.post("/api/bahan", json={'name':'Bahan Document'}).json['data']['id']
+    payload = {
+        "name": "Recipe Document",
+        "description": "Recipe Document",
+        "id_kategori": id_kategori,
+        "ingredients":[{'id_bahan':id_bahan,'quantity':2,'satuan':'buah'}]
+    }
+    id_recipe = client.post("/api/recipe", json=payload).json['data']['id']
+    assert json.loads(recipe_documents.get(id_recipe))['name'] == 'Recipe Document'
+
+    # Renames are written to the documents that embed the bahan or kategori
+    assert client.put("/api/bahan", json={'id_bahan':id_bahan, 'name':'Bahan Document 2'}).status_code == 200
+    assert client.put("/api/kategori", json={'id_kategori':id_kategori, 'name':'Kategori Document 2'}).status_code == 200
+    document = json.loads(recipe_documents.get(id_recipe))
+    assert document['recipe_bahan'][0]['bahan']['name'] == 'Bahan Document 2'
+    assert document['kategori']['name'] == 'Kategori Document 2'
+
+    res = client.get(f"/api/recipe?id_kategori={id_kategori}&id_bahan={id_bahan}")
+    assert res.json['data'] == [document]
+    assert res.json['next_cursor'] is None
+
+    # remove recipe, its document, kategori and bahan
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe}).status_code == 200
+    assert recipe_documents.get(id_recipe) is None
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan}).status_code == 200
+
+def test_rebuild_repairs_documents():
+    recipe_documents.ensure()
+    body = RecipeDocument.get(id=1).body
+
+    # Stale and orphaned documents are fixed by a rebuild
+    RecipeDocument.update(body='{}').where(RecipeDocument.id == 1).execute()
+    RecipeDocument.insert(id=1000000, kategori=1, body='{}').execute()
+    assert recipe_documents.rebuild() == Recipe.select().count()
+    assert RecipeDocument.get(id=1).body == body
+    assert recipe_documents.get(1000000) is None
@@ -1,3 +1,10 @@
+from decimal import Decimal
+
+import pytest
+
+from units import normalize, number
+
+
 def test_get_all_recipe(client):
     response = client.get("/api/recipe")
     assert response.status_code == 200
@@ -61,4 +68,251 @@ def test_create_recipe(client):
 
     # remove id_bahan2
     response_remove_bahan2 = client.delete("/api/bahan", json={'id_bahan':id_bahan2})
-    assert response_remove_bahan2.status_code == 200
\ No newline at end of file
+    assert response_remove_bahan2.status_code == 200
+
+def test_get_recipe_matches_model_to_dict(client):
+    from app import Recipe
+    from playhouse.shortcuts import model_to_dict
+
+    response = client.get("/api/recipe?id_recipe=1")
+    assert response.status_code == 200
+    assert response.json['data'] == model_to_dict(Recipe.get(id=1), backrefs=True)
+
+def test_get_recipe_batch(client):
+    single = client.get("/api/recipe?id_recipe=1").json['data']
+    res = client.get("/api/recipe?id_recipe=100000,1")
+    assert res.status_code == 200
+    assert res.json['data'] == [None, single]
+    assert res.json['error'] == {'not_found': [100000]}
+
+    res = client.get("/api/recipe?id_recipe=1,x")
+    assert res.status_code == 400
+
+def test_get_recipe_query_count_is_constant(client, query_counter):
+    # Create Kategori and Bahan for the recipes
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Query Count'}).json['data']['id']
+    id_bahan1 = client.post("/api/bahan", json={'name':'Bahan Query Count'}).json['data']['id']
+    id_bahan2 = client.post("/api/bahan", json={'name':'Bahan Query Count 2'}).json['data']['id']
+
+    payload = {
+        "name": "Recipe Query Count",
+        "description": "Recipe Query Count",
+        "id_kategori": id_kategori,
+        "ingredients":[{'id_bahan':id_bahan1,'quantity':1,'satuan':'buah'},{'id_bahan':id_bahan2,'satuan':'Secukupnya'}]
+    }
+
+    # count queries of the list with a single recipe
+    id_recipes = [client.post("/api/recipe", json=payload).json['data']['id']]
+    query_counter['count'] = 0
+    response = client.get(f"/api/recipe?id_kategori={id_kategori}")
+    assert response.status_code == 200
+    assert len(response.json['data']) == 1
+    single_recipe_queries = query_counter['count']
+
+    # count queries of the list with more recipes
+    id_recipes += [client.post("/api/recipe", json=payload).json['data']['id'] for _ in range(9)]
+    query_counter['count'] = 0
+    response = client.get(f"/api/recipe?id_kategori={id_kategori}")
+    assert response.status_code == 200
+    assert len(response.json['data']) == 10
+    assert all(len(r['recipe_bahan']) == 2 for r in response.json['data'])
+    assert query_counter['count'] == single_recipe_queries
+
+    # remove recipes, kategori and bahan
+    for id_recipe in id_recipes:
+        assert client.delete("/api/recipe", json={'id_recipe':id_recipe}).status_code == 200
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan1}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan2}).status_code == 200
+
+def test_get_recipe_paginated(client):
+    response = client.get("/api/recipe?limit=1")
+    assert response.status_code == 200
+    assert len(response.json['data']) == 1
+
+    next_cursor = response.json['next_cursor']
+    assert next_cursor == response.json['data'][0]['id']
+
+    response = client.get(f"/api/recipe?limit=1&after_id={next_cursor}")
+    assert response.status_code == 200
+    assert all(r['id'] > next_cursor for r in response.json['data'])
+
+def test_get_recipe_without_duplicates(client):
+    for query in ("", "?id_bahan=2", "?id_bahan=2&id_kategori=2"):
+        response = client.get(f"/api/recipe{query}")
+        assert response.status_code == 200
+        ids = [r['id'] for r in response.json['data']]
+        assert len(ids) == len(set(ids))
+
+def test_update_recipe(client):
+    # Create Kategori and Bahan for the recipes
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Update Recipe'}).json['data']['id']
+    id_bahan1 = client.post("/api/bahan", json={'name':'Bahan Update Recipe'}).json['data']['id']
+    id_bahan2 = client.post("/api/bahan", json={'name':'Bahan Update Recipe 2'}).json['data']['id']
+
+    payload = {
+        "name": "Recipe Update",
+        "description": "Recipe Update",
+        "id_kategori": id_kategori,
+        "ingredients":[{'id_bahan':id_bahan1,'quantity':1,'satuan':'buah'}]
+    }
+    id_recipe = client.post("/api/recipe", json=payload).json['data']['id']
+    id_other_recipe = client.post("/api/recipe", json=payload).json['data']['id']
+
+    # Update with an unknown bahan is rejected and leaves the recipe unchanged
+    payload['id_recipe'] = id_recipe
+    payload['name'] = "Recipe Update 2"
+    payload['ingredients'] = [{'id_bahan':id_bahan2,'satuan':'buah'},{'id_bahan':999999,'satuan':'buah'}]
+    response = client.put("/api/recipe", json=payload)
+    assert response.status_code == 404
+    response = client.get(f"/api/recipe?id_recipe={id_recipe}")
+    assert response.json['data']['name'] == "Recipe Update"
+    assert [rb['bahan']['id'] for rb in response.json['data']['recipe_bahan']] == [id_bahan1]
+
+    # Update replaces the ingredients of this recipe only
+    payload['ingredients'] = [{'id_bahan':id_bahan1,'quantity':2,'satuan':'buah'},{'id_bahan':id_bahan2,'satuan':'buah'}]
+    response = client.put("/api/recipe", json=payload)
+    assert response.status_code == 200
+    assert response.json['data']['name'] == "Recipe Update 2"
+    assert [rb['bahan']['id'] for rb in response.json['data']['recipe_bahan']] == [id_bahan1, id_bahan2]
+
+    response = client.get(f"/api/recipe?id_recipe={id_other_recipe}")
+    assert response.json['data']['name'] == "Recipe Update"
+    assert len(response.json['data']['recipe_bahan']) == 1
+
+    # remove recipes, kategori and bahan
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe}).status_code == 200
+    assert client.delete("/api/recipe", json={'id_recipe':id_other_recipe}).status_code == 200
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan1}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan2}).status_code == 200
+
+def test_create_recipe_with_duplicate_bahan(client):
+    payload = {
+        "name": "Recipe Duplicate Bahan",
+        "description": "Recipe Duplicate Bahan",
+        "id_kategori": 1,
+        "ingredients":[{'id_bahan':1,'quantity':1,'satuan':'buah'},{'id_bahan':1,'quantity':2,'satuan':'buah'}]
+    }
+    response = client.post("/api/recipe", json=payload)
+    assert response.status_code == 400
+
+def test_shopping_list(client):
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Shopping List'}).json['data']['id']
+    id_tepung = client.post("/api/bahan", json={'name':'Tepung Shopping List'}).json['data']['id']
+    id_telur = client.post("/api/bahan", json={'name':'Telur Shopping List'}).json['data']['id']
+    id_garam = client.post("/api/bahan", json={'name':'Garam Shopping List'}).json['data']['id']
+
+    recipes = [{
+        "name": "Recipe Shopping List 1",
+        "description": "Recipe Shopping List 1",
+        "id_kategori": id_kategori,
+        "ingredients":[{'id_bahan':id_tepung,'quantity':1,'satuan':'kg'},{'id_bahan':id_telur,'quantity':2,'satuan':'buah'},{'id_bahan':id_garam,'satuan':'Secukupnya'}]
+    }, {
+        "name": "Recipe Shopping List 2",
+        "description": "Recipe Shopping List 2",
+        "id_kategori": id_kategori,
+        "ingredients":[{'id_bahan':id_tepung,'quantity':250,'satuan':'gram'},{'id_bahan':id_telur,'quantity':1,'satuan':'buah'}]
+    }]
+    id_recipes = [client.post("/api/recipe", json=recipe).json['data']['id'] for recipe in recipes]
+
+    res = client.post("/api/recipe/shopping-list", json={'recipes': [{'id_recipe': id_recipes[0], 'multiplier': 2}, {'id_recipe': id_recipes[1]}]})
+    assert res.status_code == 200
+    assert res.json['data'] == [
+        {'id_bahan': id_tepung, 'name': 'Tepung Shopping List', 'quantity': 2250, 'satuan': 'gram'},
+        {'id_bahan': id_telur, 'name': 'Telur Shopping List', 'quantity': 5, 'satuan': 'buah'},
+        {'id_bahan': id_garam, 'name': 'Garam Shopping List', 'quantity': None, 'satuan': 'Secukupnya'},
+    ]
+
+    # without normalization every satuan is summed on its own
+    res = client.post("/api/recipe/shopping-list", json={'recipes': [{'id_recipe': id_recipes[0], 'multiplier': 0.5}, {'id_recipe': id_recipes[1]}], 'normalize': False})
+    assert {(bahan['quantity'], bahan['satuan']) for bahan in res.json['data'] if bahan['id_bahan'] == id_tepung} == {(0.5, 'kg'), (250, 'gram')}
+
+    res = client.post("/api/recipe/shopping-list", json={'recipes': [{'id_recipe': id_recipes[0], 'multiplier': 0}]})
+    assert res.status_code == 400
+
+    # remove recipes, kategori and bahan
+    for id_recipe in id_recipes:
+        assert client.delete("/api/recipe", json={'id_recipe':id_recipe}).status_code == 200
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    for id_bahan in [id_tepung, id_telur, id_garam]:
+        assert client.delete("/api/bahan", json={'id_bahan':id_bahan}).status_code == 200
+
+def test_normalize_decimal_sums():
+    # MySQL returns SUM(quantity) as Decimal
+    assert normalize(Decimal(500), 'mg') == (0.5, 'gram')
+    assert normalize(Decimal(2), 'Kg') == (2000, 'gram')
+    assert normalize(None, 'mg') == (None, 'gram')
+    assert normalize(Decimal(3), 'buah') == (Decimal(3), 'buah')
+    assert number(normalize(Decimal(250), 'mg')[0] + normalize(Decimal(1), 'g')[0]) == 1.25
+
+def test_get_recipe_sparse_fields(client):
+    full = client.get("/api/recipe?limit=3").json['data']
+
+    res = client.get("/api/recipe?limit=3&fields=name")
+    assert res.status_code == 200
+    assert res.json['data'] == [{'id': r['id'], 'name': r['name']} for r in full]
+    assert res.json['next_cursor'] == client.get("/api/recipe?limit=3").json['next_cursor']
+
+    res = client.get("/api/recipe?id_recipe=1&fields=id,name&include=kategori,recipe_bahan")
+    recipe = client.get("/api/recipe?id_recipe=1").json['data']
+    assert res.json['data'] == {'id': 1, 'name': recipe['name'], 'kategori': recipe['kategori'], 'recipe_bahan': recipe['recipe_bahan']}
+
+    # include alone keeps every column
+    res = client.get("/api/recipe?id_recipe=100000,1&include=kategori")
+    assert res.json['data'] == [None, {key: recipe[key] for key in ('id', 'name', 'description', 'kategori')}]
+    assert res.json['error'] == {'not_found': [100000]}
+
+    res = client.get("/api/recipe?id_kategori=2&id_bahan=1&fields=name")
+    assert [r['id'] for r in res.json['data']] == [r['id'] for r in client.get("/api/recipe?id_kategori=2&id_bahan=1").json['data']]
+
+    assert client.get("/api/recipe?id_recipe=100000&fields=name").status_code == 404
+    assert client.get("/api/recipe?id_kategori=100000&fields=name").json['message'] == 'Kategori Not Found'
+    assert client.get("/api/recipe?fields=name,password").status_code == 400
+    assert client.get("/api/recipe?include=bahan").status_code == 400
+
+def test_get_recipe_columnar(client):
+    res = client.get("/api/recipe?limit=2&fields=name", headers={'Accept': 'application/vnd.tlab.columnar+json'})
+    assert res.status_code == 200
+    assert res.mimetype == 'application/vnd.tlab.columnar+json'
+    rows = client.get("/api/recipe?limit=2&fields=name").json['data']
+    assert res.json['data'] == {'columns': ['id', 'name'], 'rows': [[r['id'], r['name']] for r in rows]}
+
+    # documents are converted too, and every representation has its own ETag and cache entry
+    res = client.get("/api/recipe?limit=2", headers={'Accept': 'application/vnd.tlab.columnar+json'})
+    assert res.json['data']['columns'] == ['id', 'name', 'description', 'kategori', 'recipe_bahan']
+    json_res = client.get("/api/recipe?limit=2")
+    assert json_res.mimetype == 'application/json'
+    assert json_res.headers['ETag'] != res.headers['ETag']
+    assert 'Accept' in json_res.headers['Vary']
+
+def test_get_recipe_msgpack(client):
+    msgpack = pytest.importorskip('msgpack')
+    res = client.get("/api/recipe?limit=2&fields=name", headers={'Accept': 'application/msgpack'})
+    assert res.mimetype == 'application/msgpack'
+    columnar = client.get("/api/recipe?limit=2&fields=name", headers={'Accept': 'application/vnd.tlab.columnar+json'}).json
+    assert msgpack.unpackb(res.data) == columnar
+
+@pytest.fixture()
+def streamed(monkeypatch):
+    # stream every page, one row per chunk, and read the pages from the database
+    import app
+    import json_encoder
+    from cache import response_cache
+
+    monkeypatch.setattr(app, 'STREAM_MIN_ROWS', 1)
+    monkeypatch.setattr(json_encoder, 'STREAM_CHUNK_SIZE', 1)
+    monkeypatch.setattr(response_cache, 'enabled', False)
+
+def test_get_recipe_streamed(client, streamed):
+    built = [client.get(f"/api/recipe{query}", headers={'Accept': 'application/vnd.tlab.columnar+json'}) for query in ("", "?limit=1", "?id_bahan=1")]
+    for query, columnar in zip(("", "?limit=1", "?id_bahan=1"), built):
+        res = client.get(f"/api/recipe{query}")
+        assert res.is_streamed
+        assert res.status_code == 200
+        assert res.json['next_cursor'] == columnar.json['next_cursor']
+        assert [r['id'] for r in res.json['data']] == [row[0] for row in columnar.json['data']['rows']]
+
+    # an empty page isn't streamed, so a missing filter is still a 404
+    res = client.get("/api/recipe?id_kategori=100000")
+    assert res.status_code == 404
@@ -0,0 +1,138 @@
+def test_bahan_index_ranks_by_missing():
+    from search_index import BahanRecipeIndex
+
+    class Versions():
+        shared = True
+
+        def current(self, *entities):
+            return [0]
+
+    index = BahanRecipeIndex(Versions())
+    index.version = 0
+    index.set_recipe(1, [1, 2])
+    index.set_recipe(2, [1, 2, 3])
+    index.set_recipe(3, [3, 4])
+    index.set_recipe(4, [5])
+
+    assert index.search([1, 2]) == [(1, 2, []), (2, 2, [3])]
+    assert index.search([1, 2, 3]) == [(2, 3, []), (1, 2, []), (3, 1, [4])]
+    assert index.search([1, 2, 3], max_missing=0, limit=1) == [(2, 3, [])]
+
+    index.set_recipe(1, [4])
+    index.remove_recipe(2)
+    assert index.search([1, 2, 3]) == [(3, 1, [4])]
+
+def test_bahan_index_without_shared_versions_expires():
+    from search_index import BahanRecipeIndex
+
+    class Versions():
+        # the versions of the memory backend don't see the writes of other workers
+        shared = False
+
+        def current(self, *entities):
+            return [0]
+
+    builds = []
+    index = BahanRecipeIndex(Versions(), max_age=60)
+    index.build = lambda: builds.append(1)
+    index.version, index.built_at = 0, float('inf')
+    index.search([1])
+    assert builds == []
+    index.built_at = 0
+    index.search([1])
+    assert builds == [1]
+
+def test_search_recipe_by_bahan(client):
+    # Create Kategori, Bahan and Recipes
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Search Bahan'}).json['data']['id']
+    id_bahan1 = client.post("/api/bahan", json={'name':'Bahan Search 1'}).json['data']['id']
+    id_bahan2 = client.post("/api/bahan", json={'name':'Bahan Search 2'}).json['data']['id']
+
+    def create_recipe(name, bahan):
+        payload = {
+            "name": name,
+            "description": name,
+            "id_kategori": id_kategori,
+            "ingredients":[{'id_bahan':id_bahan,'satuan':'buah'} for id_bahan in bahan]
+        }
+        return client.post("/api/recipe", json=payload).json['data']['id']
+
+    # build the index before the recipes exist, so they are added incrementally
+    assert client.get(f"/api/recipe/search/bahan?id_bahan={id_bahan1}").status_code == 200
+    id_recipe1 = create_recipe('Recipe Search 1', [id_bahan1])
+    id_recipe2 = create_recipe('Recipe Search 2', [id_bahan1, id_bahan2])
+
+    response = client.get(f"/api/recipe/search/bahan?id_bahan={id_bahan1}")
+    assert response.status_code == 200
+    assert [(r['recipe']['id'], r['missing'], r['missing_bahan']) for r in response.json['data']] == [(id_recipe1, 0, []), (id_recipe2, 1, [id_bahan2])]
+
+    response = client.get("/api/recipe/search/bahan?bahan=Bahan Search 1,Bahan Search 2&max_missing=0")
+    assert [r['recipe']['id'] for r in response.json['data']] == [id_recipe2, id_recipe1]
+
+    # Removing an ingredient updates the index
+    payload = {"id_recipe": id_recipe2, "name": "Recipe Search 2", "description": "Recipe Search 2", "id_kategori": id_kategori, "ingredients": [{'id_bahan':id_bahan2,'satuan':'buah'}]}
+    assert client.put("/api/recipe", json=payload).status_code == 200
+    response = client.get(f"/api/recipe/search/bahan?id_bahan={id_bahan1}")
+    assert [r['recipe']['id'] for r in response.json['data']] == [id_recipe1]
+
+    # remove recipes, kategori and bahan
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe1}).status_code == 200
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe2}).status_code == 200
+    response = client.get(f"/api/recipe/search/bahan?id_bahan={id_bahan1},{id_bahan2}")
+    assert response.json['data'] == []
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan1}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan2}).status_code == 200
+
+def test_search_recipe_by_bahan_required(client):
+    response = client.get("/api/recipe/search/bahan")
+    assert response.status_code == 400
+
+def test_search_recipe_text(client):
+    # Create Kategori, Bahan and Recipes
+    id_kategori = client.post("/api/kategori", json={'name':'Kategori Search Text'}).json['data']['id']
+    id_bahan = client.post("/api/bahan", json={'name':'Bahan Search Text'}).json['data']['id']
+
+    def create_recipe(name, description):
+        payload = {
+            "name": name,
+            "description": description,
+            "id_kategori": id_kategori,
+            "ingredients":[{'id_bahan':id_bahan,'satuan':'buah'}]
+        }
+        return client.post("/api/recipe", json=payload).json['data']['id']
+
+    id_recipe1 = create_recipe('Rendang Sapi', 'Rendang daging sapi khas Padang')
+    id_recipe2 = create_recipe('Soto Ayam', 'Soto ayam kuning dengan daging ayam')
+
+    response = client.get("/api/recipe/search?q=rendang")
+    assert response.status_code == 200
+    assert [r['id'] for r in response.json['data']] == [id_recipe1]
+
+    response = client.get("/api/recipe/search?q=daging&limit=1")
+    assert len(response.json['data']) == 1
+    assert response.json['next_cursor'] == 1
+    response = client.get("/api/recipe/search?q=daging&limit=1&offset=1")
+    assert len(response.json['data']) == 1
+    assert response.json['next_cursor'] is None
+
+    # Updated and deleted recipes are reflected in the index
+    payload = {"id_recipe": id_recipe2, "name": "Soto Betawi", "description": "Soto santan", "id_kategori": id_kategori}
+    assert client.put("/api/recipe", json=payload).status_code == 200
+    response = client.get("/api/recipe/search?q=betawi")
+    assert [r['id'] for r in response.json['data']] == [id_recipe2]
+    assert client.get("/api/recipe/search?q=ayam").json['data'] == []
+
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe1}).status_code == 200
+    assert client.get("/api/recipe/search?q=rendang").json['data'] == []
+
+    # remove recipe, kategori and bahan
+    assert client.delete("/api/recipe", json={'id_recipe':id_recipe2}).status_code == 200
+    assert client.delete("/api/kategori", json={'id_kategori':id_kategori}).status_code == 200
+    assert client.delete("/api/bahan", json={'id_bahan':id_bahan}).status_code == 200
+
+def test_search_recipe_text_required(client):
+    response = client.get('/api/recipe/search?q="')
+    assert response.status_code == 200
+    response = client.get("/api/recipe/search")
+    assert response.status_code == 400
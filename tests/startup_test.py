@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import app as app_module
+
+
+# Seconds importing the app may take in a fresh interpreter. Workers forked by the server import it
+# before they bind a database, so import has to stay cheap and must not need any configuration.
+IMPORT_BUDGET = 2
+
+IMPORT_APP = '''
+import time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+import models
+assert models.database.obj is None, 'importing the app bound a database'
+print(elapsed)
+'''
+
+def test_import_needs_no_configuration():
+    # a MySQL configuration without a port used to crash the import
+    env = dict(os.environ, DATABASE_ENGINE='mysql', DATABASE_DEV_PORT='', PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run([sys.executable, '-c', IMPORT_APP], env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert float(result.stdout) < IMPORT_BUDGET
+
+def test_create_app_binds_without_connecting(tmp_path, monkeypatch):
+    from models import database
+
+    bound = database.obj
+    monkeypatch.setattr(app_module, '_app', app_module._app)
+    try:
+        app = app_module.create_app({'DATABASE_ENGINE': 'sqlite', 'DATABASE_SQLITE_PATH': str(tmp_path / 'app.db')})
+        assert database.database == str(tmp_path / 'app.db')
+        assert database.is_closed()
+        assert not (tmp_path / 'app.db').exists()
+        assert '/api/recipe' in {rule.rule for rule in app.url_map.iter_rules()}
+    finally:
+        database.initialize(bound)
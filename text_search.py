@@ -0,0 +1,109 @@
+from playhouse.mysql_ext import Match
+from playhouse.sqlite_ext import FTS5Model, RowIDField, SearchField
+
+from models import database, is_sqlite, Recipe
+
+
+class RecipeFTS(FTS5Model):
+    # SQLite FTS5 copy of Recipe.name and Recipe.description, keyed by recipe id
+    rowid = RowIDField()
+    name = SearchField()
+    description = SearchField()
+
+    class Meta:
+        database = database
+        table_name = 'recipe_fts'
+
+
+class TextIndex():
+    # Common interface of the recipe full-text indexes. The index is created and filled by
+    # migration 0003, this process only checks once that it exists.
+
+    def __init__(self):
+        self._ready = False
+
+    def ensure(self):
+        if not self._ready:
+            if not self.exists():
+                raise RuntimeError('The recipe full-text index is missing, run `python -m migrations`')
+            self._ready = True
+
+    def exists(self):
+        raise NotImplementedError
+
+    def index_recipes(self, recipes):
+        # recipes is a list of (id, name, description)
+        raise NotImplementedError
+
+    def remove_recipe(self, id_recipe):
+        raise NotImplementedError
+
+    def search(self, q, limit, offset=0):
+        # Return the ids of the recipes matching q, best match first
+        raise NotImplementedError
+
+
+class MySQLTextIndex(TextIndex):
+    # MySQL FULLTEXT index on recipe(name, description). InnoDB keeps it in sync with
+    # the table, so writes need no extra work.
+    index_name = 'recipe_fulltext'
+
+    def exists(self):
+        return any(index.name == self.index_name for index in database.get_indexes('recipe'))
+
+    def index_recipes(self, recipes):
+        pass
+
+    def remove_recipe(self, id_recipe):
+        pass
+
+    def search(self, q, limit, offset=0):
+        self.ensure()
+        match = Match((Recipe.name, Recipe.description), q, 'IN NATURAL LANGUAGE MODE')
+        query = Recipe.select(Recipe.id).where(match).order_by(match.desc(), Recipe.id).limit(limit).offset(offset)
+        return [id for id, in query.tuples()]
+
+
+class SqliteTextIndex(TextIndex):
+    # SQLite FTS5 table maintained by the recipe write handlers, ranked with bm25
+
+    def exists(self):
+        return RecipeFTS.table_exists()
+
+    def index_recipes(self, recipes):
+        self.ensure()
+        RecipeFTS.delete().where(RecipeFTS.rowid.in_([id for id, _, _ in recipes])).execute()
+        RecipeFTS.insert_many(recipes, fields=[RecipeFTS.rowid, RecipeFTS.name, RecipeFTS.description]).execute()
+
+    def remove_recipe(self, id_recipe):
+        self.ensure()
+        RecipeFTS.delete().where(RecipeFTS.rowid == id_recipe).execute()
+
+    def search(self, q, limit, offset=0):
+        self.ensure()
+        # Quote every term so user input can't break the FTS5 query syntax, and match any
+        # of them like MySQL's natural language mode does
+        terms = ' OR '.join('"{}"'.format(term.replace('"', '""')) for term in q.split())
+        query = (RecipeFTS
+                 .select(RecipeFTS.rowid)
+                 .where(RecipeFTS.match(terms))
+                 .order_by(RecipeFTS.bm25(), RecipeFTS.rowid)
+                 .limit(limit)
+                 .offset(offset))
+        return [id for id, in query.tuples()]
+
+
+class BoundTextIndex():
+    # The text index of the database bound to the models, chosen when it is first used
+    # because the database is only bound after the modules are imported
+
+    def __init__(self):
+        self._index = None
+
+    def __getattr__(self, name):
+        if self._index is None:
+            self._index = SqliteTextIndex() if is_sqlite() else MySQLTextIndex()
+        return getattr(self._index, name)
+
+
+text_index = BoundTextIndex()
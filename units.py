@@ -0,0 +1,34 @@
+# Units of RecipeBahan.satuan that can be converted, by lowercase name: (base unit, size in the base unit).
+# Quantities of a bahan written in units with the same base unit are added up in that unit.
+# Any other satuan, such as 'buah' or 'Secukupnya', is kept as it is.
+UNITS = {
+    'mg': ('gram', 0.001),
+    'g': ('gram', 1),
+    'gr': ('gram', 1),
+    'gram': ('gram', 1),
+    'ons': ('gram', 100),
+    'kg': ('gram', 1000),
+    'ml': ('ml', 1),
+    'l': ('ml', 1000),
+    'liter': ('ml', 1000),
+    'sdt': ('ml', 5),
+    'sdm': ('ml', 15),
+    'gelas': ('ml', 240),
+}
+
+
+def normalize(quantity, satuan):
+    # Convert a quantity to the base unit of its satuan, returns (quantity, satuan).
+    # MySQL sums are Decimal, which can't be multiplied by a float size, so converted quantities are floats.
+    unit = UNITS.get(satuan.strip().lower())
+    if unit is None:
+        return quantity, satuan
+    base, size = unit
+    return (float(quantity) * size if quantity is not None else None), base
+
+def number(quantity):
+    # Sums come back as int, float or Decimal depending on the database, whole numbers are returned as int
+    if quantity is None:
+        return None
+    quantity = round(float(quantity), 6)
+    return int(quantity) if quantity.is_integer() else quantity